@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应并发控制与退避重试
+- AIMDController: 吞吐量持续提升时逐步加并发，出现限流/5xx或延迟飙升时成倍减并发
+- call_with_retry: 可重试错误使用带抖动的指数退避（full jitter）
+- run_adaptive: 按控制器给出的并发上限分批提交任务
+"""
+
+import time
+import random
+import statistics
+import concurrent.futures
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# R2/S3 表示"稍后再试"的错误码
+RETRYABLE_CODES = {
+    'SlowDown',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequests',
+    'RequestTimeout',
+    'InternalError',
+    'ServiceUnavailable',
+}
+NETWORK_ERRORS = (
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def is_retryable_error(error):
+    """限流、5xx和网络错误可以重试，其余（权限、参数错误等）直接失败"""
+    # upload_file 把底层的 ClientError 包成 S3UploadFailedError（boto3.exceptions，
+    # 这里按类名判断以免启动时导入 boto3），按原始错误判断
+    if type(error).__name__ == 'S3UploadFailedError':
+        cause = error.__cause__ or error.__context__
+        return cause is not None and is_retryable_error(cause)
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in RETRYABLE_CODES or status == 429 or status >= 500
+    return isinstance(error, NETWORK_ERRORS)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """第 attempt 次重试前的等待时间（full jitter）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retry(fn, max_retries=DEFAULT_RETRIES, label=''):
+    """
+    调用 fn()，遇到可重试错误时退避重试
+    返回 (fn的返回值, 重试次数)；不可重试或重试耗尽时抛出最后一次的异常
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(), attempt
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            delay = backoff_delay(attempt)
+            attempt += 1
+            print(f"  ⚠️  {label} 第 {attempt} 次重试，等待 {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+class AIMDController:
+    """
+    加性增、乘性减的并发控制器
+    只在提交任务的主线程中调用 record()，无需加锁
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32,
+                 decrease_factor=0.5, latency_factor=2.0, min_improvement=0.05):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.min_improvement = min_improvement
+
+        self.best_throughput = 0.0
+        self.baseline_latency = None
+        # 上一次降并发的时间；在此之前发出的请求的失败不再重复降
+        self.last_decrease = float('-inf')
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.window_bytes = 0
+        self.window_latencies = []
+
+    def _decrease(self, reason):
+        new_limit = max(self.minimum, int(self.limit * self.decrease_factor))
+        if new_limit != self.limit:
+            print(f"  🔽 并发 {self.limit} -> {new_limit}（{reason}）")
+        self.limit = new_limit
+        self.last_decrease = time.monotonic()
+        # 降低并发后重新测量吞吐量基准
+        self.best_throughput = 0.0
+        self._reset_window()
+
+    def record(self, success, latency, nbytes=0, retries=0):
+        """记录一个任务的结果，必要时调整并发上限"""
+        if not success or retries:
+            # 失败或经历过重试都视为拥塞信号；同一波拥塞中在降并发之前就已发出的请求
+            # 随后陆续失败，只按第一个降一次
+            if time.monotonic() - latency >= self.last_decrease:
+                self._decrease('出现错误或限流')
+            return
+
+        self.window_count += 1
+        self.window_bytes += nbytes
+        self.window_latencies.append(latency)
+
+        # 每完成约一轮（当前并发数个任务）评估一次
+        if self.window_count < max(self.limit, 4):
+            return
+
+        elapsed = max(time.monotonic() - self.window_start, 1e-6)
+        throughput = self.window_bytes / elapsed if self.window_bytes else self.window_count / elapsed
+        median_latency = statistics.median(self.window_latencies)
+
+        if self.baseline_latency is None or median_latency < self.baseline_latency:
+            self.baseline_latency = median_latency
+
+        if median_latency > self.baseline_latency * self.latency_factor and \
+                throughput <= self.best_throughput:
+            self._decrease(f'延迟上升到 {median_latency:.2f}s')
+            return
+
+        if throughput > self.best_throughput * (1 + self.min_improvement):
+            self.best_throughput = throughput
+            if self.limit < self.maximum:
+                self.limit += 1
+
+        self._reset_window()
+
+
+def run_adaptive(items, submit, controller, on_result, describe=None):
+    """
+    按 controller.limit 控制在途任务数，逐个提交 items
+    submit(item) 返回 Future；describe(result) 返回 (是否成功, 耗时, 字节数, 重试次数)
+    on_result 在调用线程中按完成顺序回调
+    """
+    pending = set()
+    items = iter(items)
+    exhausted = False
+
+    while True:
+        while not exhausted and len(pending) < controller.limit:
+            item = next(items, None)
+            if item is None:
+                exhausted = True
+                break
+            pending.add(submit(item))
+
+        if not pending:
+            break
+
+        finished, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in finished:
+            result = future.result()
+            if describe:
+                controller.record(*describe(result))
+            on_result(result)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态资源扫描器
+一次 os.scandir 遍历即可评估整套上传规则（扩展名、大小范围、包含/排除通配），
+并按 .r2ignore（gitignore 语法）提前剪掉排除目录，不再逐个扩展名重复遍历
+
+用法:
+    python3 scripts/asset_scanner.py [base_dir] > files_to_upload.txt
+"""
+
+import os
+import re
+import sys
+import stat
+import posixpath
+
+IGNORE_FILENAME = '.r2ignore'
+
+# 无论有没有 .r2ignore 都不会进入的目录
+DEFAULT_IGNORES = [
+    '.git/',
+    'node_modules/',
+    'exampleSite/',
+]
+
+# 与 hugo_r2_sync 同步范围一致的静态资源类型
+STATIC_ASSET_RULES = [
+    {'name': 'pdf', 'ext': ['.pdf']},
+    {'name': 'image', 'ext': ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.ico']},
+    {'name': 'font', 'ext': ['.woff', '.woff2', '.ttf', '.eot']},
+    {'name': 'media', 'ext': ['.mp3', '.mp4', '.wav', '.ogg']},
+]
+
+
+def glob_to_regex(pattern):
+    """把 gitignore 风格的通配模式转换为正则（不含锚定逻辑）"""
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i + 3] == '**/':
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern[i:i + 2] == '**':
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j == -1:
+                out.append('\\[')
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def compile_pattern(pattern):
+    """
+    编译一条 gitignore 风格模式，返回 (正则, 是否取反, 是否只匹配目录)
+    含 '/' 的模式相对所在目录锚定，否则匹配任意层级的文件名
+    """
+    negate = pattern.startswith('!')
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = glob_to_regex(pattern)
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return re.compile(f'^{regex}$'), negate, dir_only
+
+
+class IgnoreSpec:
+    """一个目录下的忽略规则（来自 .r2ignore 或默认值）"""
+
+    def __init__(self, patterns, base_rel=''):
+        self.base_rel = base_rel
+        self.patterns = [compile_pattern(p) for p in patterns]
+
+    @classmethod
+    def from_file(cls, path, base_rel=''):
+        patterns = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n').rstrip()
+                if line and not line.startswith('#'):
+                    patterns.append(line)
+        return cls(patterns, base_rel)
+
+    def match(self, rel_path, is_dir):
+        """返回 True(忽略) / False(显式取消忽略) / None(未命中)"""
+        if self.base_rel:
+            if not rel_path.startswith(self.base_rel + '/'):
+                return None
+            rel_path = rel_path[len(self.base_rel) + 1:]
+
+        result = None
+        for regex, negate, dir_only in self.patterns:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                result = not negate
+        return result
+
+
+def is_ignored(specs, rel_path, is_dir):
+    """按从外到内的顺序应用忽略规则，后出现的规则优先"""
+    ignored = False
+    for spec in specs:
+        result = spec.match(rel_path, is_dir)
+        if result is not None:
+            ignored = result
+    return ignored
+
+
+class RuleSet:
+    """
+    编译后的上传规则集合
+    每条规则是一个字典: name, ext, min_size, max_size, include, exclude
+    文件按顺序命中第一条满足条件的规则
+    """
+
+    def __init__(self, rules):
+        self.rules = []
+        self.by_ext = {}
+        self.any_ext = []
+
+        for index, rule in enumerate(rules):
+            compiled = {
+                'index': index,
+                'name': rule.get('name', f'rule{index}'),
+                'min_size': rule.get('min_size', 0),
+                'max_size': rule.get('max_size'),
+                'include': [compile_pattern(p)[0] for p in rule.get('include', [])],
+                'exclude': [compile_pattern(p)[0] for p in rule.get('exclude', [])],
+                'rule': rule,
+            }
+            self.rules.append(compiled)
+
+            exts = rule.get('ext')
+            if exts:
+                for ext in exts:
+                    self.by_ext.setdefault(ext.lower(), []).append(compiled)
+            else:
+                self.any_ext.append(compiled)
+
+        # 合并后按原顺序排列，保证"第一条命中"的语义
+        for ext, ext_rules in self.by_ext.items():
+            self.by_ext[ext] = sorted(ext_rules + self.any_ext, key=lambda r: r['index'])
+
+    def candidates(self, name):
+        """只根据文件名筛出可能命中的规则，避免对无关文件调用 stat"""
+        ext = os.path.splitext(name)[1].lower()
+        return self.by_ext.get(ext, self.any_ext)
+
+    @staticmethod
+    def matches(compiled, rel_path, size):
+        if size < compiled['min_size']:
+            return False
+        if compiled['max_size'] is not None and size > compiled['max_size']:
+            return False
+        if compiled['include'] and not any(r.match(rel_path) for r in compiled['include']):
+            return False
+        if any(r.match(rel_path) for r in compiled['exclude']):
+            return False
+        return True
+
+
+def root_ignore_specs(base_dir, extra_ignores=None):
+    """默认忽略规则加上 base_dir/.r2ignore"""
+    specs = [IgnoreSpec(DEFAULT_IGNORES + list(extra_ignores or []))]
+    root_ignore = os.path.join(base_dir, IGNORE_FILENAME)
+    if os.path.isfile(root_ignore):
+        specs.append(IgnoreSpec.from_file(root_ignore))
+    return specs
+
+
+def dir_ignore_specs(base_dir, rel_dir, extra_ignores=None, cache=None):
+    """
+    rel_dir 目录下生效的忽略规则（逐层叠加各级 .r2ignore），
+    目录本身或任何上级目录被忽略时返回 None；cache 字典可在多次调用间复用
+    """
+    cache = {} if cache is None else cache
+    if rel_dir in cache:
+        return cache[rel_dir]
+
+    if not rel_dir:
+        specs = root_ignore_specs(base_dir, extra_ignores)
+    else:
+        parent = dir_ignore_specs(base_dir, posixpath.dirname(rel_dir), extra_ignores, cache)
+        if parent is None or is_ignored(parent, rel_dir, True):
+            specs = None
+        else:
+            specs = parent
+            nested_ignore = os.path.join(base_dir, rel_dir, IGNORE_FILENAME)
+            if os.path.isfile(nested_ignore):
+                specs = parent + [IgnoreSpec.from_file(nested_ignore, rel_dir)]
+
+    cache[rel_dir] = specs
+    return specs
+
+
+def match_path(base_dir, rel_path, rules=STATIC_ASSET_RULES, extra_ignores=None, cache=None):
+    """
+    判断单个文件是否会被 scan 产出（用于处理文件系统事件，不必重新遍历目录）
+    命中时返回与 scan 相同的字典，否则（含文件已不存在）返回 None
+    """
+    ruleset = rules if isinstance(rules, RuleSet) else RuleSet(rules)
+    base_dir = os.path.abspath(base_dir)
+    name = posixpath.basename(rel_path)
+
+    candidates = ruleset.candidates(name)
+    if not candidates or name == IGNORE_FILENAME:
+        return None
+    specs = dir_ignore_specs(base_dir, posixpath.dirname(rel_path), extra_ignores, cache)
+    if specs is None or is_ignored(specs, rel_path, False):
+        return None
+
+    path = os.path.join(base_dir, rel_path)
+    try:
+        st = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    for compiled in candidates:
+        if RuleSet.matches(compiled, rel_path, st.st_size):
+            return {
+                'path': path,
+                'rel_path': rel_path,
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'inode': (st.st_dev, st.st_ino),
+                'rule': compiled['rule'],
+            }
+    return None
+
+
+def scan(base_dir, rules=STATIC_ASSET_RULES, subdirs=None, extra_ignores=None):
+    """
+    单次遍历 base_dir（或其中的 subdirs），逐个产出命中规则的文件:
+    {'path', 'rel_path', 'size', 'mtime', 'inode', 'rule'}
+    rel_path 相对 base_dir；inode 为 (st_dev, st_ino)，硬链接的文件相同，.r2ignore 也从 base_dir 开始逐层读取
+    """
+    ruleset = rules if isinstance(rules, RuleSet) else RuleSet(rules)
+    base_dir = os.path.abspath(base_dir)
+    root_specs = root_ignore_specs(base_dir, extra_ignores)
+
+    if subdirs:
+        stack = []
+        for subdir in reversed(subdirs):
+            rel = subdir.strip('/')
+            if os.path.isdir(os.path.join(base_dir, rel)) and not is_ignored(root_specs, rel, True):
+                stack.append((rel, root_specs))
+    else:
+        stack = [('', root_specs)]
+
+    while stack:
+        rel_dir, specs = stack.pop()
+        abs_dir = os.path.join(base_dir, rel_dir) if rel_dir else base_dir
+
+        if rel_dir:
+            nested_ignore = os.path.join(abs_dir, IGNORE_FILENAME)
+            if os.path.isfile(nested_ignore):
+                specs = specs + [IgnoreSpec.from_file(nested_ignore, rel_dir)]
+
+        try:
+            entries = sorted(os.scandir(abs_dir), key=lambda e: e.name)
+        except OSError as e:
+            print(f"⚠️  无法读取目录 {abs_dir}: {e}", file=sys.stderr)
+            continue
+
+        subdirs_found = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+
+            if entry.is_dir(follow_symlinks=False):
+                # 排除的目录直接剪枝，不会进入
+                if not is_ignored(specs, rel_path, True):
+                    subdirs_found.append((rel_path, specs))
+                continue
+
+            if not entry.is_file():
+                continue
+
+            candidates = ruleset.candidates(entry.name)
+            if not candidates or entry.name == IGNORE_FILENAME:
+                continue
+            if is_ignored(specs, rel_path, False):
+                continue
+
+            st = entry.stat()
+            for compiled in candidates:
+                if RuleSet.matches(compiled, rel_path, st.st_size):
+                    yield {
+                        'path': entry.path,
+                        'rel_path': rel_path,
+                        'size': st.st_size,
+                        'mtime': st.st_mtime,
+                        'inode': (st.st_dev, st.st_ino),
+                        'rule': compiled['rule'],
+                    }
+                    break
+
+        stack.extend(reversed(subdirs_found))
+
+
+def main():
+    """列出需要上传的文件（可重定向生成 files_to_upload.txt）"""
+    base_dir = sys.argv[1] if len(sys.argv) > 1 else '/var/www/cuhkstudy'
+    count = 0
+    for item in scan(base_dir):
+        print(item['path'])
+        count += 1
+    print(f"📁 共 {count} 个文件", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传路径基准测试
+在本机启动一个S3兼容服务（有 minio 命令时用 MinIO，否则用 moto server），
+生成合成文件树，依次用各条上传路径上传，记录 文件/s、MB/s、峰值RSS 和耗时，
+写入可以前后对比的JSON报告，不需要网络也能验证优化效果
+
+文件树（固定随机种子，内容可复现；生成一次后在工作目录中复用）:
+    icons        2000 个 1-8KB 小图标
+    big-pdfs     3 个 100MB PDF
+    mixed-1k     1000 个文件的混合树：以小图片为主，少量中等图片、字体和PDF，夹杂不上传的HTML
+    mixed-10k    同上，1万个文件
+    mixed-100k   同上，10万个文件（约4GB，只在 --trees 中显式指定时运行）
+
+上传路径:
+    upload_to_r2          upload_to_r2.py --files 列表 --base-dir 文件树
+    optimized_cdn         optimized_cdn_upload.upload_large_files_only（不做图片优化）
+    hugo_r2_sync          sync_to_r2 首次同步（同步清单为空）
+    hugo_r2_sync-noop     紧接着再同步一次，全部文件未变
+    r2_cleanup_optimize   find_large_files + 去重 + upload_optimized_files
+
+每次运行都在独立子进程中进行，峰值RSS由子进程自己读取 VmHWM（wait4 的 ru_maxrss 会继承父进程的值）；开始前清空存储桶、清单和哈希缓存，
+结束后列出存储桶，按实际上传的对象数和字节数计算速率
+
+--bwlimit 时各上传路径在限速下运行，并检查实际速率（上传字节数 / 耗时）不超过上限的 LIMIT_TOLERANCE 倍，
+超出说明有字节绕过了限速器，该次运行记为失败
+
+用法:
+    python3 scripts/benchmark_uploads.py [--trees icons mixed-1k] [--paths upload_to_r2 hugo_r2_sync]
+    python3 scripts/benchmark_uploads.py --trees mixed-1k --paths upload_to_r2 --bwlimit 2MB
+    python3 scripts/benchmark_uploads.py --endpoint http://127.0.0.1:9000   # 使用已运行的S3兼容服务
+    python3 scripts/benchmark_uploads.py --compare before.json after.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import platform
+import resource
+import subprocess
+
+KB = 1024
+MB = 1024 * 1024
+
+DEFAULT_WORK_DIR = '/tmp/cuhkstudy-bench'
+DEFAULT_REPORT_PATH = 'benchmark_report.json'
+REPORT_VERSION = 1
+TREE_VERSION = 1
+
+BENCH_BUCKET = 'bench'
+BENCH_ACCESS_KEY = 'benchadmin'
+BENCH_SECRET_KEY = 'benchadmin-secret'
+
+# (占比, 最小字节, 最大字节, 子目录, 扩展名)
+MIXED = [
+    (0.70, 1 * KB, 16 * KB, 'images', '.png'),
+    (0.15, 16 * KB, 256 * KB, 'photos', '.jpg'),
+    (0.04, 4 * KB, 64 * KB, 'fonts', '.woff2'),
+    (0.002, 1 * MB, 8 * MB, 'pdfs', '.pdf'),
+    (0.108, 2 * KB, 32 * KB, 'pages', '.html'),
+]
+
+TREES = {
+    'icons': {'count': 2000, 'mix': [(1.0, 1 * KB, 8 * KB, 'icons', '.png')]},
+    'big-pdfs': {'count': 3, 'mix': [(1.0, 100 * MB, 100 * MB, 'pdfs', '.pdf')]},
+    'mixed-1k': {'count': 1000, 'mix': MIXED},
+    'mixed-10k': {'count': 10000, 'mix': MIXED},
+    'mixed-100k': {'count': 100000, 'mix': MIXED},
+}
+DEFAULT_TREES = ['icons', 'big-pdfs', 'mixed-1k', 'mixed-10k']
+
+PATHS = ['upload_to_r2', 'optimized_cdn', 'hugo_r2_sync', 'hugo_r2_sync-noop', 'r2_cleanup_optimize']
+
+FILES_PER_DIR = 100
+CHILD_RESULT = 'child_result.json'
+
+# --bwlimit 时实际速率允许超出上限的比例（令牌桶的突发额度）
+LIMIT_TOLERANCE = 1.1
+POOL_SIZE = 8 * MB
+
+MAGIC = {
+    '.png': b'\x89PNG\r\n\x1a\n',
+    '.jpg': b'\xff\xd8\xff\xe0',
+    '.woff2': b'wOF2',
+    '.pdf': b'%PDF-1.7\n',
+    '.html': b'<!DOCTYPE html>\n',
+}
+
+
+def write_file(path, size, header, pool, rng):
+    """写入 size 字节：文件头 + 序号，其余从随机池中按随机偏移截取（内容互不相同）"""
+    with open(path, 'wb') as f:
+        f.write(header[:size])
+        remaining = size - min(size, len(header))
+        while remaining > 0:
+            length = min(remaining, len(pool) // 2)
+            offset = rng.randrange(0, len(pool) - length + 1)
+            f.write(pool[offset:offset + length])
+            remaining -= length
+
+
+def generate_tree(name, work_dir):
+    """生成（或复用）一棵合成文件树，返回树根目录"""
+    spec = TREES[name]
+    tree_dir = os.path.join(work_dir, 'trees', name)
+    marker = os.path.join(tree_dir, '.bench_tree.json')
+    stamp = {'version': TREE_VERSION, 'count': spec['count'], 'mix': spec['mix']}
+    try:
+        with open(marker, 'r', encoding='utf-8') as f:
+            if json.load(f) == json.loads(json.dumps(stamp)):
+                return tree_dir
+    except (OSError, ValueError):
+        pass
+
+    print(f"🧱 生成文件树 {name}（{spec['count']} 个文件）...")
+    shutil.rmtree(tree_dir, ignore_errors=True)
+    rng = random.Random(f"{name}-{TREE_VERSION}")
+    pool = rng.randbytes(POOL_SIZE)
+
+    weights = [share for share, *_ in spec['mix']]
+    counters = {}
+    for index in range(spec['count']):
+        _, low, high, subdir, ext = rng.choices(spec['mix'], weights)[0]
+        n = counters.get(subdir, 0)
+        counters[subdir] = n + 1
+        dir_path = os.path.join(tree_dir, 'public', subdir, f"{n // FILES_PER_DIR:04d}")
+        os.makedirs(dir_path, exist_ok=True)
+        header = MAGIC[ext] + f"{name}:{index}\n".encode()
+        write_file(os.path.join(dir_path, f"{subdir}-{n:06d}{ext}"),
+                   rng.randint(low, high), header, pool, rng)
+
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(stamp, f)
+    return tree_dir
+
+
+def tree_stats(tree_dir):
+    """文件总数/字节数，以及其中会被同步的静态资源数/字节数"""
+    from asset_scanner import scan, STATIC_ASSET_RULES
+
+    files = total = 0
+    for root, _, names in os.walk(os.path.join(tree_dir, 'public')):
+        for name in names:
+            files += 1
+            total += os.path.getsize(os.path.join(root, name))
+    assets = list(scan(tree_dir, STATIC_ASSET_RULES, subdirs=['public']))
+    return {'files': files, 'bytes': total,
+            'assets': len(assets), 'asset_bytes': sum(item['size'] for item in assets)}, assets
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(work_dir):
+    """启动本地S3兼容服务，返回 (进程, 地址, 名称)"""
+    port = free_port()
+    env = dict(os.environ)
+    if shutil.which('minio'):
+        data_dir = os.path.join(work_dir, 'minio-data')
+        os.makedirs(data_dir, exist_ok=True)
+        env.update(MINIO_ROOT_USER=BENCH_ACCESS_KEY, MINIO_ROOT_PASSWORD=BENCH_SECRET_KEY,
+                   MINIO_SITE_REGION='auto')
+        cmd = ['minio', 'server', data_dir, '--address', f'127.0.0.1:{port}', '--quiet']
+        name = 'minio'
+    else:
+        cmd = [sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)]
+        name = 'moto'
+
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{name} 启动失败（moto 需要 pip install 'moto[server]'）")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return proc, f"http://127.0.0.1:{port}", name
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"{name} 30秒内未就绪")
+
+
+def bench_env(endpoint, state_dir, bwlimit=''):
+    """子进程环境：指向本地服务，清单、缓存都放在状态目录中，默认不限速"""
+    env = dict(os.environ)
+    env.update(
+        R2_ENDPOINT=endpoint,
+        R2_BUCKET=BENCH_BUCKET,
+        R2_ADMIN_ACCESS_KEY=BENCH_ACCESS_KEY,
+        R2_ADMIN_SECRET_KEY=BENCH_SECRET_KEY,
+        R2_PUBLIC_URL=f"{endpoint}/{BENCH_BUCKET}",
+        R2_SYNC_MANIFEST=os.path.join(state_dir, 'manifest.json'),
+        R2_HASH_CACHE=os.path.join(state_dir, 'hash_cache.sqlite'),
+        R2_INVENTORY=os.path.join(state_dir, 'inventory.sqlite'),
+        R2_BWLIMIT=bwlimit or '',
+        R2_BW_SCHEDULE='',
+    )
+    return env
+
+
+def empty_bucket(client):
+    """删除存储桶中的全部对象（不存在时创建）"""
+    from r2_diff import list_remote_objects
+    from r2_uploader import delete_keys
+
+    try:
+        client.head_bucket(Bucket=BENCH_BUCKET)
+    except Exception:
+        # 客户端区域为 auto（与R2一致），建桶时需要显式给出
+        client.create_bucket(Bucket=BENCH_BUCKET, CreateBucketConfiguration={
+            'LocationConstraint': client.meta.region_name})
+        return
+    keys = (obj['key'] for obj in list_remote_objects(client, BENCH_BUCKET))
+    delete_keys(keys, BENCH_BUCKET)
+
+
+def bucket_totals(client):
+    from r2_diff import list_remote_objects
+
+    count = total = 0
+    for obj in list_remote_objects(client, BENCH_BUCKET):
+        count += 1
+        total += obj['size']
+    return count, total
+
+
+def run_child(path, tree_dir, state_dir):
+    """在子进程中执行一条上传路径，返回退出码"""
+    if path == 'upload_to_r2':
+        import upload_to_r2
+        sys.argv = ['upload_to_r2.py', '--files', os.path.join(state_dir, 'files.txt'),
+                    '--base-dir', tree_dir, '--journal', os.path.join(state_dir, 'journal.jsonl')]
+        upload_to_r2.main()
+        return 0
+
+    if path == 'optimized_cdn':
+        from optimized_cdn_upload import upload_large_files_only
+        upload_large_files_only(optimize=False, base_path=os.path.join(tree_dir, 'public'))
+        return 0
+
+    if path in ('hugo_r2_sync', 'hugo_r2_sync-noop'):
+        from hugo_r2_sync import sync_to_r2
+        ok = sync_to_r2(manifest_path=os.path.join(state_dir, 'manifest.json'), base_dir=tree_dir)
+        return 0 if ok else 1
+
+    if path == 'r2_cleanup_optimize':
+        import r2_cleanup_optimize as cleanup
+        large_files, duplicates = cleanup.find_large_files(tree_dir)
+        upload_list = cleanup.create_optimized_upload_list(large_files, duplicates)
+        return 0 if cleanup.upload_optimized_files(upload_list) else 1
+
+    raise ValueError(f"未知的上传路径: {path}")
+
+
+def peak_rss_kb():
+    """
+    当前进程的峰值RSS（KB）
+    fork 出的子进程会继承父进程的 ru_maxrss，所以在子进程内读取 VmHWM（exec 后重新计数），
+    再与它自己等待过的子进程（哈希进程池等）取最大值
+    """
+    own = None
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    own = int(line.split()[1])
+                    break
+    except OSError:
+        pass
+    if own is None:
+        # 没有 /proc（macOS）时退回 ru_maxrss，单位为字节
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        own = own // 1024 if sys.platform == 'darwin' else own
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    children = children // 1024 if sys.platform == 'darwin' else children
+    return max(own, children)
+
+
+def child_main(path, tree_dir, state_dir):
+    """子进程入口：运行上传路径，并把峰值RSS写入状态目录供父进程读取"""
+    try:
+        code = run_child(path, tree_dir, state_dir)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    with open(os.path.join(state_dir, CHILD_RESULT), 'w', encoding='utf-8') as f:
+        json.dump({'peak_rss_kb': peak_rss_kb()}, f)
+    return code
+
+
+def run_one(path, tree_name, tree_dir, stats, assets, state_dir, endpoint, client, log_dir,
+            bwlimit=None):
+    """运行一次并测量，返回结果字典；bwlimit 时 limit_ratio 为实际速率与上限之比"""
+    noop = path.endswith('-noop')
+    if not noop:
+        # 每条路径从空存储桶、空清单、冷哈希缓存开始
+        empty_bucket(client)
+        shutil.rmtree(state_dir, ignore_errors=True)
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, 'files.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(item['path'] + '\n' for item in assets)
+    before_count, before_bytes = bucket_totals(client) if noop else (0, 0)
+
+    result_path = os.path.join(state_dir, CHILD_RESULT)
+    if os.path.exists(result_path):
+        os.remove(result_path)
+
+    log_path = os.path.join(log_dir, f"{tree_name}.{path}.log")
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', path,
+           '--tree-dir', tree_dir, '--state-dir', state_dir]
+    started = time.monotonic()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        proc = subprocess.Popen(cmd, cwd=state_dir, env=bench_env(endpoint, state_dir, bwlimit),
+                                stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.monotonic() - started
+    exit_code = os.waitstatus_to_exitcode(status)
+    try:
+        with open(result_path, 'r', encoding='utf-8') as f:
+            rss_kb = json.load(f)['peak_rss_kb']
+    except (OSError, ValueError, KeyError):
+        # 子进程异常退出时只有 wait4 的值（含从父进程继承的部分，偏大）
+        rss_kb = usage.ru_maxrss
+
+    count, total = bucket_totals(client)
+    uploaded, uploaded_bytes = count - before_count, total - before_bytes
+    # 无变更的同步没有上传，速率按检查过的文件数计算
+    processed = stats['assets'] if noop else uploaded
+    from rate_limiter import parse_rate
+    limit = parse_rate(bwlimit)
+    if limit and wall:
+        limit_ratio = round(uploaded_bytes / wall / limit, 3)
+        if limit_ratio > LIMIT_TOLERANCE and exit_code == 0:
+            exit_code = 1
+    else:
+        limit_ratio = None
+    return {
+        'tree': tree_name,
+        'path': path,
+        'exit_code': exit_code,
+        'wall_seconds': round(wall, 3),
+        'uploaded_files': uploaded,
+        'uploaded_bytes': uploaded_bytes,
+        'files_per_s': round(processed / wall, 1) if wall else 0.0,
+        'rate_basis': 'checked' if noop else 'uploaded',
+        'mb_per_s': round(uploaded_bytes / MB / wall, 2) if wall else 0.0,
+        'peak_rss_mb': round(rss_kb / 1024, 1),
+        'limit_ratio': limit_ratio,
+        'log': log_path,
+    }
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit or None,
+    }
+
+
+def print_table(results):
+    print(f"\n{'树':<12} {'路径':<22} {'耗时s':>8} {'文件/s':>9} {'MB/s':>8} {'RSS MB':>8} {'对象':>7}")
+    for r in results:
+        flag = '' if r['exit_code'] == 0 else ' ❌'
+        print(f"{r['tree']:<12} {r['path']:<22} {r['wall_seconds']:>8.2f} {r['files_per_s']:>9.1f} "
+              f"{r['mb_per_s']:>8.2f} {r['peak_rss_mb']:>8.1f} {r['uploaded_files']:>7}{flag}")
+
+
+def compare(before_path, after_path):
+    """对比两份报告中相同 (树, 路径) 的结果"""
+    with open(before_path, 'r', encoding='utf-8') as f:
+        before = {(r['tree'], r['path']): r for r in json.load(f)['results']}
+    with open(after_path, 'r', encoding='utf-8') as f:
+        after = json.load(f)['results']
+
+    print(f"{'树':<12} {'路径':<22} {'耗时s 前→后':>18} {'加速':>7} {'RSS MB 前→后':>18}")
+    for r in after:
+        old = before.get((r['tree'], r['path']))
+        if not old:
+            continue
+        speedup = old['wall_seconds'] / r['wall_seconds'] if r['wall_seconds'] else 0
+        print(f"{r['tree']:<12} {r['path']:<22} "
+              f"{old['wall_seconds']:>8.2f}→{r['wall_seconds']:<8.2f} {speedup:>6.2f}x "
+              f"{old['peak_rss_mb']:>8.1f}→{r['peak_rss_mb']:<8.1f}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地S3兼容服务上测试各上传路径的性能")
+    parser.add_argument('--trees', nargs='+', default=DEFAULT_TREES, choices=sorted(TREES))
+    parser.add_argument('--paths', nargs='+', default=PATHS, choices=PATHS)
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help='文件树、状态和日志目录')
+    parser.add_argument('--endpoint', default=None, help='使用已运行的S3兼容服务，不自动启动')
+    parser.add_argument('--report', default=DEFAULT_REPORT_PATH, help='JSON报告路径')
+    parser.add_argument('--bwlimit', default=None,
+                        help='在限速下运行并检查实际速率不超过上限，如 2MB（默认不限速）')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='对比两份报告')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--tree-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--state-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child_main(args.child, args.tree_dir, args.state_dir)
+    if args.compare:
+        return compare(*args.compare)
+
+    # noop 必须紧跟在首次同步之后
+    paths = list(args.paths)
+    if 'hugo_r2_sync-noop' in paths and 'hugo_r2_sync' not in paths:
+        paths.insert(paths.index('hugo_r2_sync-noop'), 'hugo_r2_sync')
+    paths.sort(key=PATHS.index)
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    log_dir = os.path.join(args.work_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    server = None
+    if args.endpoint:
+        endpoint, server_name = args.endpoint.rstrip('/'), args.endpoint
+    else:
+        server, endpoint, server_name = start_server(args.work_dir)
+    print(f"🪣 S3兼容服务: {server_name} ({endpoint})")
+
+    # 父进程也用同一套配置创建客户端，用于清空和统计存储桶
+    os.environ.update(bench_env(endpoint, os.path.join(args.work_dir, 'state')))
+    from r2_client import get_client
+    client = get_client()
+
+    report = {
+        'version': REPORT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'machine': machine_info(),
+        'server': server_name,
+        'trees': {},
+        'results': [],
+    }
+
+    try:
+        for tree_name in args.trees:
+            tree_dir = generate_tree(tree_name, args.work_dir)
+            stats, assets = tree_stats(tree_dir)
+            report['trees'][tree_name] = stats
+            print(f"\n🌲 {tree_name}: {stats['files']} 个文件 {stats['bytes'] / MB:.1f}MB，"
+                  f"其中静态资源 {stats['assets']} 个 {stats['asset_bytes'] / MB:.1f}MB")
+
+            state_dir = os.path.join(args.work_dir, 'state', tree_name)
+            for path in paths:
+                print(f"  ⏱️  {path} ...", end=' ', flush=True)
+                result = run_one(path, tree_name, tree_dir, stats, assets, state_dir,
+                                 endpoint, client, log_dir, args.bwlimit)
+                report['results'].append(result)
+                status = '✅' if result['exit_code'] == 0 else f"❌ 退出码 {result['exit_code']}"
+                print(f"{result['wall_seconds']:.2f}s，{result['files_per_s']:.1f} 文件/s，"
+                      f"{result['mb_per_s']:.2f} MB/s，RSS {result['peak_rss_mb']:.0f}MB {status}")
+                if result['limit_ratio'] is not None:
+                    print(f"     🚦 实际速率为上限的 {result['limit_ratio'] * 100:.0f}%"
+                          f"{'' if result['limit_ratio'] <= LIMIT_TOLERANCE else '，超出上限：有字节绕过了限速'}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print_table(report['results'])
+    print(f"\n📝 报告已写入: {args.report}（日志在 {log_dir}）")
+    return 0 if all(r['exit_code'] == 0 for r in report['results']) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
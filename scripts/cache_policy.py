@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache-Control 策略
+按 r2_cache_policy.conf 中的规则（gitignore 语法的模式 + Cache-Control 值，第一条命中的生效）
+决定每个R2对象的缓存头，所有上传脚本共用
+
+apply 子命令把策略应用到存储桶中已有的对象：逐个 HEAD 比较当前的 Cache-Control，
+不一致时用 CopyObject（复制到自身，MetadataDirective=REPLACE）只替换元数据，
+Content-Type、Content-Encoding 和自定义元数据原样保留，不重新上传任何内容。
+复制带 If-Match 条件，期间被重新上传的对象不会被旧内容覆盖
+
+可调环境变量:
+    R2_CACHE_POLICY     策略文件路径（默认仓库根目录的 r2_cache_policy.conf）
+
+用法:
+    python3 scripts/cache_policy.py show public/pdfs/map.pdf img/logo.png
+    python3 scripts/cache_policy.py apply [--prefix pdfs/] [--dry-run]
+"""
+
+import os
+import sys
+import argparse
+import threading
+import concurrent.futures
+
+from asset_scanner import compile_pattern
+from r2_client import REPO_ROOT
+
+DEFAULT_POLICY_PATH = os.getenv('R2_CACHE_POLICY', os.path.join(REPO_ROOT, 'r2_cache_policy.conf'))
+
+# 策略文件缺失或没有规则命中时使用
+FALLBACK_CACHE_CONTROL = 'public, max-age=86400'
+
+DEFAULT_APPLY_WORKERS = 16
+
+# CopyObject 单次最多复制 5GB，更大的对象需要分片复制，这里只报告不处理
+MAX_COPY_SIZE = 5 * 1024 ** 3
+
+# 替换元数据时需要原样带上的响应头 -> CopyObject 参数
+PRESERVED_HEADERS = ['ContentType', 'ContentEncoding', 'ContentDisposition', 'ContentLanguage',
+                     'Expires']
+
+
+class CachePolicy:
+    """编译后的策略规则，lookup(key) 返回对象应有的 Cache-Control"""
+
+    def __init__(self, rules=None, default=FALLBACK_CACHE_CONTROL):
+        # [(模式原文, 正则, Cache-Control)]
+        self.rules = []
+        for pattern, value in rules or []:
+            regex, negate, _ = compile_pattern(pattern)
+            if negate:
+                raise ValueError(f"策略模式不支持 ! 取反: {pattern}")
+            self.rules.append((pattern, regex, value))
+        self.default = default
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_POLICY_PATH):
+        """读取策略文件：每行 模式 + 空白 + Cache-Control，# 开头为注释"""
+        rules = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split(None, 1)
+                if len(parts) != 2:
+                    raise ValueError(f"{path}:{number} 缺少 Cache-Control 值: {line}")
+                rules.append((parts[0], parts[1].strip()))
+        return cls(rules)
+
+    def match(self, key):
+        """返回 (命中的模式或 None, Cache-Control)"""
+        key = key.lstrip('/')
+        for pattern, regex, value in self.rules:
+            if regex.match(key):
+                return pattern, value
+        return None, self.default
+
+    def lookup(self, key):
+        return self.match(key)[1]
+
+
+_shared_policy = None
+_shared_lock = threading.Lock()
+
+
+def load_policy(path=None):
+    """读取策略文件；文件不存在时提示一次并全部使用默认值"""
+    path = path or DEFAULT_POLICY_PATH
+    if not os.path.exists(path):
+        print(f"⚠️  缓存策略文件不存在: {path}，所有对象使用 {FALLBACK_CACHE_CONTROL}")
+        return CachePolicy()
+    return CachePolicy.from_file(path)
+
+
+def shared_policy():
+    """进程内共享的策略（首次使用时读取）"""
+    global _shared_policy
+    if _shared_policy is None:
+        with _shared_lock:
+            if _shared_policy is None:
+                _shared_policy = load_policy()
+    return _shared_policy
+
+
+def cache_control_for(key):
+    """上传对象 key 时应设置的 Cache-Control"""
+    return shared_policy().lookup(key)
+
+
+def copy_args(head, cache_control):
+    """根据 HeadObject 结果构造替换元数据所需的 CopyObject 参数"""
+    args = {'CacheControl': cache_control, 'Metadata': head.get('Metadata', {})}
+    for name in PRESERVED_HEADERS:
+        if head.get(name):
+            args[name] = head[name]
+    return args
+
+
+def update_object(client, bucket, key, policy, dry_run=False, acl=None):
+    """
+    检查一个对象，必要时只替换元数据
+    返回 (状态, 原 Cache-Control, 目标 Cache-Control)，状态为
+    unchanged / updated / would-update / too-large / changed（复制期间对象被替换）
+    """
+    from botocore.exceptions import ClientError
+    from adaptive_concurrency import call_with_retry
+
+    wanted = policy.lookup(key)
+    head, _ = call_with_retry(lambda: client.head_object(Bucket=bucket, Key=key), label=key)
+    current = head.get('CacheControl')
+    if current == wanted:
+        return 'unchanged', current, wanted
+    if head.get('ContentLength', 0) > MAX_COPY_SIZE:
+        return 'too-large', current, wanted
+    if dry_run:
+        return 'would-update', current, wanted
+
+    extra = copy_args(head, wanted)
+    if acl:
+        extra['ACL'] = acl
+    try:
+        call_with_retry(lambda: client.copy_object(
+            Bucket=bucket,
+            Key=key,
+            CopySource={'Bucket': bucket, 'Key': key},
+            CopySourceIfMatch=head['ETag'],
+            MetadataDirective='REPLACE',
+            **extra
+        ), label=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'PreconditionFailed':
+            return 'changed', current, wanted
+        raise
+    return 'updated', current, wanted
+
+
+def apply_policy(policy, bucket, prefix='', dry_run=False, workers=DEFAULT_APPLY_WORKERS):
+    """把策略应用到存储桶中 prefix 下的所有对象，返回 {状态: 数量}"""
+    from r2_client import get_client
+    from r2_diff import list_remote_objects
+    from r2_uploader import iter_batches, DEFAULT_ACL
+
+    # HEAD 和复制都由 call_with_retry 重试
+    client = get_client(retries=False)
+    counts = {}
+
+    def check(key):
+        try:
+            return key, update_object(client, bucket, key, policy, dry_run, DEFAULT_ACL), None
+        except Exception as e:
+            return key, None, str(e)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # 边列出边检查，不必先把整个存储桶读入内存
+        keys = (obj['key'] for obj in list_remote_objects(client, bucket, prefix))
+        for batch in iter_batches(keys, workers * 16):
+            for key, outcome, error in executor.map(check, batch):
+                if error:
+                    counts['failed'] = counts.get('failed', 0) + 1
+                    print(f"  ❌ {key}: {error}")
+                    continue
+                status, current, wanted = outcome
+                counts[status] = counts.get(status, 0) + 1
+                if status in ('updated', 'would-update'):
+                    print(f"  {'🔁' if status == 'updated' else '📝'} {key}: {current or '(无)'} -> {wanted}")
+                elif status == 'too-large':
+                    print(f"  ⚠️  {key}: 超过5GB，CopyObject 无法更新，需要重新上传")
+                elif status == 'changed':
+                    print(f"  ⚠️  {key}: 检查后对象被替换，已跳过（新上传的对象已按策略设置）")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按缓存策略设置R2对象的 Cache-Control")
+    parser.add_argument('--policy', default=DEFAULT_POLICY_PATH, help='策略文件路径')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    show = subparsers.add_parser('show', help='显示对象键命中的规则')
+    show.add_argument('keys', nargs='+')
+
+    apply = subparsers.add_parser('apply', help='只替换元数据，把策略应用到已有对象')
+    apply.add_argument('--prefix', default='', help='只处理该前缀下的对象')
+    apply.add_argument('--dry-run', action='store_true', help='只列出需要更新的对象')
+    apply.add_argument('--workers', type=int, default=DEFAULT_APPLY_WORKERS, help='并发请求数')
+    args = parser.parse_args()
+
+    try:
+        policy = load_policy(args.policy)
+    except (OSError, ValueError) as e:
+        print(f"❌ 无法读取缓存策略: {e}")
+        return 1
+
+    if args.command == 'show':
+        for key in args.keys:
+            pattern, value = policy.match(key)
+            print(f"{key}: {value}（{'规则 ' + pattern if pattern else '默认值'}）")
+        return 0
+
+    from r2_client import load_config
+
+    bucket = load_config()['bucket']
+    print(f"🗂️  检查 s3://{bucket}/{args.prefix} 下对象的 Cache-Control"
+          f"{'（试运行）' if args.dry_run else ''}...")
+    counts = apply_policy(policy, bucket, args.prefix, args.dry_run, args.workers)
+
+    print(f"\n📊 {sum(counts.values())} 个对象: {counts.get('unchanged', 0)} 个已符合策略，"
+          f"{counts.get('updated', counts.get('would-update', 0))} 个"
+          f"{'已更新' if not args.dry_run else '需要更新'}，"
+          f"{counts.get('failed', 0)} 个失败")
+    return 1 if counts.get('failed') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
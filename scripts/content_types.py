@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-Type 解析
+所有上传路径共用：先查扩展名表，扩展名缺失或不可靠时读取文件头魔数判断，
+结果按扩展名缓存，整个同步过程不再调用 file -b 子进程
+"""
+
+import os
+import mimetypes
+from functools import lru_cache
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+# 站点实际用到的类型，优先于系统 mimetypes 数据库（不同发行版结果不一致）
+EXTENSION_TYPES = {
+    # 文档
+    '.pdf': 'application/pdf',
+    '.html': 'text/html; charset=utf-8',
+    '.htm': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.mjs': 'text/javascript; charset=utf-8',
+    '.json': 'application/json',
+    '.map': 'application/json',
+    '.webmanifest': 'application/manifest+json',
+    '.xml': 'application/xml',
+    '.txt': 'text/plain; charset=utf-8',
+    '.md': 'text/markdown; charset=utf-8',
+    '.ftl': 'text/plain; charset=utf-8',
+    # 图片
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif',
+    '.svg': 'image/svg+xml',
+    '.ico': 'image/vnd.microsoft.icon',
+    # 字体
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.eot': 'application/vnd.ms-fontobject',
+    '.pfb': 'application/x-font-type1',
+    # 音视频
+    '.mp3': 'audio/mpeg',
+    '.mp4': 'video/mp4',
+    '.m4a': 'audio/mp4',
+    '.wav': 'audio/wav',
+    '.ogg': 'audio/ogg',
+    '.webm': 'video/webm',
+    # 预压缩文件按原始类型上传，编码由 Content-Encoding 表示
+    '.br': None,
+    '.gz': None,
+}
+
+# 这些扩展名不说明内容，需要读文件头
+AMBIGUOUS_EXTENSIONS = {'', '.bin', '.dat', '.tmp', '.download'}
+
+SNIFF_BYTES = 512
+
+
+def sniff_content_type(head):
+    """根据文件头魔数判断类型，无法识别时返回 None"""
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'audio/wav'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'avif', b'avis'):
+            return 'image/avif'
+        if brand.startswith(b'M4A'):
+            return 'audio/mp4'
+        return 'video/mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm'
+    if head.startswith(b'OggS'):
+        return 'audio/ogg'
+    if head.startswith(b'ID3') or head[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
+        return 'audio/mpeg'
+    if head.startswith(b'wOFF'):
+        return 'font/woff'
+    if head.startswith(b'wOF2'):
+        return 'font/woff2'
+    if head.startswith((b'\x00\x01\x00\x00', b'true')):
+        return 'font/ttf'
+    if head.startswith(b'OTTO'):
+        return 'font/otf'
+    if head.startswith(b'\x00\x00\x01\x00'):
+        return 'image/vnd.microsoft.icon'
+    if head.startswith(b'\x1f\x8b'):
+        return 'application/gzip'
+
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if text.startswith((b'<!doctype html', b'<html')):
+        return 'text/html; charset=utf-8'
+    if text.startswith(b'<svg') or (text.startswith(b'<?xml') and b'<svg' in text):
+        return 'image/svg+xml'
+    if text.startswith(b'<?xml'):
+        return 'application/xml'
+    if text.startswith((b'{', b'[')):
+        return 'application/json'
+    return None
+
+
+@lru_cache(maxsize=None)
+def content_type_for_extension(ext):
+    """按扩展名解析（已缓存），无法确定时返回 None"""
+    if ext in EXTENSION_TYPES:
+        return EXTENSION_TYPES[ext]
+    if ext in AMBIGUOUS_EXTENSIONS:
+        return None
+    return mimetypes.types_map.get(ext)
+
+
+def get_content_type(file_path):
+    """解析文件的 Content-Type"""
+    name = os.path.basename(str(file_path))
+    base, ext = os.path.splitext(name)
+    ext = ext.lower()
+
+    # foo.css.br / foo.js.gz：按去掉编码后缀的原始文件判断
+    if ext in ('.br', '.gz') and os.path.splitext(base)[1]:
+        ext = os.path.splitext(base)[1].lower()
+
+    content_type = content_type_for_extension(ext)
+    if content_type:
+        return content_type
+
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+    except OSError:
+        return DEFAULT_CONTENT_TYPE
+
+    return sniff_content_type(head) or DEFAULT_CONTENT_TYPE
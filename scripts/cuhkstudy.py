@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CUHKstudy 统一命令行入口
+把各个脚本作为子命令调用，子命令的参数原样交给对应脚本的 main()。
+只有选中的子命令对应的模块会被导入，boto3 等重量级依赖在真正连接R2时才加载，
+cron 和 git hook 中频繁运行的轻量命令（--help、health、telemetry 等）启动只需几十毫秒
+
+用法:
+    python3 scripts/cuhkstudy.py sync --build          # 等同于 hugo_r2_sync.py --build
+    python3 scripts/cuhkstudy.py upload --diff         # 等同于 upload_to_r2.py --diff
+    python3 scripts/cuhkstudy.py cleanup --dry-run
+    python3 scripts/cuhkstudy.py health
+    python3 scripts/cuhkstudy.py editor 8888
+    python3 scripts/cuhkstudy.py sync --help           # 子命令自己的帮助
+
+安装为命令（符号链接即可，脚本目录按链接目标解析）:
+    ln -s /root/cuhkstudy/scripts/cuhkstudy.py /usr/local/bin/cuhkstudy
+"""
+
+import sys
+import argparse
+
+# 子命令 -> (模块, 说明)，模块在运行子命令时才导入
+COMMANDS = {
+    'sync': ('hugo_r2_sync', '把 public/ 的静态资源同步到R2（可先构建Hugo）'),
+    'upload': ('upload_to_r2', '按文件列表批量上传到R2'),
+    'cleanup': ('r2_cleanup_optimize', '清理R2冗余对象并重新上传优化后的大文件'),
+    'health': ('system_health_check', '检查服务、API、CDN和数据库状态'),
+    'editor': ('install_web_editor', '启动Markdown在线编辑器（保存即发布）'),
+    'watch': ('r2_watch', '监听 public/、uploads/ 并持续同步到R2'),
+    'publish': ('site_publisher', '构建Hugo站点并只上传变化的资源'),
+    'inventory': ('r2_inventory', '本地存储桶清单（refresh / summary / largest / missing）'),
+    'refs': ('reference_graph', '检查失效引用和R2孤立对象'),
+    'telemetry': ('upload_telemetry', '查看最近一次上传的延迟分布'),
+    'cache': ('cache_policy', '查看缓存策略命中的规则，或只改元数据应用到已有对象'),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='cuhkstudy',
+        description="CUHKstudy 站点与R2 CDN 管理工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='子命令:\n' + '\n'.join(f"  {name:<11} {help_text}"
+                                         for name, (_, help_text) in COMMANDS.items()),
+    )
+    parser.add_argument('command', metavar='命令', choices=list(COMMANDS),
+                        help='要运行的子命令（见下方列表）')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='传给子命令的参数')
+    return parser
+
+
+def run(command, args):
+    """导入子命令对应的模块并以 args 调用其 main()，返回退出码"""
+    import importlib
+
+    module_name = COMMANDS[command][0]
+    # 子命令的 argparse 从 sys.argv 读取参数，prog 显示为 "cuhkstudy 子命令"
+    sys.argv = [f"cuhkstudy {command}"] + list(args)
+    module = importlib.import_module(module_name)
+    return module.main() or 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return run(args.command, args.args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+重复文件检测
+按代价从低到高逐级筛选，只有前一级仍然相同的文件才进入下一级:
+1. 文件大小（来自扫描时的 stat，不读文件）
+2. 同一 inode（硬链接）直接视为相同，每个 inode 只读一次
+3. 首尾各 64KB 的部分哈希
+4. 完整MD5（经 file_hasher 持久缓存，文件未变时下次不再读取）
+
+Hugo 把 static/ 复制到 public/，文件数翻倍，但大小唯一的文件一次都不会被读取
+"""
+
+import hashlib
+from collections import defaultdict
+
+from file_hasher import cached_md5
+
+PARTIAL_BLOCK = 64 * 1024
+
+
+def partial_hash(path, size, block=PARTIAL_BLOCK):
+    """
+    首尾两块的MD5，返回 (摘要, 是否覆盖全文)
+    不超过两块的小文件直接读全文，此时摘要就是完整MD5，不需要再算一次
+    """
+    hash_md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        if size <= 2 * block:
+            hash_md5.update(f.read())
+            return hash_md5.hexdigest(), True
+        hash_md5.update(f.read(block))
+        f.seek(-block, 2)
+        hash_md5.update(f.read(block))
+    return hash_md5.hexdigest(), False
+
+
+def group_by(items, key_func):
+    """按 key_func 分组，键为 None（读取失败）的项被丢弃"""
+    groups = defaultdict(list)
+    for item in items:
+        key = key_func(item)
+        if key is not None:
+            groups[key].append(item)
+    return groups
+
+
+def find_duplicates(items, md5_func=cached_md5):
+    """
+    找出内容相同的文件
+    items 为 asset_scanner.scan 产出的字典（需要 path、size，可选 inode）
+    返回 (重复组列表, 统计)；每组是内容相同的若干 item，组内保持输入顺序，
+    组内 item 补上 'md5' 字段（只有硬链接、从未读取内容的组为 None）；
+    唯一的文件不在任何组中，也不会被读取
+    """
+    stats = {'files': 0, 'size_candidates': 0, 'hardlinks': 0,
+             'partial_hashed': 0, 'full_hashed': 0}
+    by_size = defaultdict(list)
+    order = {}
+    for item in items:
+        order[id(item)] = stats['files']
+        stats['files'] += 1
+        by_size[item['size']].append(item)
+
+    def safe(func, item):
+        try:
+            return func(item)
+        except OSError:
+            return None
+
+    duplicates = []
+
+    def add_group(inode_groups, md5):
+        members = [item for group in inode_groups for item in group]
+        if len(members) > 1:
+            for item in members:
+                item['md5'] = md5
+            duplicates.append(sorted(members, key=lambda item: order[id(item)]))
+
+    for size, same_size in by_size.items():
+        if len(same_size) < 2:
+            continue
+        stats['size_candidates'] += len(same_size)
+
+        # 同一个 inode 的文件内容必然相同，每个 inode 只读第一个路径
+        by_inode = list(group_by(same_size, lambda item: item.get('inode') or id(item)).values())
+        stats['hardlinks'] += len(same_size) - len(by_inode)
+        if len(by_inode) == 1:
+            add_group(by_inode, None)
+            continue
+
+        stats['partial_hashed'] += len(by_inode)
+        by_partial = group_by(by_inode, lambda group: safe(
+            lambda item: partial_hash(item['path'], size), group[0]))
+
+        for (digest, complete), candidates in by_partial.items():
+            if complete or len(candidates) == 1:
+                add_group(candidates, digest if complete else None)
+                continue
+            stats['full_hashed'] += len(candidates)
+            by_full = group_by(candidates, lambda group: safe(
+                lambda item: md5_func(item['path']), group[0]))
+            for md5, same_content in by_full.items():
+                add_group(same_content, md5)
+
+    return duplicates, stats
+
+
+def pick_winners(groups, rank):
+    """
+    每组选出 rank(item) 最小的文件
+    返回 {path: 胜出的 item}，组内每个文件都能 O(1) 查到本组的胜者
+    """
+    winner_of = {}
+    for group in groups:
+        best = min(group, key=rank)
+        for item in group:
+            winner_of[item['path']] = best
+    return winner_of
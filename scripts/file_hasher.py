@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件哈希服务
+- 大文件用 mmap 一次交给 hashlib（释放GIL），小文件整块读取，不再 4KB 一块地循环
+- 批量计算时用进程池并行
+- 结果持久缓存在 SQLite 中，以 (st_dev, st_ino, 大小, mtime_ns) 为键，
+  文件未变时不会重新读取
+- md5 用于和R2的ETag比较；fast 是更快的非加密哈希（有 xxhash 时用 xxh3，
+  否则用 blake2b），只用于本地变更检测
+
+可调环境变量:
+    R2_HASH_CACHE   缓存数据库路径（默认 /var/www/cuhkstudy/.hash_cache.sqlite）
+
+用法:
+    python3 scripts/file_hasher.py [--fast] 文件...
+"""
+
+import os
+import sys
+import mmap
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import concurrent.futures
+
+try:
+    import xxhash
+except ImportError:  # 未安装时 fast 使用 blake2b
+    xxhash = None
+
+DEFAULT_HASH_CACHE_PATH = os.getenv(
+    'R2_HASH_CACHE', '/var/www/cuhkstudy/.hash_cache.sqlite'
+)
+
+ALGORITHMS = ('md5', 'fast')
+
+# 超过这个大小用 mmap 读取
+MMAP_THRESHOLD = 1024 * 1024
+
+# 待计算的总量低于这些值时在当前进程计算，省去启动进程池的开销
+POOL_MIN_FILES = 32
+POOL_MIN_BYTES = 64 * 1024 * 1024
+
+# mtime 距今不足这么多秒的文件不写缓存：同一时间片内再次修改时 mtime 可能不变
+RACY_WINDOW = 2.0
+
+
+def new_hash(algorithm):
+    if algorithm == 'md5':
+        return hashlib.md5()
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def fast_hash_name():
+    """fast 哈希的实际算法名，写在摘要前面，换了算法后旧缓存自然不再匹配"""
+    return 'xxh3' if xxhash is not None else 'blake2b'
+
+
+def hash_path(path, algorithms=('md5',)):
+    """计算一个文件的哈希，返回 {算法: 摘要}"""
+    hashes = {algorithm: new_hash(algorithm) for algorithm in algorithms}
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for h in hashes.values():
+                    h.update(data)
+        else:
+            data = f.read()
+            for h in hashes.values():
+                h.update(data)
+
+    digests = {}
+    for algorithm, h in hashes.items():
+        digest = h.hexdigest()
+        digests[algorithm] = digest if algorithm == 'md5' else f"{fast_hash_name()}:{digest}"
+    return digests
+
+
+def calculate_md5(file_path):
+    """计算文件MD5（不使用缓存）"""
+    return hash_path(file_path)['md5']
+
+
+class HashCache:
+    """以 (st_dev, st_ino) 为主键、大小和 mtime_ns 为校验的哈希缓存"""
+
+    def __init__(self, path=DEFAULT_HASH_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS hashes ('
+                ' dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER,'
+                ' md5 TEXT, fast TEXT, PRIMARY KEY (dev, inode))'
+            )
+            self.db.commit()
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  哈希缓存不可用，本次不使用缓存: {e}", file=sys.stderr)
+            self.db = None
+
+    def get(self, st):
+        """返回 {'md5', 'fast'}（未缓存的算法为 None），没有有效记录时返回 None"""
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                'SELECT size, mtime_ns, md5, fast FROM hashes WHERE dev = ? AND inode = ?',
+                (st.st_dev, st.st_ino)
+            ).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return None
+        fast = row[3] if row[3] and row[3].startswith(fast_hash_name() + ':') else None
+        return {'md5': row[2], 'fast': fast}
+
+    def put_many(self, records):
+        """records: 可迭代的 (stat结果, {算法: 摘要})，与已有记录合并"""
+        if self.db is None:
+            return
+        now = time.time()
+        rows = []
+        for st, digests in records:
+            if now - st.st_mtime < RACY_WINDOW:
+                continue
+            rows.append((st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+                         digests.get('md5'), digests.get('fast')))
+        if not rows:
+            return
+        with self.lock:
+            try:
+                self.db.executemany(
+                    'INSERT INTO hashes (dev, inode, size, mtime_ns, md5, fast)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)'
+                    ' ON CONFLICT (dev, inode) DO UPDATE SET'
+                    '  md5 = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns'
+                    '             THEN COALESCE(excluded.md5, md5) ELSE excluded.md5 END,'
+                    '  fast = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns'
+                    '              THEN COALESCE(excluded.fast, fast) ELSE excluded.fast END,'
+                    '  size = excluded.size, mtime_ns = excluded.mtime_ns',
+                    rows
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️  写入哈希缓存失败: {e}", file=sys.stderr)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    """进程内共享的默认缓存"""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = HashCache()
+    return _shared_cache
+
+
+def hash_files(paths, algorithm='md5', cache=None, workers=None):
+    """
+    批量计算文件哈希，返回 {路径: 摘要}；无法读取的文件不在结果中
+    先查缓存，未命中的文件量较大时用进程池并行计算
+    """
+    cache = cache or shared_cache()
+    results = {}
+    misses = []
+    miss_bytes = 0
+
+    for path in dict.fromkeys(paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        cached = cache.get(st)
+        if cached and cached.get(algorithm):
+            results[path] = cached[algorithm]
+        else:
+            misses.append((path, st))
+            miss_bytes += st.st_size
+
+    if not misses:
+        return results
+
+    records = []
+
+    def collect(path, st, digests):
+        results[path] = digests[algorithm]
+        records.append((st, digests))
+
+    if len(misses) < POOL_MIN_FILES and miss_bytes < POOL_MIN_BYTES:
+        for path, st in misses:
+            try:
+                collect(path, st, hash_path(path, (algorithm,)))
+            except OSError as e:
+                print(f"⚠️  无法读取 {path}: {e}", file=sys.stderr)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(hash_path, path, (algorithm,)): (path, st)
+                       for path, st in misses}
+            for future in concurrent.futures.as_completed(futures):
+                path, st = futures[future]
+                try:
+                    collect(path, st, future.result())
+                except OSError as e:
+                    print(f"⚠️  无法读取 {path}: {e}", file=sys.stderr)
+
+    cache.put_many(records)
+    return results
+
+
+def cached_md5(file_path):
+    """带持久缓存的单文件MD5，可直接替换 calculate_md5"""
+    st = os.stat(file_path)
+    cache = shared_cache()
+    cached = cache.get(st)
+    if cached and cached['md5']:
+        return cached['md5']
+    digests = hash_path(file_path)
+    cache.put_many([(st, digests)])
+    return digests['md5']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="计算文件哈希（带持久缓存）")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--fast', action='store_true', help='使用非加密的快速哈希而不是MD5')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    results = hash_files(args.paths, 'fast' if args.fast else 'md5', workers=args.workers)
+    for path in args.paths:
+        if path in results:
+            print(f"{results[path]}  {path}")
+    print(f"⏱️  {len(results)} 个文件，用时 {time.monotonic() - started:.2f}s", file=sys.stderr)
+    return 0 if len(results) == len(set(args.paths)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内容寻址的静态资源
+把资源以带内容哈希的键发布（如 img/cover/1.3f2a9c1b7d0e.svg），缓存策略中
+哈希键的规则（"immutable, max-age=31536000"）让浏览器和CDN永久缓存；同时把构建好的
+public/ 中HTML和CSS里的引用改写为哈希后的CDN地址，内容变化时地址随之变化
+"""
+
+import os
+import re
+import posixpath
+from urllib.parse import urlsplit, unquote
+
+DEFAULT_HASHED_MANIFEST_PATH = os.getenv(
+    'R2_HASHED_MANIFEST', '/var/www/cuhkstudy/.r2_hashed_manifest.json'
+)
+HASH_LENGTH = 12
+
+# 会被改写引用的文本文件
+TEXT_RULES = [
+    {'name': 'text', 'ext': ['.html', '.htm', '.css']},
+]
+
+# HTML属性（Hugo --minify 会去掉属性值的引号）、srcset 和 CSS url()
+ATTR_RE = re.compile(
+    r'''(?P<prefix>\b(?:src|href|poster|data-src|content)=)'''
+    r'''(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<bare>[^\s"'=<>`]+))''',
+    re.IGNORECASE,
+)
+SRCSET_RE = re.compile(
+    r'''(?P<prefix>\bsrcset=)(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)')''',
+    re.IGNORECASE,
+)
+CSS_URL_RE = re.compile(r'''url\(\s*(?P<quote>['"]?)(?P<url>[^'")]+)(?P=quote)\s*\)''')
+
+SKIP_SCHEMES = ('data:', 'mailto:', 'tel:', 'javascript:', '#')
+
+
+def hashed_key(site_path, md5):
+    """/img/cover/1.svg + md5 -> img/cover/1.<hash>.svg"""
+    base, ext = posixpath.splitext(site_path.lstrip('/'))
+    return f"{base}.{md5[:HASH_LENGTH]}{ext}"
+
+
+def read_site_host(hugo_config='/var/www/cuhkstudy/config/_default/hugo.toml'):
+    """从Hugo配置读取站点域名，用于识别写成完整URL的站内引用"""
+    try:
+        with open(hugo_config, 'r', encoding='utf-8') as f:
+            match = re.search(r'''^\s*baseURL\s*=\s*["']([^"']+)["']''', f.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return urlsplit(match.group(1)).netloc if match else None
+
+
+def resolve_reference(url, page_dir, site_host=None):
+    """
+    把引用解析为站点路径（如 /img/a.png）
+    返回 (站点路径, 查询和锚点后缀)；外部链接或无法解析时返回 (None, None)
+    """
+    url = url.strip()
+    if not url or url.startswith(SKIP_SCHEMES):
+        return None, None
+
+    parts = urlsplit(url)
+    if parts.scheme or url.startswith('//'):
+        if parts.scheme not in ('http', 'https', '') or not site_host or parts.netloc != site_host:
+            return None, None
+    path = unquote(parts.path)
+    if not path:
+        return None, None
+
+    if not path.startswith('/'):
+        path = posixpath.join(page_dir, path)
+    path = posixpath.normpath(path)
+
+    # 改写后保留原来的查询和锚点（如字体的 ?v=3、#iefix）
+    suffix = ''
+    if parts.query:
+        suffix += f"?{parts.query}"
+    if parts.fragment:
+        suffix += f"#{parts.fragment}"
+    return path, suffix
+
+
+def rewrite_text(text, page_dir, replace, site_host=None):
+    """
+    对文本中的每个资源引用调用 replace(站点路径)，返回新地址则替换
+    返回 (新文本, 替换次数)
+    """
+    count = 0
+
+    def swap(url):
+        nonlocal count
+        path, suffix = resolve_reference(url, page_dir, site_host)
+        if path is None:
+            return url
+        new_url = replace(path)
+        if new_url is None:
+            return url
+        count += 1
+        return new_url + suffix
+
+    def on_attr(match):
+        for group, quote in (('dq', '"'), ('sq', "'"), ('bare', '')):
+            value = match.group(group)
+            if value is not None:
+                return f"{match.group('prefix')}{quote}{swap(value)}{quote}"
+        return match.group(0)
+
+    def on_srcset(match):
+        quote = '"' if match.group('dq') is not None else "'"
+        value = match.group('dq') if match.group('dq') is not None else match.group('sq')
+        candidates = []
+        for candidate in value.split(','):
+            pieces = candidate.strip().split(None, 1)
+            if pieces:
+                pieces[0] = swap(pieces[0])
+            candidates.append(' '.join(pieces))
+        return f"{match.group('prefix')}{quote}{', '.join(candidates)}{quote}"
+
+    def on_css_url(match):
+        quote = match.group('quote')
+        return f"url({quote}{swap(match.group('url'))}{quote})"
+
+    text = ATTR_RE.sub(on_attr, text)
+    text = SRCSET_RE.sub(on_srcset, text)
+    text = CSS_URL_RE.sub(on_css_url, text)
+    return text, count
+
+
+def extract_urls(text):
+    """
+    产出文本中所有资源引用的原始地址（属性、srcset 和 CSS url()）
+    content= 只取看起来是地址的值（og:image 等），跳过 viewport、description 之类的文本
+    """
+    for match in ATTR_RE.finditer(text):
+        for group in ('dq', 'sq', 'bare'):
+            value = match.group(group)
+            if value is None:
+                continue
+            if match.group('prefix').lower().startswith('content') and \
+                    not value.startswith(('/', 'http://', 'https://')):
+                break
+            yield value
+            break
+    for match in SRCSET_RE.finditer(text):
+        value = match.group('dq') if match.group('dq') is not None else match.group('sq')
+        for candidate in value.split(','):
+            pieces = candidate.strip().split(None, 1)
+            if pieces:
+                yield pieces[0]
+    for match in CSS_URL_RE.finditer(text):
+        yield match.group('url')
+
+
+def page_dir_for(rel_path):
+    """public/ 下文件的相对路径 -> 所在的站点目录，如 ugfn/index.html -> /ugfn"""
+    return '/' + posixpath.dirname(rel_path.replace(os.sep, '/'))
+
+
+def collect_references(text_files, asset_paths, site_host=None):
+    """找出文本文件中实际引用到的资源站点路径"""
+    referenced = set()
+
+    def record(path):
+        if path in asset_paths:
+            referenced.add(path)
+        return None
+
+    for item in text_files:
+        with open(item['path'], 'r', encoding='utf-8', errors='replace') as f:
+            rewrite_text(f.read(), page_dir_for(item['rel_path']), record, site_host)
+    return referenced
+
+
+def rewrite_references(text_files, url_map, site_host=None):
+    """把文本文件中的资源引用改写为 url_map 中的新地址，返回 (改写文件数, 替换引用数)"""
+    files_changed = 0
+    refs_changed = 0
+
+    for item in text_files:
+        with open(item['path'], 'r', encoding='utf-8', errors='surrogateescape') as f:
+            text = f.read()
+
+        new_text, count = rewrite_text(text, page_dir_for(item['rel_path']),
+                                       url_map.get, site_host)
+        if not count:
+            continue
+
+        tmp_path = f"{item['path']}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+            f.write(new_text)
+        os.replace(tmp_path, item['path'])
+        files_changed += 1
+        refs_changed += count
+
+    return files_changed, refs_changed
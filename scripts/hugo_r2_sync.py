@@ -8,13 +8,29 @@ Hugo R2 同步脚本
 import os
 import sys
 import json
+import argparse
 import subprocess
 from pathlib import Path
 from dotenv import load_dotenv
 
+from asset_scanner import scan, STATIC_ASSET_RULES
+from r2_sync_manifest import SyncManifest, DEFAULT_MANIFEST_PATH
+from file_hasher import hash_files
+from r2_client import load_config, get_client
+from hashed_assets import (
+    collect_references, rewrite_references, hashed_key, read_site_host,
+    TEXT_RULES, DEFAULT_HASHED_MANIFEST_PATH,
+)
+from r2_diff import load_remote_index, diff_against_remote
+from r2_uploader import make_task, upload_files, delete_keys, DEFAULT_WORKERS
+import rate_limiter
+import upload_telemetry
+
 # 加载环境变量
 load_dotenv()
 
+BASE_DIR = "/var/www/cuhkstudy"
+
 def run_command(cmd, cwd=None):
     """运行shell命令"""
     try:
@@ -26,68 +42,188 @@ def run_command(cmd, cwd=None):
         print(f"错误: {e.stderr}")
         return None
 
-def sync_to_r2():
-    """同步Hugo public目录到R2"""
+def sync_to_r2(full=False, delete=False, manifest_path=DEFAULT_MANIFEST_PATH,
+               workers=DEFAULT_WORKERS, remote_diff=False, base_dir=BASE_DIR, skip=None):
+    """
+    同步Hugo public目录到R2（基于同步清单的增量同步）
+    remote_diff 时先与存储桶比较ETag，已一致的文件直接记入清单；同步清单为空时自动启用
+    skip 为不上传的 rel_path（public/ 开头，--hashed 已按哈希键发布的资源），也不算作本地已删除
+    """
     print("🚀 开始同步Hugo静态文件到R2...")
     
-    # 检查环境变量
-    endpoint = os.getenv('R2_ENDPOINT')
-    bucket = os.getenv('R2_BUCKET')
+    # 检查R2配置
+    config = load_config()
+    bucket = config['bucket']
     
-    if not endpoint or not bucket:
+    if not config['endpoint'] or not bucket:
         print("❌ 缺少R2环境变量")
         return False
     
     # 确保public目录存在
-    public_dir = "/var/www/cuhkstudy/public"
+    public_dir = os.path.join(base_dir, "public")
     if not os.path.exists(public_dir):
         print(f"❌ Hugo public目录不存在: {public_dir}")
         return False
     
-    # 只同步静态资源文件
-    sync_patterns = [
-        "*.pdf",
-        "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg", "*.ico",
-        "*.woff", "*.woff2", "*.ttf", "*.eot",
-        "*.mp3", "*.mp4", "*.wav", "*.ogg"
-    ]
+    manifest = SyncManifest(manifest_path)
+    if not full:
+        manifest.load()
+        remote_diff = remote_diff or not manifest.entries
     
-    success_count = 0
-    total_count = 0
+    # 单次遍历public目录，只同步静态资源文件（规则见 asset_scanner.STATIC_ASSET_RULES）
+    print("🔍 扫描静态资源文件...")
+    items = list(scan(base_dir, STATIC_ASSET_RULES, subdirs=["public"]))
+    seen_paths = {item['rel_path'] for item in items}
+    if skip:
+        items = [item for item in items if item['rel_path'] not in skip]
     
-    for pattern in sync_patterns:
-        print(f"🔄 同步 {pattern} 文件...")
-        
-        # 查找匹配的文件
-        find_cmd = f"find {public_dir} -name '{pattern}' -type f"
-        files = run_command(find_cmd)
-        
-        if not files:
+    success_count, total_count, skipped_count = upload_changed(
+        items, manifest, bucket, workers=workers, remote_diff=remote_diff
+    )
+    
+    # 清单中也有 r2_watch 同步的 uploads/ 等其他目录，只比较本次扫描的 public/
+    stale_paths = manifest.stale_paths(seen_paths, prefix="public/")
+    if stale_paths:
+        if delete:
+            print(f"🗑️  删除 {len(stale_paths)} 个本地已不存在的文件...")
+            for rel_path in delete_keys(stale_paths, bucket):
+                manifest.forget(rel_path)
+                print(f"  🗑️  {rel_path}")
+            manifest.save()
+        else:
+            print(f"ℹ️  {len(stale_paths)} 个文件本地已删除，使用 --delete 从R2移除")
+    
+    print(f"\n📊 同步完成: {success_count}/{total_count} 个文件上传，{skipped_count} 个未变更已跳过")
+    return success_count == total_count
+
+def upload_changed(items, manifest, bucket, workers=DEFAULT_WORKERS, remote_diff=False):
+    """
+    上传 items（asset_scanner 产出的字典）中相对同步清单有变化的文件，成功后记入清单
+    返回 (成功数, 需要上传数, 未变更跳过数)
+    """
+    skipped_count = 0
+    pending = {}
+    tasks = []
+    
+    # Hugo重新构建后mtime全部变化，需要读内容的文件一次性并行计算MD5
+    md5s = hash_files([item['path'] for item in items
+                       if manifest.stat_changed(item['rel_path'], item['size'], item['mtime'])])
+    
+    for item in items:
+        # 相对路径作为S3 key
+        rel_path = item['rel_path']
+        try:
+            changed, info = manifest.check(rel_path, item['path'], md5s.get(item['path']))
+        except OSError as e:
+            # 扫描之后文件又被删除或替换
+            print(f"  ⚠️  跳过 {rel_path}: {e}")
+            continue
+        if not changed:
+            skipped_count += 1
             continue
-            
-        file_list = files.split('\n')
-        total_count += len(file_list)
         
-        # 使用AWS CLI批量上传
-        for file_path in file_list:
-            # 计算相对路径作为S3 key
-            rel_path = os.path.relpath(file_path, "/var/www/cuhkstudy")
-            
-            upload_cmd = f"""aws s3 cp "{file_path}" "s3://{bucket}/{rel_path}" \
-                --profile r2-cuhkstudy \
-                --endpoint-url {endpoint} \
-                --content-type "$(file -b --mime-type '{file_path}')" \
-                --cache-control "public, max-age=2592000" \
-                --acl public-read"""
-            
-            if run_command(upload_cmd):
-                success_count += 1
-                print(f"  ✅ {rel_path}")
-            else:
-                print(f"  ❌ {rel_path}")
-    
-    print(f"\n📊 同步完成: {success_count}/{total_count} 个文件")
-    return success_count == total_count
+        pending[rel_path] = info
+        tasks.append(make_task(item['path'], rel_path))
+    
+    if remote_diff and tasks:
+        tasks = filter_unchanged_remote(tasks, pending, manifest, bucket)
+    
+    total_count = len(tasks)
+    success_count = 0
+    if not tasks:
+        manifest.save()
+        return success_count, total_count, skipped_count
+    print(f"🔄 上传 {total_count} 个文件，最多 {workers} 个并发线程...")
+    
+    def on_result(result):
+        nonlocal success_count
+        rel_path = result['r2_key']
+        if result['success']:
+            manifest.record(rel_path, pending[rel_path], result['etag'])
+            success_count += 1
+            print(f"  ✅ {rel_path}")
+            # 定期落盘，中断后已上传的文件不会重传
+            if success_count % 50 == 0:
+                manifest.save()
+        else:
+            print(f"  ❌ {rel_path}: {result['error']}")
+    
+    upload_files(tasks, bucket, max_workers=workers, on_result=on_result)
+    manifest.save()
+    return success_count, total_count, skipped_count
+
+def filter_unchanged_remote(tasks, pending, manifest, bucket):
+    """与存储桶比较，去掉远端已一致的文件并把它们记入同步清单"""
+    print("🔎 与R2存储桶比较ETag...")
+    remote_index = load_remote_index(get_client(), bucket, prefix="public/")
+    
+    local_files = [(t['key'], t['path'], pending[t['key']]['size']) for t in tasks]
+    local_md5s = {key: info['md5'] for key, info in pending.items()}
+    to_upload, unchanged = diff_against_remote(local_files, remote_index, local_md5s)
+    
+    for key, _, remote in unchanged:
+        manifest.record(key, pending[key], remote['etag'])
+    manifest.save()
+    
+    print(f"  ✅ {len(unchanged)} 个文件与R2一致，{len(to_upload)} 个需要上传")
+    upload_keys = {key for key, _, _ in to_upload}
+    return [t for t in tasks if t['key'] in upload_keys]
+
+def publish_hashed(cdn_base, manifest_path=DEFAULT_HASHED_MANIFEST_PATH, workers=DEFAULT_WORKERS,
+                   base_dir=BASE_DIR):
+    """
+    以内容哈希键发布public/中被HTML/CSS引用的静态资源，并把引用改写为CDN地址
+    哈希键内容不变，因此可以永久缓存；内容未变的资源不会重复上传
+    返回 (是否全部成功, 被引用资源的站点路径集合)，未被引用的资源由 sync_to_r2 照常同步
+    """
+    print("🚀 以内容哈希键发布静态资源...")
+    
+    bucket = load_config()['bucket']
+    public_dir = os.path.join(base_dir, "public")
+    if not os.path.exists(public_dir):
+        print(f"❌ Hugo public目录不存在: {public_dir}")
+        return False, set()
+    
+    site_host = read_site_host()
+    assets = {'/' + item['rel_path']: item for item in scan(public_dir, STATIC_ASSET_RULES)}
+    text_files = list(scan(public_dir, TEXT_RULES))
+    
+    referenced = collect_references(text_files, assets, site_host)
+    print(f"🔍 {len(text_files)} 个HTML/CSS文件引用了 {len(referenced)} 个静态资源")
+    
+    manifest = SyncManifest(manifest_path).load()
+    url_map = {}
+    pending = {}
+    tasks = []
+    
+    for site_path in sorted(referenced):
+        item = assets[site_path]
+        changed, info = manifest.check(item['rel_path'], item['path'])
+        key = hashed_key(site_path, info['md5'])
+        if changed:
+            pending[key] = (item['rel_path'], site_path, info)
+            tasks.append(make_task(item['path'], key))
+        else:
+            url_map[site_path] = f"{cdn_base}/{key}"
+    
+    print(f"🔄 上传 {len(tasks)} 个新的哈希资源，{len(url_map)} 个已存在")
+    
+    def on_result(result):
+        rel_path, site_path, info = pending[result['r2_key']]
+        if result['success']:
+            manifest.record(rel_path, info, result['etag'])
+            url_map[site_path] = f"{cdn_base}/{result['r2_key']}"
+            print(f"  ✅ {result['r2_key']}")
+        else:
+            # 上传失败的资源保留原引用，避免页面出现失效链接
+            print(f"  ❌ {result['r2_key']}: {result['error']}")
+    
+    upload_files(tasks, bucket, max_workers=workers, on_result=on_result)
+    manifest.save()
+    
+    files_changed, refs_changed = rewrite_references(text_files, url_map, site_host)
+    print(f"\n📊 改写 {files_changed} 个文件中的 {refs_changed} 处引用")
+    return len(url_map) == len(referenced), set(referenced)
 
 def update_hugo_config():
     """更新Hugo配置以支持R2 CDN"""
@@ -131,9 +267,41 @@ audio_prefix = "/audio/"
     
     return True
 
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Hugo构建后同步静态资源到R2")
+    parser.add_argument('--build', action='store_true', help='同步前先构建Hugo站点')
+    parser.add_argument('--full', action='store_true', help='忽略同步清单，全量上传')
+    parser.add_argument('--delete', action='store_true', help='从R2删除本地已不存在的文件')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST_PATH, help='同步清单路径')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='最大并发上传线程数')
+    parser.add_argument('--linearize', action='store_true',
+                        help='构建后线性化 public/ 中的PDF（快速Web查看）')
+    parser.add_argument('--precompress', action='store_true',
+                        help='同步后为 public/ 中的文本文件生成 .gz/.br 预压缩文件（含 --hashed 改写后的页面）')
+    parser.add_argument('--hashed', action='store_true',
+                        help='以内容哈希键发布被引用的资源（永久缓存）并改写HTML/CSS引用，其余资源照常同步')
+    parser.add_argument('--cdn-base', default=None,
+                        help='哈希资源的公共访问地址，默认使用 R2_PUBLIC_URL')
+    parser.add_argument('--remote-diff', action='store_true',
+                        help='上传前与R2存储桶比较ETag，只上传缺失或不同的文件')
+    rate_limiter.add_arguments(parser)
+    upload_telemetry.add_arguments(parser)
+    return parser.parse_args(argv)
+
 def main():
     """主函数"""
-    if len(sys.argv) > 1 and sys.argv[1] == "--build":
+    args = parse_args()
+    
+    try:
+        limiter = rate_limiter.configure(args.bwlimit, args.bw_schedule)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    if limiter.limited:
+        print(f"🚦 上传限速: {limiter.describe()}")
+    
+    if args.build:
         print("🏗️  构建Hugo站点...")
         os.chdir("/root/cuhkstudy")
         
@@ -144,14 +312,38 @@ def main():
         
         print("✅ Hugo构建完成")
     
+    if args.linearize:
+        # 在构建后处理要同步的 public/，不改动受git跟踪的源PDF
+        from pdf_linearize import linearize_pdfs
+        linearize_pdfs(BASE_DIR, ['public'])
+    
     # 更新配置
     if not update_hugo_config():
         return 1
     
     # 同步到R2
-    if not sync_to_r2():
+    skip = set()
+    synced = True
+    if args.hashed:
+        cdn_base = (args.cdn_base or load_config()['public_url']).rstrip('/')
+        synced, referenced = publish_hashed(cdn_base, workers=args.workers)
+        # 被引用的资源已按哈希键发布，其余（JS动态加载、外部直接链接的资源）照常同步
+        skip = {'public' + site_path for site_path in referenced}
+    synced = sync_to_r2(full=args.full, delete=args.delete, manifest_path=args.manifest,
+                        workers=args.workers, remote_diff=args.remote_diff, skip=skip) and synced
+    
+    if args.precompress:
+        # 最后一个改动 public/ 的步骤：--hashed 改写过的HTML/CSS也要重新生成 .gz/.br，
+        # 否则 nginx gzip_static 优先发送的压缩副本仍是旧引用。延迟导入，未使用时不加载多进程压缩相关模块
+        from precompress import precompress
+        precompress(os.path.join(BASE_DIR, 'public'))
+    
+    # 同步失败时也写出遥测，失败对象的耗时和重试次数同样有用
+    upload_telemetry.write('hugo_r2_sync', args.metrics_dir, args.telemetry_json)
+    if not synced:
         return 1
     
+    rate_limiter.report(limiter)
     print("🎉 所有操作完成！")
     return 0
 
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传前的图片优化
+对 public/ 中的 PNG/JPG 重新压缩并去掉EXIF等元数据，生成 WebP/AVIF 副本和多种宽度的
+响应式版本，结果写入变体清单（供模板或CDN规则选择合适的文件）
+
+- 多进程并行处理
+- 处理结果按源文件MD5缓存在 public/ 之外，内容未变的图片不会重新处理，
+  hugo 重新构建后直接从缓存复制回 public/（不用硬链接：hugo 会原地重写同名文件，
+  硬链接会把新内容写进缓存）
+- 原图只有在重新压缩后变小时才会被替换
+
+文件命名（以 img/mix2.png 为例）:
+    img/mix2.png          重新压缩后的原图
+    img/mix2.webp         原尺寸 WebP
+    img/mix2.w960.webp    宽 960 的 WebP
+    img/mix2.w960.avif    宽 960 的 AVIF（Pillow 支持 AVIF 时）
+
+用法:
+    python3 scripts/image_optimizer.py [--widths 480,960,1600] [--workers N]
+"""
+
+import io
+import os
+import sys
+import json
+import argparse
+import posixpath
+import concurrent.futures
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 未安装 Pillow 时无法优化，调用方应跳过这一步
+    Image = None
+
+from asset_scanner import scan
+from precompress import place_output
+from file_hasher import calculate_md5
+
+PUBLIC_DIR = '/var/www/cuhkstudy/public'
+DEFAULT_CACHE_DIR = '/var/www/cuhkstudy/.image_cache'
+DEFAULT_VARIANT_MANIFEST_PATH = os.getenv(
+    'R2_IMAGE_MANIFEST', '/var/www/cuhkstudy/.image_variants.json'
+)
+
+IMAGE_RULES = [
+    {'name': 'png', 'ext': ['.png'], 'min_size': 32 * 1024},
+    {'name': 'jpg', 'ext': ['.jpg', '.jpeg'], 'min_size': 32 * 1024},
+]
+
+DEFAULT_WIDTHS = [480, 960, 1600]
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+AVIF_QUALITY = 55
+
+# 编码参数变化时递增，旧缓存随之失效
+PIPELINE_VERSION = 1
+
+
+def avif_supported():
+    """Pillow 11.3 起内置 AVIF 编码（或安装了 pillow-avif-plugin）"""
+    if Image is None:
+        return False
+    Image.init()
+    return 'AVIF' in Image.SAVE
+
+
+def default_formats():
+    return ['webp', 'avif'] if avif_supported() else ['webp']
+
+
+def encode(image, fmt):
+    """把图片编码为指定格式，返回字节串（不带EXIF，保留ICC色彩配置）"""
+    buffer = io.BytesIO()
+    icc_profile = image.info.get('icc_profile')
+    params = {'icc_profile': icc_profile} if icc_profile else {}
+
+    if fmt == 'png':
+        image.save(buffer, 'PNG', optimize=True, **params)
+    elif fmt == 'jpeg':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True, **params)
+    elif fmt == 'webp':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6, **params)
+    elif fmt == 'avif':
+        image.save(buffer, 'AVIF', quality=AVIF_QUALITY, **params)
+    else:
+        raise ValueError(f"不支持的格式: {fmt}")
+    return buffer.getvalue()
+
+
+def load_image(path):
+    """读取图片并按EXIF方向摆正（之后EXIF会被丢弃）"""
+    image = Image.open(path)
+    image.load()
+    icc_profile = image.info.get('icc_profile')
+    image = ImageOps.exif_transpose(image)
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGB')
+    if icc_profile:
+        image.info['icc_profile'] = icc_profile
+    return image
+
+
+def variant_name(width, fmt):
+    """缓存目录中的文件名；width 为 None 表示原尺寸"""
+    return f"{fmt}" if width is None else f"w{width}.{fmt}"
+
+
+def build_variants(path, entry_dir, widths, formats):
+    """处理一张图片并把所有输出写入缓存目录，返回元数据"""
+    ext = os.path.splitext(path)[1].lower()
+    source_format = 'png' if ext == '.png' else 'jpeg'
+    image = load_image(path)
+    width, height = image.size
+    original_size = os.path.getsize(path)
+
+    os.makedirs(entry_dir, exist_ok=True)
+    meta = {
+        'version': PIPELINE_VERSION,
+        'width': width,
+        'height': height,
+        'original_size': original_size,
+        'optimized': None,
+        'variants': [],
+    }
+
+    def write(name, data):
+        tmp_path = os.path.join(entry_dir, f"{name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(entry_dir, name))
+
+    # 重新压缩原图，只有变小才使用
+    data = encode(image, source_format)
+    if len(data) < original_size:
+        write('optimized' + ext, data)
+        meta['optimized'] = {'file': 'optimized' + ext, 'size': len(data)}
+
+    # 原尺寸的新格式副本，只保留比原图小的
+    for fmt in formats:
+        data = encode(image, fmt)
+        if len(data) < original_size:
+            name = variant_name(None, fmt)
+            write(name, data)
+            meta['variants'].append({'file': name, 'format': fmt, 'width': width,
+                                     'height': height, 'size': len(data)})
+
+    # 缩小版本（不放大）
+    for target in sorted(set(widths)):
+        if target >= width:
+            continue
+        target_height = max(1, round(height * target / width))
+        resized = image.resize((target, target_height), Image.LANCZOS)
+        for fmt in formats:
+            data = encode(resized, fmt)
+            name = variant_name(target, fmt)
+            write(name, data)
+            meta['variants'].append({'file': name, 'format': fmt, 'width': target,
+                                     'height': target_height, 'size': len(data)})
+
+    # meta.json 最后写入，作为缓存完整的标志
+    write('meta.json', json.dumps(meta, indent=2).encode('utf-8'))
+    return meta
+
+
+def cache_intact(entry_dir, meta):
+    """缓存中的每个输出文件都存在且大小与元数据一致"""
+    outputs = ([meta['optimized']] if meta['optimized'] else []) + meta['variants']
+    for output in outputs:
+        try:
+            if os.path.getsize(os.path.join(entry_dir, output['file'])) != output['size']:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def optimize_image(path, rel_path, cache_dir, widths, formats, previous=None):
+    """
+    优化单张图片（在子进程中运行）
+    previous 是上一次清单中的记录：文件已经是优化后的版本时沿用原来的源MD5
+    返回清单记录；路径均为相对 public/ 的站点路径
+    """
+    md5 = calculate_md5(path)
+    source_md5 = md5
+    if previous and md5 == previous.get('optimized_md5'):
+        source_md5 = previous['source_md5']
+
+    signature = f"{','.join(str(w) for w in sorted(set(widths)))}-{','.join(formats)}"
+    entry_dir = os.path.join(cache_dir, source_md5[:2],
+                             f"{source_md5}-v{PIPELINE_VERSION}-{signature}")
+    meta_path = os.path.join(entry_dir, 'meta.json')
+
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if not cache_intact(entry_dir, meta):
+            # 缓存文件被改写过（早期版本硬链接到 public/ 后被 hugo 原地覆盖），重新生成
+            meta = None
+    cached = meta is not None
+    if not cached:
+        if source_md5 != md5:
+            # 只剩优化后的文件而缓存已被清理，把它当作新的源文件
+            return optimize_image(path, rel_path, cache_dir, widths, formats)
+        meta = build_variants(path, entry_dir, widths, formats)
+
+    base = os.path.splitext(path)[0]
+    rel_base = posixpath.splitext(rel_path.replace(os.sep, '/'))[0]
+
+    optimized_md5 = source_md5
+    if meta['optimized']:
+        cache_path = os.path.join(entry_dir, meta['optimized']['file'])
+        place_output(cache_path, path, link=False)
+        optimized_md5 = calculate_md5(path)
+
+    variants = []
+    for variant in meta['variants']:
+        place_output(os.path.join(entry_dir, variant['file']), f"{base}.{variant['file']}",
+                     link=False)
+        variants.append({
+            'path': f"{rel_base}.{variant['file']}",
+            'format': variant['format'],
+            'width': variant['width'],
+            'height': variant['height'],
+            'size': variant['size'],
+        })
+
+    return {
+        'rel_path': rel_path.replace(os.sep, '/'),
+        'source_md5': source_md5,
+        'optimized_md5': optimized_md5,
+        'width': meta['width'],
+        'height': meta['height'],
+        'original_size': meta['original_size'],
+        'size': meta['optimized']['size'] if meta['optimized'] else meta['original_size'],
+        'variants': variants,
+        'cached': cached,
+    }
+
+
+def load_variant_manifest(path=DEFAULT_VARIANT_MANIFEST_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('images', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_variant_manifest(entries, path=DEFAULT_VARIANT_MANIFEST_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': PIPELINE_VERSION, 'images': entries}, f,
+                  ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def optimize_images(items=None, public_dir=PUBLIC_DIR, cache_dir=DEFAULT_CACHE_DIR,
+                    manifest_path=DEFAULT_VARIANT_MANIFEST_PATH, widths=None,
+                    formats=None, workers=None):
+    """
+    并行优化图片并更新变体清单
+    items 为 asset_scanner.scan 的结果（rel_path 相对 public_dir），默认扫描整个 public/
+    返回 {rel_path: 清单记录}，只包含本次处理的图片
+    """
+    if Image is None:
+        print("⚠️  未安装 Pillow（pip install Pillow），跳过图片优化")
+        return {}
+
+    widths = widths or DEFAULT_WIDTHS
+    formats = formats or default_formats()
+    if items is None:
+        items = scan(public_dir, IMAGE_RULES)
+    items = list(items)
+    manifest = load_variant_manifest(manifest_path)
+
+    print(f"🖼️  优化 {len(items)} 张图片（{', '.join(formats)}，宽度 {', '.join(map(str, widths))}）...")
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(optimize_image, item['path'], item['rel_path'], cache_dir,
+                            widths, formats, manifest.get(item['rel_path'])): item
+            for item in items
+        }
+        for future in concurrent.futures.as_completed(futures):
+            item = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                print(f"  ❌ {item['rel_path']}: {e}")
+                continue
+            if not entry.pop('cached'):
+                print(f"  ✅ {entry['rel_path']}: {entry['original_size'] / 1024:.0f}KB -> "
+                      f"{entry['size'] / 1024:.0f}KB，{len(entry['variants'])} 个变体")
+            results[entry['rel_path']] = entry
+
+    manifest.update(results)
+    save_variant_manifest(manifest, manifest_path)
+
+    before = sum(e['original_size'] for e in results.values())
+    after = sum(e['size'] for e in results.values())
+    if before:
+        print(f"📊 原图 {before / 1024 / 1024:.2f} MB -> {after / 1024 / 1024:.2f} MB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压缩 public/ 中的图片并生成 WebP/AVIF 响应式版本")
+    parser.add_argument('--public-dir', default=PUBLIC_DIR)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--manifest', default=DEFAULT_VARIANT_MANIFEST_PATH,
+                        help='变体清单路径')
+    parser.add_argument('--widths', default=','.join(map(str, DEFAULT_WIDTHS)),
+                        help='响应式宽度，逗号分隔')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认CPU核数')
+    args = parser.parse_args()
+
+    if Image is None:
+        print("❌ 需要 Pillow: pip install Pillow")
+        return 1
+    if not os.path.isdir(args.public_dir):
+        print(f"❌ 目录不存在: {args.public_dir}")
+        return 1
+
+    widths = [int(w) for w in args.widths.split(',') if w.strip()]
+    optimize_images(public_dir=args.public_dir, cache_dir=args.cache_dir,
+                    manifest_path=args.manifest, widths=widths, workers=args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,8 +10,14 @@ import http.server
 import socketserver
 import urllib.parse
 import json
+import argparse
 from pathlib import Path
 
+from site_publisher import Publisher
+
+# 保存后自动发布的后台线程，start_editor 中按参数创建
+publisher = None
+
 class MarkdownEditorHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
         # 处理nginx代理路径
@@ -21,6 +27,8 @@ class MarkdownEditorHandler(http.server.SimpleHTTPRequestHandler):
             self.list_files()
         elif self.path.startswith('/api/read/'):
             self.read_file()
+        elif self.path.startswith('/api/publish-status'):
+            self.publish_status()
         else:
             super().do_GET()
     
@@ -457,6 +465,7 @@ class MarkdownEditorHandler(http.server.SimpleHTTPRequestHandler):
             <div class="toolbar">
                 <span class="current-file" id="currentFile">选择一个文件开始编辑</span>
                 <div class="toolbar-right">
+                    <span id="publishStatus" style="color: #666; font-size: 13px; margin-right: 8px;"></span>
                     <button onclick="saveFile()" id="saveBtn" disabled>💾 保存</button>
                     <button onclick="refreshFiles()">🔄 刷新</button>
                 </div>
@@ -851,7 +860,13 @@ Ctrl+S: 保存文件" disabled></textarea>
                 });
                 
                 if (response.ok) {
-                    alert('✅ 文件保存成功！');
+                    const seq = response.headers.get('X-Publish-Seq');
+                    if (seq) {
+                        // 后台会合并连续的保存并自动构建发布，这里轮询发布结果
+                        trackPublish(parseInt(seq, 10));
+                    } else {
+                        alert('✅ 文件保存成功！');
+                    }
                 } else {
                     throw new Error('保存失败');
                 }
@@ -860,6 +875,35 @@ Ctrl+S: 保存文件" disabled></textarea>
             }
         }
         
+        let publishTimer = null;
+        
+        async function trackPublish(seq) {
+            const status = document.getElementById('publishStatus');
+            status.textContent = '✅ 已保存，等待发布...';
+            clearTimeout(publishTimer);
+            
+            const poll = async () => {
+                try {
+                    const response = await fetch('/api/publish-status');
+                    const data = await response.json();
+                    if (data.published < seq) {
+                        status.textContent = data.state === 'building' ? '🏗️ 正在构建发布...' : '✅ 已保存，等待发布...';
+                        publishTimer = setTimeout(poll, 1000);
+                        return;
+                    }
+                    const last = data.last;
+                    if (last && last.ok) {
+                        status.textContent = `🌐 已发布（${last.latency.toFixed(1)}s，构建 ${last.build_seconds.toFixed(1)}s，更新 ${last.pages} 个页面，上传 ${last.uploaded} 个资源）`;
+                    } else {
+                        status.textContent = '❌ 发布失败：' + (last ? last.error : '未知错误');
+                    }
+                } catch (error) {
+                    publishTimer = setTimeout(poll, 3000);
+                }
+            };
+            publishTimer = setTimeout(poll, 1000);
+        }
+        
         function refreshFiles() {
             loadFiles();
         }
@@ -1027,23 +1071,48 @@ Ctrl+S: 保存文件" disabled></textarea>
             
             self.send_response(200)
             self.send_header('Content-type', 'text/plain; charset=utf-8')
+            if publisher:
+                # 只登记，构建和上传在后台线程中进行，保存请求立即返回
+                self.send_header('X-Publish-Seq', str(publisher.request()))
             self.end_headers()
             self.wfile.write('保存成功'.encode('utf-8'))
         except Exception as e:
             self.send_error(500, str(e))
 
-def start_editor(port=8080):
+    def publish_status(self):
+        """返回后台发布状态"""
+        status = publisher.status() if publisher else {'state': 'disabled'}
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(json.dumps(status, ensure_ascii=False).encode('utf-8'))
+
+def start_editor(port=8080, auto_publish=True, upload=True):
     """启动编辑器服务"""
+    global publisher
     os.chdir('/root/cuhkstudy')
     
+    if auto_publish:
+        publisher = Publisher(upload=upload)
+    
     with socketserver.TCPServer(("", port), MarkdownEditorHandler) as httpd:
         print(f"🚀 Markdown Editor started at http://localhost:{port}")
         print(f"📝 You can now edit markdown files in your browser!")
         print(f"🔗 Open: http://your-server-ip:{port}")
+        if publisher:
+            print(f"🏗️  Auto publish on save: {'build + R2 upload' if upload else 'build only'}")
         print(f"⭐ Press Ctrl+C to stop")
         httpd.serve_forever()
 
+def main():
+    parser = argparse.ArgumentParser(description="Markdown在线编辑器")
+    parser.add_argument('port', nargs='?', type=int, default=8888)
+    parser.add_argument('--no-publish', action='store_true', help='保存后不自动构建发布')
+    parser.add_argument('--no-upload', action='store_true',
+                        help='自动发布时只构建Hugo，不上传R2（已运行 r2_watch.py 时使用）')
+    args = parser.parse_args()
+    start_editor(args.port, auto_publish=not args.no_publish, upload=not args.no_upload)
+
 if __name__ == "__main__":
-    import sys
-    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8888
-    start_editor(port)
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,81 +1,65 @@
 #!/usr/bin/env python3
 """
 优化的CDN上传脚本 - 只上传大文件，排除字体和PDF.js
+上传前先用 image_optimizer 压缩图片，并一起上传生成的 WebP/AVIF 响应式版本
 """
-import os
-import boto3
+import sys
 from pathlib import Path
 
-def upload_large_files_only():
+from asset_scanner import scan
+from image_optimizer import optimize_images
+from r2_client import load_config
+from r2_uploader import make_task, upload_one
+import rate_limiter
+import upload_telemetry
+
+def upload_large_files_only(optimize=True, base_path='/var/www/cuhkstudy/public'):
     """只上传大图片和PDF文件到CDN"""
     
-    # 配置
-    s3_client = boto3.client(
-        's3',
-        endpoint_url='https://447991a9c9d7dad31c67040315d483b2.r2.cloudflarestorage.com',
-        aws_access_key_id='15f81283b1e9092dc433661173e17caa',
-        aws_secret_access_key='0a92b00e366dcd0923743da7c8e5b4680d83af1b45cfa114160a77309aafeb79',
-        region_name='auto'
-    )
-    
-    bucket_name = 'cuhkstudy'
-    base_path = Path('/var/www/cuhkstudy/public')
+    # 配置（端点和凭据来自 .env，见 r2_client）
+    bucket_name = load_config()['bucket']
+    base_path = Path(base_path)
     
-    # 要上传的文件类型和大小限制
+    # 要上传的文件类型和大小限制，排除PDF.js相关文件
     upload_rules = [
-        {'pattern': '*.png', 'min_size': 1024*1024},  # PNG > 1MB
-        {'pattern': '*.jpg', 'min_size': 500*1024},   # JPG > 500KB  
-        {'pattern': '*.jpeg', 'min_size': 500*1024},  # JPEG > 500KB
-        {'pattern': '*.pdf', 'min_size': 0},          # 所有PDF
+        {'name': 'png', 'ext': ['.png'], 'min_size': 1024*1024},           # PNG > 1MB
+        {'name': 'jpg', 'ext': ['.jpg', '.jpeg'], 'min_size': 500*1024},   # JPG/JPEG > 500KB
+        {'name': 'pdf', 'ext': ['.pdf'], 'min_size': 0},                   # 所有PDF
     ]
     
     uploaded_files = []
     
-    for rule in upload_rules:
-        pattern = rule['pattern']
-        min_size = rule['min_size']
-        
-        for file_path in base_path.rglob(pattern):
-            # 跳过PDF.js相关文件
-            if 'pdfjs' in str(file_path):
-                continue
-                
-            file_size = file_path.stat().st_size
-            if file_size >= min_size:
-                relative_path = file_path.relative_to(base_path)
-                s3_key = str(relative_path)
-                
-                try:
-                    s3_client.upload_file(
-                        str(file_path), 
-                        bucket_name, 
-                        s3_key,
-                        ExtraArgs={'ContentType': get_content_type(file_path)}
-                    )
-                    uploaded_files.append({
-                        'file': s3_key,
-                        'size': f"{file_size/1024/1024:.1f}MB"
-                    })
-                    print(f"✅ 已上传: {s3_key} ({file_size/1024/1024:.1f}MB)")
-                except Exception as e:
-                    print(f"❌ 上传失败: {s3_key} - {e}")
+    # 按原始大小挑选文件，优化后变小的图片仍然上传
+    items = list(scan(base_path, upload_rules, extra_ignores=['pdfjs/']))
+    if optimize:
+        images = [item for item in items if item['rule']['name'] != 'pdf']
+        for entry in optimize_images(images, public_dir=str(base_path)).values():
+            for variant in entry['variants']:
+                path = base_path / variant['path']
+                items.append({'path': str(path), 'rel_path': variant['path'],
+                              'size': variant['size'], 'rule': {'name': variant['format']}})
+    
+    for item in items:
+        s3_key = item['rel_path']
+        # upload_one 负责限速、重试和遥测，Cache-Control 按缓存策略设置
+        result = upload_one(make_task(item['path'], s3_key), bucket_name)
+        if result['success']:
+            file_size = result['size']
+            uploaded_files.append({
+                'file': s3_key,
+                'size': f"{file_size/1024/1024:.1f}MB"
+            })
+            print(f"✅ 已上传: {s3_key} ({file_size/1024/1024:.1f}MB)")
+        else:
+            print(f"❌ 上传失败: {s3_key} - {result['error']}")
     
     print(f"\n📊 上传总结: 共上传 {len(uploaded_files)} 个大文件")
     total_size = sum(float(f['size'].replace('MB', '')) for f in uploaded_files)
     print(f"📁 总大小: {total_size:.1f}MB")
+    rate_limiter.report()
+    upload_telemetry.write('optimized_cdn_upload')
     
     return uploaded_files
 
-def get_content_type(file_path):
-    """获取文件MIME类型"""
-    suffix = file_path.suffix.lower()
-    content_types = {
-        '.png': 'image/png',
-        '.jpg': 'image/jpeg', 
-        '.jpeg': 'image/jpeg',
-        '.pdf': 'application/pdf'
-    }
-    return content_types.get(suffix, 'application/octet-stream')
-
 if __name__ == "__main__":
-    upload_large_files_only()
+    upload_large_files_only(optimize='--no-optimize' not in sys.argv[1:])
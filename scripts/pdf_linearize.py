@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF线性化（"快速Web查看"）
+线性化后的PDF把第一页需要的对象放在文件开头，并在开头写入线性化字典，
+pdf.js 通过Range请求只取前面一段就能渲染第一页，不必等整个文件下载完
+
+- Hugo构建后就地线性化 public/ 中的PDF（已线性化的直接跳过）；uploads/、static/pdfs/
+  中受git跟踪的源文件不做改动，每次构建都从缓存重新复制到 public/
+- 结果按源文件MD5缓存，同一个原始文件再次出现时直接复用，不会重新处理
+- 优先使用 pikepdf，没有时调用 qpdf 命令；两者都没有时跳过
+- --check 对已发布的URL发送Range请求，确认服务端支持断点续传并报告首页所需字节数
+
+用法:
+    python3 scripts/pdf_linearize.py [--workers N]
+    python3 scripts/pdf_linearize.py --check https://cdn.example.com/pdfs/a.pdf
+"""
+
+import os
+import re
+import sys
+import shutil
+import argparse
+import subprocess
+import concurrent.futures
+
+try:
+    import pikepdf
+except ImportError:  # 回退到 qpdf 命令行
+    pikepdf = None
+
+from asset_scanner import scan
+from file_hasher import calculate_md5
+
+BASE_DIR = '/var/www/cuhkstudy'
+PDF_DIRS = ['public']
+DEFAULT_CACHE_DIR = '/var/www/cuhkstudy/.pdf_cache'
+
+PDF_RULES = [
+    {'name': 'pdf', 'ext': ['.pdf']},
+]
+
+# 线性化字典必须位于文件的前1024字节内
+HEADER_SIZE = 1024
+LINEARIZED_RE = re.compile(rb'/Linearized\s+[\d.]+')
+PARAM_RE = re.compile(rb'/([LHOENT])\s*(\[[^\]]*\]|\d+)')
+
+
+def linearization_info(head):
+    """
+    解析文件开头的线性化字典
+    返回 {'length': /L 文件长度, 'first_page_end': /E 首页结束偏移, 'pages': /N}，未线性化返回 None
+    """
+    match = LINEARIZED_RE.search(head[:HEADER_SIZE])
+    if not match:
+        return None
+    end = head.find(b'>>', match.end())
+    params = dict(PARAM_RE.findall(head[match.end():end if end != -1 else None]))
+    try:
+        return {
+            'length': int(params[b'L']),
+            'first_page_end': int(params[b'E']),
+            'pages': int(params[b'N']),
+        }
+    except (KeyError, ValueError):
+        return None
+
+
+def is_linearized(path):
+    """文件已线性化且之后没有被增量修改（/L 与实际大小一致）"""
+    with open(path, 'rb') as f:
+        info = linearization_info(f.read(HEADER_SIZE))
+    return info is not None and info['length'] == os.path.getsize(path)
+
+
+def backend_name():
+    if pikepdf is not None:
+        return 'pikepdf'
+    if shutil.which('qpdf'):
+        return 'qpdf'
+    return None
+
+
+def linearize_to(src, dst):
+    """把 src 线性化写入 dst"""
+    if pikepdf is not None:
+        with pikepdf.open(src) as pdf:
+            pdf.save(dst, linearize=True)
+        return
+
+    # qpdf 退出码 3 表示成功但有警告（常见于扫描件）
+    result = subprocess.run(['qpdf', '--linearize', src, dst], capture_output=True, text=True)
+    if result.returncode not in (0, 3):
+        raise RuntimeError(result.stderr.strip() or f"qpdf 退出码 {result.returncode}")
+
+
+def linearize_file(path, cache_dir):
+    """
+    就地线性化单个PDF（在子进程中运行）
+    返回 (状态, 原大小, 新大小)，状态为 linearized/cached/skipped/failed
+    """
+    size = os.path.getsize(path)
+    if is_linearized(path):
+        return 'skipped', size, size
+
+    md5 = calculate_md5(path)
+    cache_path = os.path.join(cache_dir, md5[:2], md5 + '.pdf')
+    failed_marker = cache_path + '.failed'
+    if os.path.exists(failed_marker):
+        return 'failed', size, size
+
+    status = 'cached'
+    if not os.path.exists(cache_path):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            linearize_to(path, tmp_path)
+        except Exception as e:
+            # 损坏的PDF记下来，下次不再尝试
+            with open(failed_marker, 'w', encoding='utf-8') as f:
+                f.write(str(e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return 'failed', size, size
+        os.replace(tmp_path, cache_path)
+        status = 'linearized'
+
+    # 复制而不是硬链接：hugo 会原地重写 public/ 中的文件，不能波及缓存。
+    # 不保留原文件的修改时间，按 mtime 判断变更的同步步骤才能看到新内容
+    tmp_path = f"{path}.tmp"
+    shutil.copyfile(cache_path, tmp_path)
+    os.replace(tmp_path, path)
+    return status, size, os.path.getsize(path)
+
+
+def linearize_pdfs(base_dir=BASE_DIR, dirs=None, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """并行线性化各目录中的PDF，返回 {状态: 文件数}"""
+    backend = backend_name()
+    if backend is None:
+        print("⚠️  未安装 pikepdf（pip install pikepdf）或 qpdf，跳过PDF线性化")
+        return {}
+
+    dirs = [d for d in (dirs or PDF_DIRS) if os.path.isdir(os.path.join(base_dir, d))]
+    files = [item['path'] for item in scan(base_dir, PDF_RULES, subdirs=dirs,
+                                           extra_ignores=['pdfjs/'])]
+    print(f"📄 检查 {len(files)} 个PDF的线性化（{backend}）...")
+
+    counts = {'linearized': 0, 'cached': 0, 'skipped': 0, 'failed': 0}
+    saved = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(linearize_file, path, cache_dir): path for path in files}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                status, before, after = future.result()
+            except Exception as e:
+                status, before, after = 'failed', 0, 0
+                print(f"  ❌ {os.path.relpath(path, base_dir)}: {e}")
+            counts[status] += 1
+            saved += before - after
+            if status == 'linearized':
+                print(f"  ✅ {os.path.relpath(path, base_dir)} ({after / 1024 / 1024:.1f}MB)")
+            elif status == 'failed':
+                print(f"  ⚠️  无法线性化: {os.path.relpath(path, base_dir)}")
+
+    print(f"📊 新线性化 {counts['linearized']} 个，缓存 {counts['cached']} 个，"
+          f"已是线性化 {counts['skipped']} 个，失败 {counts['failed']} 个"
+          f"（大小变化 {-saved / 1024:+.0f}KB）")
+    return counts
+
+
+def check_range(url, timeout=30):
+    """
+    用Range请求检查已发布的PDF：服务端必须返回206，
+    且文件开头带线性化字典，首页只需下载 /E 字节
+    返回 (是否通过, 说明)
+    """
+    import requests
+
+    try:
+        response = requests.get(url, headers={'Range': f'bytes=0-{HEADER_SIZE - 1}'},
+                                timeout=timeout)
+    except requests.RequestException as e:
+        return False, f"请求失败: {e}"
+
+    if response.status_code != 206:
+        return False, f"不支持Range请求（状态码 {response.status_code}），pdf.js 只能整体下载"
+
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    info = linearization_info(response.content)
+    if info is None:
+        return False, f"支持Range请求，但文件未线性化（共 {total} 字节），首页需要等待整个文件"
+    if total.isdigit() and int(total) != info['length']:
+        return False, "线性化字典与文件大小不符（线性化后又被增量修改），需要重新线性化"
+
+    share = info['first_page_end'] / info['length'] * 100
+    return True, (f"首页只需前 {info['first_page_end'] / 1024:.0f}KB"
+                  f"（全文 {info['length'] / 1024 / 1024:.1f}MB 的 {share:.1f}%，共 {info['pages']} 页）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线性化PDF以便 pdf.js 按Range请求快速显示首页")
+    parser.add_argument('--base-dir', default=BASE_DIR)
+    parser.add_argument('--dirs', nargs='+', default=PDF_DIRS, help='相对 base-dir 的目录')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认CPU核数')
+    parser.add_argument('--check', nargs='+', metavar='URL',
+                        help='不做线性化，只用Range请求检查这些已发布的PDF')
+    args = parser.parse_args()
+
+    if args.check:
+        ok = True
+        for url in args.check:
+            passed, message = check_range(url)
+            ok = ok and passed
+            print(f"{'✅' if passed else '❌'} {url}\n   {message}")
+        return 0 if ok else 1
+
+    counts = linearize_pdfs(args.base_dir, args.dirs, args.cache_dir, args.workers)
+    return 1 if counts.get('failed') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态文件预压缩
+Hugo构建后为 public/ 中可压缩的文本文件（含 pdfjs 的 .mjs 大文件）生成 .gz 和 .br 副本，
+nginx 通过 gzip_static / brotli_static 直接发送，不再为每个请求实时压缩
+
+- 多进程并行压缩
+- 压缩结果按源文件MD5缓存在 public/ 之外，hugo --cleanDestinationDir 之后
+  内容未变的文件直接从缓存复制，不会重新压缩
+- 可选把压缩副本连同 Content-Encoding 上传到R2
+
+用法:
+    python3 scripts/precompress.py [--upload] [--workers N]
+"""
+
+import os
+import sys
+import gzip
+import shutil
+import filecmp
+import hashlib
+import argparse
+import concurrent.futures
+
+try:
+    import brotli
+except ImportError:  # 未安装时只生成 .gz
+    brotli = None
+
+from asset_scanner import scan
+
+PUBLIC_DIR = '/var/www/cuhkstudy/public'
+DEFAULT_CACHE_DIR = '/var/www/cuhkstudy/.precompress_cache'
+
+COMPRESSIBLE_RULES = [
+    {
+        'name': 'text',
+        'ext': ['.html', '.htm', '.css', '.js', '.mjs', '.json', '.map', '.xml',
+                '.svg', '.txt', '.ftl', '.webmanifest', '.ico', '.ttf', '.eot'],
+        'min_size': 1024,  # 与 nginx gzip_min_length 一致
+    },
+]
+
+# 压缩后至少要比原文件小这么多才保留
+MIN_SAVING = 0.05
+
+ENCODINGS = {
+    'gzip': '.gz',
+    'br': '.br',
+}
+
+
+def compress_bytes(data, encoding):
+    """用指定编码压缩，gzip 固定 mtime=0 保证结果可复现"""
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+
+def place_output(cache_path, out_path, link=True):
+    """
+    把缓存中的结果放到 public/（优先硬链接，跨文件系统时复制）
+    link=False 时总是复制：Hugo 会截断并原地重写 public/ 中与源文件同名的文件，
+    硬链接会让它把新内容写进缓存
+    """
+    try:
+        same = os.path.samefile(cache_path, out_path)
+    except OSError:
+        same = False
+    if same and link:
+        # 已经是同一个硬链接；此时 rename 什么也不做，会留下 .tmp
+        return
+    if not link and not same and os.path.exists(out_path) \
+            and filecmp.cmp(cache_path, out_path, shallow=False):
+        return
+
+    tmp_path = f"{out_path}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    if link:
+        try:
+            os.link(cache_path, tmp_path)
+        except OSError:
+            link = False
+    if not link:
+        shutil.copyfile(cache_path, tmp_path)
+    os.replace(tmp_path, out_path)
+
+
+def compress_file(path, encodings, cache_dir):
+    """
+    为单个文件生成压缩副本（在子进程中运行）
+    返回 {'path', 'md5', 'size', 'outputs': {编码: 大小}, 'compressed': 新压缩的编码列表}
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    md5 = hashlib.md5(data).hexdigest()
+    result = {'path': path, 'md5': md5, 'size': len(data), 'outputs': {}, 'compressed': []}
+
+    for encoding in encodings:
+        suffix = ENCODINGS[encoding]
+        out_path = path + suffix
+        cache_path = os.path.join(cache_dir, md5[:2], md5 + suffix)
+        skip_marker = cache_path + '.skip'
+
+        if not os.path.exists(skip_marker) and not os.path.exists(cache_path):
+            compressed = compress_bytes(data, encoding)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            if len(compressed) > len(data) * (1 - MIN_SAVING):
+                open(skip_marker, 'w').close()
+            else:
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(compressed)
+                os.replace(tmp_path, cache_path)
+                result['compressed'].append(encoding)
+
+        if os.path.exists(skip_marker):
+            # 压缩收益太小：删除旧内容留下的压缩副本，否则 gzip_static 会继续提供过期内容
+            if os.path.lexists(out_path):
+                os.remove(out_path)
+            continue
+
+        place_output(cache_path, out_path)
+        result['outputs'][encoding] = os.path.getsize(out_path)
+
+    return result
+
+
+def precompress(public_dir=PUBLIC_DIR, cache_dir=DEFAULT_CACHE_DIR, workers=None, encodings=None):
+    """并行预压缩 public/，返回每个源文件的结果列表"""
+    if encodings is None:
+        encodings = ['gzip', 'br'] if brotli else ['gzip']
+    if 'br' in encodings and brotli is None:
+        print("⚠️  未安装 brotli 模块（pip install brotli），只生成 .gz")
+        encodings = [e for e in encodings if e != 'br']
+
+    files = [item['path'] for item in scan(public_dir, COMPRESSIBLE_RULES)]
+    print(f"🗜️  预压缩 {len(files)} 个文件（{', '.join(encodings)}）...")
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compress_file, path, encodings, cache_dir) for path in files]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"  ❌ 压缩失败: {e}")
+
+    compressed = sum(1 for r in results if r['compressed'])
+    original = sum(r['size'] for r in results if r['outputs'])
+    gz_total = sum(r['outputs'].get('gzip', 0) for r in results)
+    print(f"📊 新压缩 {compressed} 个文件，其余 {len(results) - compressed} 个来自缓存")
+    if original and gz_total:
+        print(f"   📦 gzip: {original / 1024 / 1024:.2f} MB -> {gz_total / 1024 / 1024:.2f} MB")
+
+    return results
+
+
+def upload_variants(results, base_dir='/var/www/cuhkstudy', workers=None):
+    """把压缩副本连同 Content-Encoding 上传到R2（键为原文件键加 .gz/.br 后缀）"""
+    from r2_client import load_config
+    from r2_uploader import make_task, upload_files, DEFAULT_WORKERS
+    from content_types import get_content_type
+
+    tasks = []
+    for result in results:
+        for encoding in result['outputs']:
+            path = result['path'] + ENCODINGS[encoding]
+            key = os.path.relpath(path, base_dir)
+            tasks.append(make_task(path, key, content_type=get_content_type(result['path']),
+                                   content_encoding=encoding))
+
+    print(f"📤 上传 {len(tasks)} 个压缩副本...")
+    uploaded = upload_files(tasks, load_config()['bucket'], max_workers=workers or DEFAULT_WORKERS)
+    failed = [r for r in uploaded if not r['success']]
+    for r in failed:
+        print(f"  ❌ {r['r2_key']}: {r['error']}")
+    print(f"  ✅ 成功 {len(uploaded) - len(failed)}/{len(uploaded)}")
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为 public/ 生成 .gz/.br 预压缩文件")
+    parser.add_argument('--public-dir', default=PUBLIC_DIR)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help='压缩进程数，默认CPU核数')
+    parser.add_argument('--upload', action='store_true', help='同时把压缩副本上传到R2')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.public_dir):
+        print(f"❌ 目录不存在: {args.public_dir}")
+        return 1
+
+    results = precompress(args.public_dir, args.cache_dir, args.workers)
+    if args.upload:
+        from upload_telemetry import write
+
+        uploaded = upload_variants(results, os.path.dirname(args.public_dir.rstrip('/')))
+        write('precompress')
+        if not uploaded:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
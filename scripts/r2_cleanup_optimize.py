@@ -10,28 +10,29 @@ R2 CDN 清理和优化脚本
 
 import os
 import sys
-import json
-import subprocess
-import hashlib
+import argparse
 from pathlib import Path
 from collections import defaultdict
 from dotenv import load_dotenv
 
+from asset_scanner import scan
+from dedup import find_duplicates, pick_winners
+from r2_client import load_config, get_client
+from r2_diff import list_remote_objects
+from r2_inventory import Inventory
+from r2_uploader import (
+    make_task, upload_files, delete_batches, DEFAULT_WORKERS, DEFAULT_DELETE_WORKERS
+)
+import rate_limiter
+import upload_telemetry
+
 load_dotenv()
 
-R2_ENDPOINT = os.getenv('R2_ENDPOINT')
-R2_BUCKET = os.getenv('R2_BUCKET')
+R2_CONFIG = load_config()
+R2_ENDPOINT = R2_CONFIG['endpoint']
+R2_BUCKET = R2_CONFIG['bucket']
 
-def run_aws_cmd(cmd):
-    """执行AWS CLI命令"""
-    full_cmd = f"{cmd} --profile r2-cuhkstudy --endpoint-url {R2_ENDPOINT}"
-    try:
-        result = subprocess.run(full_cmd, shell=True, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"❌ 命令失败: {cmd}")
-        print(f"错误: {e.stderr}")
-        return None
+BASE_DIR = "/var/www/cuhkstudy"
 
 def get_file_size(file_path):
     """获取文件大小(MB)"""
@@ -40,231 +41,201 @@ def get_file_size(file_path):
     except:
         return 0
 
-def calculate_md5(file_path):
-    """计算文件MD5"""
-    try:
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    except:
-        return None
+# 需要删除的路径模式
+DELETE_PATTERNS = [
+    "resource/",      # 弃用目录
+    "resources/",     # 弃用目录  
+    "Uploads/",       # 用户上传目录，不需要CDN
+    "themes/blowfish/exampleSite/",  # 示例文件
+    "themes/blowfish/assets/",       # 主题资源
+    "themes/blowfish/static/",       # 主题静态文件
+    "content/",       # 内容源文件
+]
+
+DRY_RUN_REPORT = "r2_cleanup_dry_run.txt"
+
+# 本地清单超过这个时间（秒）就先刷新
+INVENTORY_MAX_AGE = 3600
 
-def clean_r2_bucket():
-    """清理R2存储桶中的冗余文件"""
-    print("🧹 开始清理R2存储桶...")
+def cleanup_reason(key, size):
+    """对象需要删除的原因，保留的对象返回 None"""
+    for pattern in DELETE_PATTERNS:
+        if key.startswith(pattern):
+            return pattern
     
-    # 获取所有文件列表
-    list_cmd = f"aws s3 ls s3://{R2_BUCKET}/ --recursive"
-    files_output = run_aws_cmd(list_cmd)
+    # 小文件 (< 100KB)：只保留PDF文件，删除小图标等
+    if size < 100 * 1024 and not key.endswith('.pdf'):
+        return "小于100KB"
     
-    if not files_output:
-        print("❌ 无法获取R2文件列表")
-        return False
+    return None
+
+def load_inventory(force_refresh=False, max_age=INVENTORY_MAX_AGE):
+    """打开本地存储桶清单，过期或从未刷新时先并发刷新"""
+    inventory = Inventory()
+    age = inventory.age()
+    if force_refresh or age is None or age > max_age:
+        print("🗂️  刷新本地存储桶清单...")
+        result = inventory.refresh(R2_BUCKET)
+        if result['failed']:
+            inventory.close()
+            raise RuntimeError(f"前缀列出失败: {', '.join(result['failed'])}")
+        print(f"  ✅ {result['objects']} 个对象")
+    else:
+        print(f"🗂️  使用 {age / 60:.0f} 分钟前的本地存储桶清单")
+    return inventory
+
+def clean_r2_bucket(dry_run=False, workers=DEFAULT_DELETE_WORKERS, report_path=DRY_RUN_REPORT,
+                    inventory=None):
+    """
+    清理R2存储桶中的冗余文件
+    有本地清单（r2_inventory）时从清单读取对象，删除后同步更新清单；
+    否则分页列出存储桶的同时按批删除（列表和删除交叠进行，内存占用与桶大小无关）；
+    dry_run 时只把将要删除的对象写入报告
+    """
+    print(f"🧹 开始清理R2存储桶{'（试运行，不会删除）' if dry_run else ''}...")
     
-    # 需要删除的路径模式
-    delete_patterns = [
-        "resource/",      # 弃用目录
-        "resources/",     # 弃用目录  
-        "Uploads/",       # 用户上传目录，不需要CDN
-        "themes/blowfish/exampleSite/",  # 示例文件
-        "themes/blowfish/assets/",       # 主题资源
-        "themes/blowfish/static/",       # 主题静态文件
-        "content/",       # 内容源文件
-    ]
+    summary = defaultdict(lambda: [0, 0])  # 原因 -> [文件数, 字节数]
+    listed = 0
     
-    files_to_delete = []
+    def files_to_delete(report=None):
+        nonlocal listed
+        objects = inventory.iter_objects() if inventory else list_remote_objects(get_client(), R2_BUCKET)
+        for obj in objects:
+            listed += 1
+            reason = cleanup_reason(obj['key'], obj['size'])
+            if reason is None:
+                continue
+            summary[reason][0] += 1
+            summary[reason][1] += obj['size']
+            if report:
+                report.write(f"{obj['key']}\t{obj['size']}\t{reason}\n")
+            yield obj['key']
     
-    for line in files_output.split('\n'):
-        if not line.strip():
-            continue
-        
-        # 解析文件信息
-        parts = line.split()
-        if len(parts) < 4:
-            continue
-            
-        file_key = parts[3]
-        
-        # 检查是否需要删除
-        should_delete = False
-        for pattern in delete_patterns:
-            if file_key.startswith(pattern):
-                should_delete = True
-                break
-        
-        # 检查小文件 (< 100KB)
-        if not should_delete:
-            file_size_bytes = int(parts[2])
-            if file_size_bytes < 100 * 1024:  # 小于100KB
-                # 只保留PDF文件，删除小图标等
-                if not file_key.endswith('.pdf'):
-                    should_delete = True
-        
-        if should_delete:
-            files_to_delete.append(file_key)
+    try:
+        if dry_run:
+            with open(report_path, 'w', encoding='utf-8') as report:
+                for _ in files_to_delete(report):
+                    pass
+        else:
+            print("🗑️  边列出边批量删除文件...")
+            deleted = 0
+            failed = 0
+            for batch, errors in delete_batches(files_to_delete(), R2_BUCKET, workers=workers):
+                deleted += len(batch) - len(errors)
+                failed += len(errors)
+                if inventory:
+                    inventory.remove(key for key in batch if key not in errors)
+                for key, reason in list(errors.items())[:5]:
+                    print(f"  ❌ 删除失败: {key} - {reason}")
+                print(f"  ✅ 删除了 {len(batch) - len(errors)} 个文件（累计 {deleted}）")
+    except Exception as e:
+        print(f"❌ 无法获取R2文件列表: {e}")
+        return False
     
-    print(f"📋 发现 {len(files_to_delete)} 个文件需要删除")
+    total = sum(count for count, _ in summary.values())
+    print(f"📋 共列出 {listed} 个对象，{total} 个需要删除:")
+    for reason, (count, size) in sorted(summary.items(), key=lambda x: -x[1][1]):
+        print(f"  - {reason}: {count} 个，{size / 1024 / 1024:.2f} MB")
     
-    # 批量删除
-    if files_to_delete:
-        print("🗑️  开始批量删除文件...")
-        
-        # 每次删除1000个文件
-        batch_size = 1000
-        for i in range(0, len(files_to_delete), batch_size):
-            batch = files_to_delete[i:i+batch_size]
-            
-            # 创建删除清单文件
-            delete_list = "delete-list.json"
-            delete_objects = {
-                "Objects": [{"Key": key} for key in batch],
-                "Quiet": True
-            }
-            
-            with open(delete_list, 'w') as f:
-                json.dump(delete_objects, f)
-            
-            # 执行删除
-            delete_cmd = f"aws s3api delete-objects --bucket {R2_BUCKET} --delete file://{delete_list}"
-            if run_aws_cmd(delete_cmd):
-                print(f"  ✅ 删除了 {len(batch)} 个文件")
-            else:
-                print(f"  ❌ 删除失败")
-            
-            # 清理临时文件
-            os.remove(delete_list)
+    if dry_run:
+        print(f"📝 待删除列表已写入: {report_path}")
+        return True
     
+    if failed:
+        print(f"⚠️  {failed} 个文件删除失败")
+        return False
     print("✅ R2清理完成")
     return True
 
-def find_large_files():
+# 重复文件保留路径的优先级
+PRIORITY_ORDER = [
+    'static/',      # 最高优先级
+    'assets/',      # 次优先级  
+    'public/',      # 最低优先级
+]
+
+def find_large_files(base_dir=BASE_DIR):
     """查找需要CDN的大文件"""
     print("🔍 分析需要CDN的大文件...")
     
-    target_dirs = [
-        "/var/www/cuhkstudy/static",
-        "/var/www/cuhkstudy/assets", 
-        "/var/www/cuhkstudy/public"
+    target_dirs = ["static", "assets", "public"]
+    
+    # 只处理大文件(>100KB)或PDF
+    large_file_rules = [
+        {'name': 'pdf', 'ext': ['.pdf']},
+        {'name': 'large', 'min_size': int(0.1 * 1024 * 1024) + 1},
     ]
     
+    print(f"📂 扫描 {', '.join(target_dirs)}")
+    
     large_files = []
-    duplicates = defaultdict(list)
+    for item in scan(base_dir, large_file_rules, subdirs=target_dirs):
+        item['size_mb'] = item['size'] / 1024 / 1024
+        item['ext'] = Path(item['rel_path']).suffix.lower()
+        large_files.append(item)
     
-    for base_dir in target_dirs:
-        if not os.path.exists(base_dir):
-            continue
-            
-        print(f"📂 扫描 {base_dir}")
-        
-        for root, dirs, files in os.walk(base_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_size = get_file_size(file_path)
-                
-                # 只处理大文件或PDF
-                if file_size > 0.1 or file.endswith(('.pdf', '.PDF')):  # >100KB 或 PDF
-                    file_md5 = calculate_md5(file_path)
-                    if file_md5:
-                        rel_path = os.path.relpath(file_path, "/var/www/cuhkstudy")
-                        
-                        large_files.append({
-                            'path': file_path,
-                            'rel_path': rel_path,
-                            'size_mb': file_size,
-                            'md5': file_md5,
-                            'ext': Path(file).suffix.lower()
-                        })
-                        
-                        duplicates[file_md5].append(rel_path)
+    # 先按大小、再按首尾部分哈希筛选，只有仍然相同的文件才计算完整MD5
+    duplicates, stats = find_duplicates(large_files)
+    print(f"  📁 {stats['files']} 个文件，{stats['size_candidates']} 个大小有重复，"
+          f"部分哈希 {stats['partial_hashed']} 个，完整MD5 {stats['full_hashed']} 个，"
+          f"硬链接 {stats['hardlinks']} 个")
     
     # 输出重复文件报告
     print("\n📊 重复文件分析:")
-    for md5, paths in duplicates.items():
-        if len(paths) > 1:
-            print(f"  🔄 MD5: {md5[:8]}... 有 {len(paths)} 个副本:")
-            for path in paths:
-                print(f"    - {path}")
+    for group in duplicates:
+        md5 = group[0]['md5'] or '硬链接'
+        print(f"  🔄 MD5: {md5[:8]}... 有 {len(group)} 个副本:")
+        for file_info in group:
+            print(f"    - {file_info['rel_path']}")
     
     return large_files, duplicates
 
+def path_priority(file_info):
+    """重复文件中保留哪一个：按目录优先级，其次路径较短的"""
+    rel_path = file_info['rel_path']
+    for i, prefix in enumerate(PRIORITY_ORDER):
+        if rel_path.startswith(prefix):
+            return (i, len(rel_path), rel_path)
+    return (len(PRIORITY_ORDER), len(rel_path), rel_path)
+
 def create_optimized_upload_list(large_files, duplicates):
-    """创建优化的上传列表"""
+    """创建优化的上传列表：唯一文件全部保留，每组重复文件只保留优先级最高的一个"""
     print("📝 创建优化上传策略...")
     
-    upload_list = []
-    processed_md5 = set()
-    
-    # 优先级规则
-    priority_order = [
-        'static/',      # 最高优先级
-        'assets/',      # 次优先级  
-        'public/',      # 最低优先级
-    ]
-    
-    for file_info in large_files:
-        md5 = file_info['md5']
-        
-        # 跳过已处理的重复文件
-        if md5 in processed_md5:
-            continue
-        
-        # 对于重复文件，选择最优路径
-        if len(duplicates[md5]) > 1:
-            best_path = None
-            best_priority = 999
-            
-            for dup_path in duplicates[md5]:
-                for i, prefix in enumerate(priority_order):
-                    if dup_path.startswith(prefix):
-                        if i < best_priority:
-                            best_priority = i
-                            best_path = dup_path
-                        break
-            
-            if best_path:
-                # 找到对应的file_info
-                for f in large_files:
-                    if f['rel_path'] == best_path:
-                        upload_list.append(f)
-                        processed_md5.add(md5)
-                        break
-        else:
-            upload_list.append(file_info)
-            processed_md5.add(md5)
-    
-    return upload_list
+    winner_of = pick_winners(duplicates, path_priority)
+    return [f for f in large_files if winner_of.get(f['path'], f) is f]
 
-def upload_optimized_files(upload_list):
+def upload_optimized_files(upload_list, workers=DEFAULT_WORKERS):
     """上传优化后的文件列表"""
     print(f"📤 开始上传 {len(upload_list)} 个优化文件...")
     
-    success_count = 0
-    total_size = 0
-    
+    tasks = []
+    sizes = {}
     for file_info in upload_list:
         file_path = file_info['path']
-        rel_path = file_info['rel_path']
-        size_mb = file_info['size_mb']
         
         # 优化S3 key路径
-        s3_key = rel_path
+        s3_key = file_info['rel_path']
         if s3_key.startswith('public/'):
             s3_key = s3_key[7:]  # 去掉 public/ 前缀
         
-        print(f"📤 {file_path} -> s3://{R2_BUCKET}/{s3_key} ({size_mb:.2f}MB)")
-        
-        upload_cmd = f"""aws s3 cp "{file_path}" "s3://{R2_BUCKET}/{s3_key}" \
-            --content-type "$(file -b --mime-type '{file_path}')" \
-            --cache-control "public, max-age=31536000" \
-            --acl public-read"""
-        
-        if run_aws_cmd(upload_cmd):
+        sizes[s3_key] = file_info['size_mb']
+        tasks.append(make_task(file_path, s3_key))
+    
+    success_count = 0
+    total_size = 0
+    
+    def on_result(result):
+        nonlocal success_count, total_size
+        size_mb = sizes[result['r2_key']]
+        if result['success']:
             success_count += 1
             total_size += size_mb
+            print(f"📤 {result['local_path']} -> s3://{R2_BUCKET}/{result['r2_key']} ({size_mb:.2f}MB)")
         else:
-            print(f"  ❌ 上传失败: {rel_path}")
+            print(f"  ❌ 上传失败: {result['local_path']} - {result['error']}")
+    
+    upload_files(tasks, R2_BUCKET, max_workers=workers, on_result=on_result)
     
     print(f"\n📊 上传统计:")
     print(f"  ✅ 成功: {success_count}/{len(upload_list)} 个文件")
@@ -292,12 +263,44 @@ def clean_deprecated_dirs():
             print(f"  📁 已移动到: {backup_path}")
             print(f"  ⚠️  请确认无问题后手动删除: rm -rf {backup_path}")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="清理和优化R2 CDN")
+    parser.add_argument('--dry-run', action='store_true',
+                        help=f'只报告将要删除和上传的文件（写入 {DRY_RUN_REPORT}），不做任何修改')
+    parser.add_argument('--delete-workers', type=int, default=DEFAULT_DELETE_WORKERS,
+                        help='同时进行的 DeleteObjects 批次数')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='最大并发上传线程数')
+    parser.add_argument('--refresh-inventory', action='store_true',
+                        help='先刷新本地存储桶清单（默认超过1小时才刷新）')
+    parser.add_argument('--no-inventory', action='store_true',
+                        help='不使用本地清单，直接分页列出存储桶')
+    rate_limiter.add_arguments(parser)
+    upload_telemetry.add_arguments(parser)
+    return parser.parse_args(argv)
+
 def main():
     """主函数"""
+    args = parse_args()
     print("🚀 开始R2 CDN优化...")
     
+    try:
+        limiter = rate_limiter.configure(args.bwlimit, args.bw_schedule)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    
     # 1. 清理R2存储桶
-    if not clean_r2_bucket():
+    inventory = None
+    if not args.no_inventory:
+        try:
+            inventory = load_inventory(force_refresh=args.refresh_inventory)
+        except Exception as e:
+            print(f"⚠️  本地存储桶清单不可用，改为直接列出存储桶: {e}")
+    cleaned = clean_r2_bucket(dry_run=args.dry_run, workers=args.delete_workers,
+                              inventory=inventory)
+    if inventory:
+        inventory.close()
+    if not cleaned:
         return 1
     
     # 2. 分析本地大文件
@@ -306,9 +309,17 @@ def main():
     # 3. 创建优化上传列表
     upload_list = create_optimized_upload_list(large_files, duplicates)
     
+    if args.dry_run:
+        print(f"\n📝 试运行: 将上传 {len(upload_list)} 个文件，"
+              f"共 {sum(f['size_mb'] for f in upload_list):.2f} MB")
+        return 0
+    
     # 4. 上传优化文件
-    if not upload_optimized_files(upload_list):
+    uploaded = upload_optimized_files(upload_list, workers=args.workers)
+    upload_telemetry.write('r2_cleanup_optimize', args.metrics_dir, args.telemetry_json)
+    if not uploaded:
         return 1
+    rate_limiter.report(limiter)
     
     # 5. 清理弃用目录
     clean_deprecated_dirs()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享的R2客户端
+统一读取 .env 中的端点和凭据，整个进程共用一个带连接池的boto3客户端：
+boto3底层客户端是线程安全的，连接池（keep-alive）归客户端所有，
+因此所有工作线程共用同一个池，TLS握手和客户端构建只发生一次，而不是每个对象一次
+
+可调环境变量:
+    R2_POOL_SIZE        连接池大小（默认 64）；上传入口按 并发线程数 × 每个文件的分片线程数
+                        调用 reserve_connections() 放大，同时进行的请求不会超出连接池
+    R2_CONNECT_TIMEOUT  连接超时秒数（默认 10）
+    R2_READ_TIMEOUT     读取超时秒数（默认 120）
+    R2_MAX_ATTEMPTS     botocore 对单个请求的最大尝试次数（默认 5）
+
+get_client() 由 botocore 按 standard 模式重试，列出存储桶的分页、分片上传的创建/合并等
+没有自行重试的调用都用它；get_client(retries=False) 不做任何重试，只给已经用
+call_with_retry 或分片重传包住的上传/删除调用，这样限流信号能反馈给并发控制器，也不会重试套重试
+
+上传带宽限制在这里接入：客户端的 before-send 事件用 rate_limiter.throttle_request 包装请求体，
+所有经由共享客户端的上传都按实际发送的字节数限速
+
+boto3 在第一次创建客户端时才导入（约0.2秒），只读取配置的命令不必承担这部分启动时间
+"""
+
+import os
+import threading
+from dotenv import load_dotenv
+
+from rate_limiter import throttle_request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 先找到的 .env 优先，已有的环境变量不会被覆盖
+ENV_FILES = [
+    os.path.join(REPO_ROOT, '.env'),
+    '/root/cuhkstudy/.env',
+]
+
+DEFAULT_ENDPOINT = 'https://447991a9c9d7dad31c67040315d483b2.r2.cloudflarestorage.com'
+DEFAULT_BUCKET = 'cuhkstudy'
+AWS_PROFILE = 'r2-cuhkstudy'
+
+_lock = threading.Lock()
+_config = None
+_clients = {}
+
+
+def load_config():
+    """读取R2配置（只解析一次）"""
+    global _config
+    if _config is not None:
+        return _config
+
+    for env_file in ENV_FILES:
+        if os.path.exists(env_file):
+            load_dotenv(env_file)
+
+    account_id = os.getenv('R2_ACCOUNT_ID')
+    endpoint = os.getenv('R2_ENDPOINT')
+    if not endpoint:
+        endpoint = f"https://{account_id}.r2.cloudflarestorage.com" if account_id else DEFAULT_ENDPOINT
+    bucket = os.getenv('R2_BUCKET') or DEFAULT_BUCKET
+
+    _config = {
+        'account_id': account_id,
+        'endpoint': endpoint,
+        'bucket': bucket,
+        'access_key': os.getenv('R2_ADMIN_ACCESS_KEY'),
+        'secret_key': os.getenv('R2_ADMIN_SECRET_KEY'),
+        'public_url': os.getenv('R2_PUBLIC_URL') or f"{endpoint}/{bucket}",
+        'pool_size': int(os.getenv('R2_POOL_SIZE', '64')),
+        'connect_timeout': float(os.getenv('R2_CONNECT_TIMEOUT', '10')),
+        'read_timeout': float(os.getenv('R2_READ_TIMEOUT', '120')),
+        'max_attempts': int(os.getenv('R2_MAX_ATTEMPTS', '5')),
+    }
+    return _config
+
+
+def create_client(config=None, retries=True):
+    """
+    新建一个客户端：优先使用.env中的管理员密钥，否则使用AWS CLI的r2-cuhkstudy配置
+    retries=False 时关闭 botocore 重试，由调用方的 call_with_retry 处理
+    """
+    import boto3
+    from botocore.config import Config
+
+    config = config or load_config()
+
+    if config['access_key'] and config['secret_key']:
+        session = boto3.session.Session(
+            aws_access_key_id=config['access_key'],
+            aws_secret_access_key=config['secret_key'],
+        )
+    else:
+        session = boto3.session.Session(profile_name=AWS_PROFILE)
+
+    botocore_config = Config(
+        region_name='auto',
+        max_pool_connections=config['pool_size'],
+        connect_timeout=config['connect_timeout'],
+        read_timeout=config['read_timeout'],
+        tcp_keepalive=True,
+        retries={'mode': 'standard',
+                 'total_max_attempts': config['max_attempts'] if retries else 1},
+    )
+    client = session.client('s3', endpoint_url=config['endpoint'], config=botocore_config)
+    client.meta.events.register('before-send.s3', throttle_request)
+    return client
+
+
+def reserve_connections(count):
+    """
+    确保连接池不小于 count（同时进行的请求数），在开始并发上传前调用
+    已创建的客户端连接池偏小时丢弃，之后的 get_client() 按新的大小重建
+    """
+    config = load_config()
+    with _lock:
+        if count <= config['pool_size']:
+            return
+        config['pool_size'] = count
+        _clients.clear()
+
+
+def get_client(retries=True):
+    """返回进程内共享的客户端（首次调用时创建）；retries=False 返回不重试的那一个"""
+    client = _clients.get(retries)
+    if client is None:
+        with _lock:
+            client = _clients.get(retries)
+            if client is None:
+                client = _clients[retries] = create_client(retries=retries)
+    return client
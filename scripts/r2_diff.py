@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地文件与R2存储桶的差异比较
+分页列出存储桶对象，按对象键匹配本地文件，比较大小和MD5/ETag，
+只返回缺失或内容不同的文件；不依赖任何本地同步状态，新机器上也能使用
+"""
+
+import hashlib
+
+from file_hasher import cached_md5
+
+MB = 1024 * 1024
+
+# 推测分片上传ETag时尝试的分片大小：本仓库 r2_multipart、AWS CLI/boto3 默认值及常见取值
+CANDIDATE_PART_SIZES = [8 * MB, 5 * MB, 16 * MB, 15 * MB, 32 * MB, 64 * MB, 100 * MB]
+
+
+def list_remote_objects(client, bucket, prefix=''):
+    """分页列出存储桶对象，逐个产出 {'key', 'size', 'etag', 'last_modified'}"""
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield {
+                'key': obj['Key'],
+                'size': obj['Size'],
+                'etag': obj.get('ETag', '').strip('"'),
+                'last_modified': obj.get('LastModified'),
+            }
+
+
+def load_remote_index(client, bucket, prefix=''):
+    """把存储桶列表读入 {key: 对象信息} 索引"""
+    return {obj['key']: obj for obj in list_remote_objects(client, bucket, prefix)}
+
+
+def multipart_etag(file_path, part_size):
+    """按给定分片大小计算分片上传ETag: md5(各分片md5拼接)-分片数"""
+    digests = []
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(part_size)
+            if not chunk:
+                break
+            digests.append(hashlib.md5(chunk).digest())
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+def etag_matches(file_path, size, etag, local_md5=None, md5_func=cached_md5):
+    """
+    判断本地文件是否与远端ETag一致
+    普通ETag就是内容MD5；带 "-N" 后缀的是分片上传ETag，按可能的分片大小逐个尝试
+    """
+    if not etag:
+        return False
+
+    if '-' not in etag:
+        return (local_md5 or md5_func(file_path)) == etag
+
+    try:
+        part_count = int(etag.rsplit('-', 1)[1])
+    except ValueError:
+        return False
+
+    for part_size in CANDIDATE_PART_SIZES:
+        # 只尝试分片数吻合的大小，避免无谓地重复读文件
+        if -(-size // part_size) != part_count:
+            continue
+        if multipart_etag(file_path, part_size) == etag:
+            return True
+    return False
+
+
+def diff_against_remote(local_files, remote_index, local_md5s=None, md5_func=cached_md5):
+    """
+    比较本地文件与远端索引
+    local_files: 可迭代的 (key, 本地路径, 大小)
+    返回 (需要上传的列表, 已一致的列表)，列表元素为 (key, 路径, 原因或远端信息)
+    """
+    to_upload = []
+    unchanged = []
+    local_md5s = local_md5s or {}
+
+    for key, file_path, size in local_files:
+        remote = remote_index.get(key)
+        if remote is None:
+            to_upload.append((key, file_path, 'missing'))
+        elif remote['size'] != size:
+            to_upload.append((key, file_path, 'size'))
+        elif not etag_matches(file_path, size, remote['etag'], local_md5s.get(key), md5_func):
+            to_upload.append((key, file_path, 'etag'))
+        else:
+            unchanged.append((key, file_path, remote))
+
+    return to_upload, unchanged
+
+
+def remote_only_keys(local_keys, remote_index, prefix=''):
+    """存储桶中存在但本地没有的对象键"""
+    local_keys = set(local_keys)
+    return sorted(k for k in remote_index if k.startswith(prefix) and k not in local_keys)
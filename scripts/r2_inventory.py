@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+R2 存储桶的本地清单（SQLite）
+把存储桶中每个对象的键、大小、ETag、修改时间和 Content-Type 镜像到本地，
+清理、审计和健康检查直接查本地数据库，不必每次都通过网络列出整个存储桶
+
+刷新时先按顶层前缀（img/、pdfs/、public/ ...）分片，各分片并发分页列出；
+只有完整列出的分片才会清除其中已不存在的对象
+
+可调环境变量:
+    R2_INVENTORY    数据库路径（默认 /var/www/cuhkstudy/.r2_inventory.sqlite）
+
+用法:
+    python3 scripts/r2_inventory.py refresh [--prefix img/ pdfs/] [--content-types]
+    python3 scripts/r2_inventory.py summary
+    python3 scripts/r2_inventory.py largest [-n 20] [--prefix public/]
+    python3 scripts/r2_inventory.py missing [--prefix public/]
+"""
+
+import os
+import sys
+import time
+import queue
+import sqlite3
+import argparse
+import concurrent.futures
+
+DEFAULT_INVENTORY_PATH = os.getenv(
+    'R2_INVENTORY', '/var/www/cuhkstudy/.r2_inventory.sqlite'
+)
+BASE_DIR = '/var/www/cuhkstudy'
+DEFAULT_REFRESH_WORKERS = 8
+
+# 对象键在本地对应的位置：hugo_r2_sync 以 public/... 为键，其他脚本去掉了 public/ 前缀
+LOCAL_ROOTS = [BASE_DIR, os.path.join(BASE_DIR, 'public')]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_type TEXT,
+    seen INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_size ON objects (size);
+CREATE TABLE IF NOT EXISTS shards (
+    prefix TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL,
+    objects INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+'''
+
+
+def prefix_upper_bound(prefix):
+    """键以 prefix 开头 等价于 prefix <= key < 上界，这样范围查询可以走主键索引"""
+    return prefix + '\U0010ffff'
+
+
+class Inventory:
+    """存储桶清单；同一时间只应在一个线程中使用"""
+
+    def __init__(self, path=DEFAULT_INVENTORY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- 刷新 ----------
+
+    def refresh(self, bucket=None, prefixes=None, workers=DEFAULT_REFRESH_WORKERS,
+                content_types=False):
+        """
+        从存储桶刷新清单
+        prefixes 为空时自动发现顶层前缀并全部刷新；返回 {'objects', 'bytes', 'failed': [前缀]}
+        content_types 为 True 时对新增或ETag变化的对象发送 HEAD 获取 Content-Type
+        """
+        # 只有刷新需要网络和 boto3，查询不需要
+        from r2_client import load_config, get_client
+
+        client = get_client()
+        bucket = bucket or load_config()['bucket']
+        generation = time.time_ns()
+
+        result = {'objects': 0, 'bytes': 0, 'failed': []}
+        if prefixes is None:
+            prefixes, result['objects'], result['bytes'] = self._discover_prefixes(
+                client, bucket, generation)
+
+        pages = queue.Queue(maxsize=workers * 4)
+        done = object()
+
+        def list_shard(prefix):
+            count = total = 0
+            try:
+                paginator = client.get_paginator('list_objects_v2')
+                for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                    contents = page.get('Contents', [])
+                    count += len(contents)
+                    total += sum(obj['Size'] for obj in contents)
+                    pages.put(contents)
+            finally:
+                pages.put(done)
+            return count, total
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(list_shard, prefix): prefix for prefix in prefixes}
+
+            # 各分片的分页在主线程写入数据库，列出和写入同时进行
+            remaining = len(futures)
+            while remaining:
+                contents = pages.get()
+                if contents is done:
+                    remaining -= 1
+                    continue
+                self._upsert(contents, generation)
+
+            for future, prefix in futures.items():
+                try:
+                    count, total = future.result()
+                except Exception as e:
+                    print(f"  ❌ 列出 {prefix or '(根目录)'} 失败: {e}")
+                    result['failed'].append(prefix)
+                    continue
+                self._sweep(prefix, generation, count, total)
+                result['objects'] += count
+                result['bytes'] += total
+
+        self.db.commit()
+
+        if content_types:
+            self._fill_content_types(client, bucket, workers)
+        return result
+
+    def _discover_prefixes(self, client, bucket, generation):
+        """
+        用 Delimiter 列出顶层前缀；根目录下的对象在这里直接写入
+        返回 (前缀列表, 根目录对象数, 根目录字节数)
+        """
+        prefixes = []
+        root = []
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Delimiter='/'):
+            prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+            root.extend(page.get('Contents', []))
+
+        self._upsert(root, generation)
+        # 根目录下的对象：键中没有 '/'
+        stale = [(key,) for (key,) in self.db.execute(
+            "SELECT key FROM objects WHERE instr(key, '/') = 0 AND seen != ?", (generation,))]
+        self.db.executemany('DELETE FROM objects WHERE key = ?', stale)
+        root_bytes = sum(obj['Size'] for obj in root)
+        self.db.execute(
+            'INSERT OR REPLACE INTO shards (prefix, refreshed_at, objects, bytes) VALUES (?, ?, ?, ?)',
+            ('', time.time(), len(root), root_bytes)
+        )
+
+        # 本地有而存储桶里已经没有的顶层前缀，整个清掉
+        for (prefix,) in self.db.execute('SELECT prefix FROM shards').fetchall():
+            if prefix and prefix not in prefixes:
+                self.db.execute('DELETE FROM objects WHERE key >= ? AND key < ?',
+                                (prefix, prefix_upper_bound(prefix)))
+                self.db.execute('DELETE FROM shards WHERE prefix = ?', (prefix,))
+        return prefixes, len(root), root_bytes
+
+    def _upsert(self, contents, generation):
+        # ETag 不变时保留已获取的 Content-Type
+        self.db.executemany(
+            'INSERT INTO objects (key, size, etag, last_modified, seen) VALUES (?, ?, ?, ?, ?)'
+            ' ON CONFLICT (key) DO UPDATE SET'
+            '  content_type = CASE WHEN etag = excluded.etag THEN content_type END,'
+            '  size = excluded.size, etag = excluded.etag,'
+            '  last_modified = excluded.last_modified, seen = excluded.seen',
+            [(obj['Key'], obj['Size'], obj.get('ETag', '').strip('"'),
+              obj['LastModified'].isoformat() if obj.get('LastModified') else None,
+              generation) for obj in contents]
+        )
+
+    def _sweep(self, prefix, generation, count, total):
+        """分片完整列出后，删除其中本次未出现的对象"""
+        self.db.execute('DELETE FROM objects WHERE key >= ? AND key < ? AND seen != ?',
+                        (prefix, prefix_upper_bound(prefix), generation))
+        self.db.execute(
+            'INSERT OR REPLACE INTO shards (prefix, refreshed_at, objects, bytes) VALUES (?, ?, ?, ?)',
+            (prefix, time.time(), count, total)
+        )
+
+    def _fill_content_types(self, client, bucket, workers):
+        keys = [key for (key,) in self.db.execute(
+            'SELECT key FROM objects WHERE content_type IS NULL')]
+        if not keys:
+            return
+        print(f"  🔎 获取 {len(keys)} 个对象的 Content-Type...")
+
+        def head(key):
+            try:
+                return key, client.head_object(Bucket=bucket, Key=key).get('ContentType', '')
+            except Exception:
+                return key, None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            rows = [(content_type, key) for key, content_type in executor.map(head, keys)
+                    if content_type is not None]
+        self.db.executemany('UPDATE objects SET content_type = ? WHERE key = ?', rows)
+        self.db.commit()
+
+    def remove(self, keys):
+        """记录已从存储桶删除的对象"""
+        self.db.executemany('DELETE FROM objects WHERE key = ?', [(key,) for key in keys])
+        self.db.commit()
+
+    # ---------- 查询 ----------
+
+    def age(self):
+        """距最早一个分片刷新过去的秒数；从未刷新过返回 None"""
+        row = self.db.execute('SELECT MIN(refreshed_at) FROM shards').fetchone()
+        return time.time() - row[0] if row[0] else None
+
+    def totals(self, prefix=''):
+        """(对象数, 字节数)"""
+        return self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects WHERE key >= ? AND key < ?',
+            (prefix, prefix_upper_bound(prefix))
+        ).fetchone()
+
+    def bytes_by_prefix(self, prefix=''):
+        """prefix 下一级目录的 [(子前缀, 对象数, 字节数)]，按字节数从大到小"""
+        start = len(prefix) + 1
+        return self.db.execute(
+            'SELECT CASE WHEN instr(substr(key, ?), \'/\') > 0'
+            '            THEN substr(key, 1, ? + instr(substr(key, ?), \'/\') - 1)'
+            '            ELSE key END AS child,'
+            '       COUNT(*), SUM(size)'
+            ' FROM objects WHERE key >= ? AND key < ?'
+            ' GROUP BY child ORDER BY SUM(size) DESC',
+            (start, start, start, prefix, prefix_upper_bound(prefix))
+        ).fetchall()
+
+    def largest(self, limit=20, prefix=''):
+        """最大的对象 [(键, 大小)]"""
+        if not prefix:
+            # 走 size 索引
+            return self.db.execute(
+                'SELECT key, size FROM objects ORDER BY size DESC LIMIT ?', (limit,)
+            ).fetchall()
+        return self.db.execute(
+            'SELECT key, size FROM objects WHERE key >= ? AND key < ? ORDER BY size DESC LIMIT ?',
+            (prefix, prefix_upper_bound(prefix), limit)
+        ).fetchall()
+
+    def iter_objects(self, prefix='', batch_size=1000):
+        """
+        按键顺序逐个产出 {'key', 'size', 'etag', 'last_modified', 'content_type'}
+        按键分页查询，遍历过程中可以安全地调用 remove()
+        """
+        last = prefix
+        upper = prefix_upper_bound(prefix)
+        first = True
+        while True:
+            rows = self.db.execute(
+                'SELECT key, size, etag, last_modified, content_type FROM objects'
+                f" WHERE key {'>=' if first else '>'} ? AND key < ? ORDER BY key LIMIT ?",
+                (last, upper, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            first = False
+            for key, size, etag, last_modified, content_type in rows:
+                yield {'key': key, 'size': size, 'etag': etag,
+                       'last_modified': last_modified, 'content_type': content_type}
+            last = rows[-1][0]
+
+    def missing_locally(self, prefix='', local_roots=None):
+        """存储桶中有、但在任何 local_roots 下都找不到对应文件的对象 [(键, 大小)]"""
+        local_roots = local_roots or LOCAL_ROOTS
+        missing = []
+        for obj in self.iter_objects(prefix):
+            if not any(os.path.isfile(os.path.join(root, obj['key'])) for root in local_roots):
+                missing.append((obj['key'], obj['size']))
+        return missing
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.2f} MB"
+    return f"{size / 1024:.1f} KB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="R2 存储桶本地清单")
+    parser.add_argument('--db', default=DEFAULT_INVENTORY_PATH, help='清单数据库路径')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    refresh = sub.add_parser('refresh', help='从存储桶刷新清单')
+    refresh.add_argument('--prefix', nargs='+', default=None, help='只刷新这些前缀，默认全部')
+    refresh.add_argument('--workers', type=int, default=DEFAULT_REFRESH_WORKERS)
+    refresh.add_argument('--content-types', action='store_true',
+                         help='对新增或变化的对象发送HEAD请求获取 Content-Type')
+
+    summary = sub.add_parser('summary', help='按前缀统计')
+    summary.add_argument('--prefix', default='')
+
+    largest = sub.add_parser('largest', help='最大的对象')
+    largest.add_argument('-n', type=int, default=20)
+    largest.add_argument('--prefix', default='')
+
+    missing = sub.add_parser('missing', help='本地已不存在的对象')
+    missing.add_argument('--prefix', default='')
+
+    args = parser.parse_args()
+
+    with Inventory(args.db) as inventory:
+        if args.command == 'refresh':
+            started = time.monotonic()
+            result = inventory.refresh(prefixes=args.prefix, workers=args.workers,
+                                       content_types=args.content_types)
+            print(f"✅ 刷新 {result['objects']} 个对象（{format_size(result['bytes'])}），"
+                  f"用时 {time.monotonic() - started:.1f}s")
+            return 1 if result['failed'] else 0
+
+        age = inventory.age()
+        if age is None:
+            print("❌ 清单为空，请先运行: python3 scripts/r2_inventory.py refresh")
+            return 1
+        print(f"🗂️  清单更新于 {age / 60:.0f} 分钟前")
+
+        if args.command == 'summary':
+            count, total = inventory.totals(args.prefix)
+            print(f"📦 {args.prefix or '存储桶'}: {count} 个对象，{format_size(total)}")
+            for child, child_count, child_bytes in inventory.bytes_by_prefix(args.prefix):
+                print(f"  {format_size(child_bytes):>12}  {child_count:>7}  {child}")
+        elif args.command == 'largest':
+            for key, size in inventory.largest(args.n, args.prefix):
+                print(f"  {format_size(size):>12}  {key}")
+        elif args.command == 'missing':
+            missing = inventory.missing_locally(args.prefix)
+            for key, size in missing:
+                print(f"  {format_size(size):>12}  {key}")
+            print(f"📊 {len(missing)} 个对象在本地找不到，共 "
+                  f"{format_size(sum(size for _, size in missing))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
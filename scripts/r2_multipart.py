@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+R2 分片并发上传
+大文件切成等长分片并发上传，单个分片失败只重传该分片，
+全部完成后合并；任何分片最终失败则中止上传，避免留下残余分片
+"""
+
+import io
+import os
+import time
+import concurrent.futures
+
+from adaptive_concurrency import backoff_delay, is_retryable_error
+
+MB = 1024 * 1024
+
+# 超过该大小的文件走分片上传
+DEFAULT_THRESHOLD = 16 * MB
+# R2/S3 要求除最后一片外每片至少 5MB，且大小一致
+DEFAULT_PART_SIZE = 8 * MB
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+DEFAULT_PART_WORKERS = 4
+DEFAULT_PART_RETRIES = 4
+
+
+def plan_parts(file_size, part_size=DEFAULT_PART_SIZE):
+    """返回 [(分片号, 偏移, 长度), ...]，必要时放大分片以满足最多10000片的限制"""
+    part_size = max(part_size, MIN_PART_SIZE)
+    if file_size > part_size * MAX_PARTS:
+        part_size = -(-file_size // MAX_PARTS)
+
+    if file_size == 0:
+        return [(1, 0, 0)]
+
+    return [
+        (number, offset, min(part_size, file_size - offset))
+        for number, offset in enumerate(range(0, file_size, part_size), start=1)
+    ]
+
+
+def read_part(file_path, offset, length):
+    """读取一个分片（每次重试重新读取，不在内存中常驻整个文件）"""
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def upload_part(client, bucket, key, upload_id, file_path, part, max_retries=DEFAULT_PART_RETRIES):
+    """
+    上传一个分片，限流/5xx/网络错误时指数退避后只重传这一片，返回 (分片信息, 重试次数)
+    权限、NoSuchUpload、InvalidPart 等不可重试的错误直接失败
+    """
+    number, offset, length = part
+    attempt = 0
+    while True:
+        try:
+            body = read_part(file_path, offset, length)
+            response = client.upload_part(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=io.BytesIO(body),
+            )
+            return {'PartNumber': number, 'ETag': response['ETag']}, attempt
+        except Exception as e:
+            if not is_retryable_error(e):
+                raise
+            attempt += 1
+            if attempt > max_retries:
+                raise RuntimeError(f"分片 {number} 重试 {max_retries} 次后仍失败: {e}") from e
+            delay = backoff_delay(attempt - 1)
+            print(f"  ⚠️  {key} 分片 {number} 失败，{delay:.1f}s 后重试 ({attempt}/{max_retries}): {e}")
+            time.sleep(delay)
+
+
+def multipart_upload(client, bucket, key, file_path, extra_args=None,
+                     part_size=DEFAULT_PART_SIZE, max_workers=DEFAULT_PART_WORKERS,
+                     max_retries=DEFAULT_PART_RETRIES, stats=None, part_client=None):
+    """
+    分片并发上传单个文件，返回合并后的对象ETag
+    extra_args 与 put_object 的 ContentType/CacheControl/ACL 等参数相同
+    传入 stats 字典时把各分片的重试次数之和写入 stats['retries']
+    分片由 upload_part 自行重传，可通过 part_client 传入关闭了 botocore 重试的客户端
+    """
+    file_size = os.path.getsize(file_path)
+    parts = plan_parts(file_size, part_size)
+
+    response = client.create_multipart_upload(Bucket=bucket, Key=key, **(extra_args or {}))
+    upload_id = response['UploadId']
+
+    try:
+        completed = []
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = [
+                executor.submit(upload_part, part_client or client, bucket, key, upload_id,
+                                file_path, part, max_retries)
+                for part in parts
+            ]
+            retries = 0
+            for future in concurrent.futures.as_completed(futures):
+                part_info, attempts = future.result()
+                completed.append(part_info)
+                retries += attempts
+                if stats is not None:
+                    stats['retries'] = retries
+        finally:
+            # 有分片最终失败时不再等待排队中的分片
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        completed.sort(key=lambda p: p['PartNumber'])
+        response = client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': completed},
+        )
+        return response.get('ETag', '').strip('"') or None
+
+    except BaseException:
+        try:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            print(f"  ⚠️  中止分片上传失败 {key}: {e}")
+        raise
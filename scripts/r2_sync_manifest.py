@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+R2 同步清单
+记录每个已同步文件的大小、修改时间、内容哈希和远端ETag，
+用于增量同步：只上传新增或变更的文件，并找出本地已删除的文件
+"""
+
+import os
+import json
+
+from file_hasher import calculate_md5
+
+# 默认清单位置，可通过环境变量覆盖
+DEFAULT_MANIFEST_PATH = os.getenv(
+    'R2_SYNC_MANIFEST', '/var/www/cuhkstudy/.r2_sync_manifest.json'
+)
+MANIFEST_VERSION = 1
+
+
+class SyncManifest:
+    """以相对路径为键的本地同步清单"""
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+
+    def load(self):
+        """读取清单，文件不存在或损坏时从空清单开始"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return self
+        except (OSError, ValueError) as e:
+            print(f"⚠️  同步清单无法读取，将全量同步: {e}")
+            return self
+
+        if data.get('version') == MANIFEST_VERSION:
+            self.entries = data.get('files', {})
+        return self
+
+    def save(self):
+        """原子写入清单"""
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': self.entries},
+                      f, indent=2, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def stat_changed(self, rel_path, size, mtime):
+        """大小或mtime与清单不同（check 需要读取文件内容）"""
+        entry = self.entries.get(rel_path)
+        return not entry or entry['size'] != size or entry['mtime'] != mtime
+
+    def check(self, rel_path, file_path, md5=None):
+        """
+        判断文件是否需要上传
+        返回 (是否需要上传, 本地文件信息)；大小和mtime都未变时不读取文件内容
+        md5 可传入预先批量计算好的值
+        """
+        st = os.stat(file_path)
+        entry = self.entries.get(rel_path)
+        info = {'size': st.st_size, 'mtime': st.st_mtime}
+
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+            info['md5'] = entry['md5']
+            return False, info
+
+        info['md5'] = md5 or calculate_md5(file_path)
+        if entry and entry['size'] == st.st_size and entry['md5'] == info['md5']:
+            # 内容未变，仅刷新mtime（例如Hugo重新构建后）
+            entry['mtime'] = st.st_mtime
+            self.dirty = True
+            return False, info
+
+        return True, info
+
+    def record(self, rel_path, info, etag=None):
+        """记录一次成功的上传"""
+        self.entries[rel_path] = {
+            'size': info['size'],
+            'mtime': info['mtime'],
+            'md5': info['md5'],
+            'etag': etag,
+        }
+        self.dirty = True
+
+    def forget(self, rel_path):
+        """从清单中移除一个文件"""
+        if self.entries.pop(rel_path, None) is not None:
+            self.dirty = True
+
+    def stale_paths(self, seen_paths, prefix=''):
+        """清单中（以 prefix 开头）存在但本地已不存在的文件"""
+        return sorted(path for path in set(self.entries) - set(seen_paths)
+                      if path.startswith(prefix))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+R2 进程内并发上传引擎
+用boto3和有界线程池代替逐个文件调用 aws s3 cp / file -b 子进程
+"""
+
+import os
+import time
+import concurrent.futures
+
+from r2_client import get_client, reserve_connections
+from content_types import get_content_type
+from adaptive_concurrency import AIMDController, call_with_retry, run_adaptive, DEFAULT_RETRIES
+from r2_multipart import multipart_upload, DEFAULT_PART_SIZE, DEFAULT_THRESHOLD, DEFAULT_PART_WORKERS
+from rate_limiter import shared_limiter
+from upload_telemetry import record_result
+from cache_policy import cache_control_for
+
+DEFAULT_WORKERS = 16
+DEFAULT_ACL = 'public-read'
+
+# DeleteObjects 每次最多1000个键
+DELETE_BATCH_SIZE = 1000
+DEFAULT_DELETE_WORKERS = 4
+
+
+def make_task(file_path, key, cache_control=None, content_type=None, content_encoding=None):
+    """构造一个上传任务，未指定 cache_control 时按缓存策略（r2_cache_policy.conf）取值"""
+    return {
+        'path': file_path,
+        'key': key,
+        'cache_control': cache_control or cache_control_for(key),
+        'content_type': content_type or get_content_type(file_path),
+        'content_encoding': content_encoding,
+    }
+
+
+def upload_one(task, bucket, acl=DEFAULT_ACL, part_size=DEFAULT_PART_SIZE,
+               max_retries=DEFAULT_RETRIES, threshold=DEFAULT_THRESHOLD):
+    """上传单个文件，返回结果字典（不抛出异常）；大文件自动分片并发上传，结果计入上传遥测"""
+    file_path = task['path']
+    started = time.monotonic()
+    stats = {'retries': 0}
+    try:
+        extra = {'ContentType': task['content_type']}
+        if task.get('cache_control'):
+            extra['CacheControl'] = task['cache_control']
+        if task.get('content_encoding'):
+            extra['ContentEncoding'] = task['content_encoding']
+        if acl:
+            extra['ACL'] = acl
+
+        size = os.path.getsize(file_path)
+        if size >= threshold:
+            etag = multipart_upload(get_client(), bucket, task['key'], file_path,
+                                    extra, part_size=part_size, max_retries=max_retries,
+                                    stats=stats, part_client=get_client(retries=False))
+        else:
+            def put():
+                with open(file_path, 'rb') as f:
+                    return get_client(retries=False).put_object(
+                        Bucket=bucket, Key=task['key'], Body=f, **extra
+                    )
+            response, stats['retries'] = call_with_retry(put, max_retries, label=task['key'])
+            etag = response.get('ETag', '').strip('"') or None
+        shared_limiter().count(size, started)
+
+        result = {
+            'success': True,
+            'local_path': file_path,
+            'r2_key': task['key'],
+            'size': size,
+            'content_type': task['content_type'],
+            'etag': etag,
+            'elapsed': time.monotonic() - started,
+            'retries': stats['retries'],
+        }
+    except Exception as e:
+        result = {
+            'success': False,
+            'local_path': file_path,
+            'r2_key': task['key'],
+            'content_type': task['content_type'],
+            'error': str(e),
+            'elapsed': time.monotonic() - started,
+            'retries': stats['retries'],
+        }
+    record_result(result)
+    return result
+
+
+def describe_result(result):
+    """供 AIMDController.record 使用的 (是否成功, 耗时, 字节数, 重试次数)"""
+    return result['success'], result['elapsed'], result.get('size', 0), result['retries']
+
+
+def upload_files(tasks, bucket, max_workers=DEFAULT_WORKERS, acl=DEFAULT_ACL, on_result=None,
+                 part_size=DEFAULT_PART_SIZE, max_retries=DEFAULT_RETRIES):
+    """
+    并发上传一组任务，并发数在 1..max_workers 之间按吞吐量和错误率自适应调整
+    on_result 在调用线程中按完成顺序回调，可安全地更新清单或打印进度
+    """
+    results = []
+    if not tasks:
+        return results
+
+    # 每个大文件还有自己的分片线程，连接池按最坏情况放大
+    reserve_connections(max_workers * DEFAULT_PART_WORKERS)
+    controller = AIMDController(initial=min(8, max_workers), maximum=max_workers)
+
+    def collect(result):
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        run_adaptive(
+            tasks,
+            lambda task: executor.submit(upload_one, task, bucket, acl, part_size, max_retries),
+            controller,
+            collect,
+            describe_result,
+        )
+
+    return results
+
+
+def iter_batches(items, batch_size):
+    """把可迭代对象按 batch_size 切成列表，逐批产出（不会一次读入全部）"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def delete_batches(keys, bucket, batch_size=DELETE_BATCH_SIZE, workers=DEFAULT_DELETE_WORKERS,
+                   max_retries=DEFAULT_RETRIES):
+    """
+    流式批量删除：keys 可以是生成器（例如正在分页列出的存储桶），
+    每攒够 batch_size 个键就提交一次 DeleteObjects，最多 workers 个批次同时在途
+    逐批产出 (本批键列表, {删除失败的键: 原因})
+    """
+    client = get_client(retries=False)
+
+    def delete(batch):
+        try:
+            response, _ = call_with_retry(lambda: client.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True},
+            ), max_retries, label=f"DeleteObjects({len(batch)})")
+        except Exception as e:
+            return batch, {key: str(e) for key in batch}
+        errors = {err['Key']: err.get('Message') or err.get('Code', '')
+                  for err in response.get('Errors', [])}
+        return batch, errors
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for batch in iter_batches(keys, batch_size):
+            pending.add(executor.submit(delete, batch))
+            if len(pending) >= workers:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    yield future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+def delete_keys(keys, bucket, batch_size=DELETE_BATCH_SIZE, workers=DEFAULT_DELETE_WORKERS):
+    """批量删除对象，返回成功删除的键列表"""
+    deleted = []
+    for batch, errors in delete_batches(keys, bucket, batch_size, workers):
+        for key, reason in errors.items():
+            print(f"  ❌ 删除失败: {key} - {reason}")
+        deleted.extend(key for key in batch if key not in errors)
+    return deleted
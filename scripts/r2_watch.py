@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+R2 持续同步守护进程
+监听 public/ 和 uploads/ 的文件系统事件（Linux 上由 watchdog 使用 inotify），
+新增或修改的静态资源在几秒内上传到R2，不再需要定期全量扫描
+
+- 防抖：事件停止 DEBOUNCE 秒后才处理一批（整次 Hugo 构建只触发一次上传），
+  持续有事件时最多等待 MAX_DELAY 秒
+- 只处理命中 STATIC_ASSET_RULES 且未被 .r2ignore 排除的文件，目录整体移入时扫描该目录
+- mtime 距今不足 SETTLE 秒的文件视为仍在写入，推迟到下一批
+- 与 hugo_r2_sync 共用同步清单：启动时先按清单对照一次监听目录，
+  补上守护进程停止期间发生的变更，之后只处理事件
+- 本地删除的文件默认只提示，--delete 时同时从R2删除
+- 每批上传后更新上传遥测（自守护进程启动以来的累计分布）
+
+用法:
+    python3 scripts/r2_watch.py [--delete] [--bwlimit 2MB]
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # main() 中提示安装
+    Observer = None
+    FileSystemEventHandler = object
+
+from asset_scanner import scan, match_path, STATIC_ASSET_RULES
+from r2_sync_manifest import SyncManifest, DEFAULT_MANIFEST_PATH
+from r2_client import load_config
+from r2_uploader import delete_keys, DEFAULT_WORKERS
+from hugo_r2_sync import upload_changed
+import rate_limiter
+import upload_telemetry
+
+BASE_DIR = '/var/www/cuhkstudy'
+WATCH_DIRS = ['public', 'uploads']
+
+DEBOUNCE = 2.0
+MAX_DELAY = 30.0
+SETTLE = 1.0
+POLL_INTERVAL = 0.5
+
+
+class ChangeQueue:
+    """线程安全的待处理变更，观察者线程写入，主线程按防抖规则取出"""
+
+    def __init__(self, debounce=DEBOUNCE, max_delay=MAX_DELAY):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.changed = set()
+        self.dirs = set()
+        self.removed = set()
+        self.first = None
+        self.last = None
+
+    def add(self, kind, rel_path):
+        """kind: changed（文件）/ dirs（目录整体出现）/ removed（文件或目录消失）"""
+        now = time.monotonic()
+        with self.lock:
+            getattr(self, kind).add(rel_path)
+            if self.first is None:
+                self.first = now
+            self.last = now
+
+    def take(self, force=False):
+        """防抖时间已到（或 force）时取出全部变更 (changed, dirs, removed)，否则返回 None"""
+        now = time.monotonic()
+        with self.lock:
+            if self.first is None:
+                return None
+            if not force and now - self.last < self.debounce and now - self.first < self.max_delay:
+                return None
+            batch = (self.changed, self.dirs, self.removed)
+            self._reset()
+            return batch
+
+
+class EventHandler(FileSystemEventHandler):
+    """把 watchdog 事件换算成相对 base_dir 的路径放入队列"""
+
+    def __init__(self, queue, base_dir=BASE_DIR):
+        super().__init__()
+        self.queue = queue
+        self.base_dir = os.path.abspath(base_dir)
+
+    def rel(self, path):
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        rel_path = os.path.relpath(path, self.base_dir)
+        return None if rel_path.startswith('..') else rel_path.replace(os.sep, '/')
+
+    def on_any_event(self, event):
+        src = self.rel(event.src_path)
+        if event.event_type == 'moved':
+            if src:
+                self.queue.add('removed', src)
+            target = self.rel(event.dest_path)
+        elif event.event_type == 'deleted':
+            if src:
+                self.queue.add('removed', src)
+            return
+        elif event.event_type in ('created', 'modified', 'closed'):
+            target = src
+        else:
+            return
+
+        if not target:
+            return
+        if event.is_directory:
+            # 目录新建或移入时内部文件可能没有单独的事件，处理时扫描整个目录
+            if event.event_type in ('created', 'moved'):
+                self.queue.add('dirs', target)
+        else:
+            self.queue.add('changed', target)
+
+
+def removed_paths(removed, manifest, base_dir=BASE_DIR):
+    """清单中位于 removed（文件或目录）之下、且本地确实已不存在的路径"""
+    gone = []
+    for rel_path in manifest.entries:
+        parent = rel_path
+        while parent:
+            if parent in removed:
+                if not os.path.exists(os.path.join(base_dir, rel_path)):
+                    gone.append(rel_path)
+                break
+            parent = os.path.dirname(parent)
+    return sorted(gone)
+
+
+def delete_removed(paths, manifest, bucket, delete=False):
+    """本地已删除的文件：--delete 时从R2删除并移出清单，否则只提示"""
+    if not paths:
+        return
+    if not delete:
+        print(f"ℹ️  {len(paths)} 个文件本地已删除（如 {paths[0]}），使用 --delete 同步删除R2对象")
+        return
+    for rel_path in delete_keys(paths, bucket):
+        manifest.forget(rel_path)
+        print(f"  🗑️  {rel_path}")
+    manifest.save()
+
+
+def reconcile(manifest, bucket, base_dir=BASE_DIR, watch_dirs=WATCH_DIRS,
+              workers=DEFAULT_WORKERS, delete=False):
+    """启动时按同步清单对照一次监听目录，补上停止期间的变更"""
+    print("🔍 对照同步清单检查停机期间的变更...")
+    items = list(scan(base_dir, STATIC_ASSET_RULES, subdirs=watch_dirs))
+    uploaded, total, skipped = upload_changed(items, manifest, bucket, workers=workers)
+
+    seen = {item['rel_path'] for item in items}
+    stale = []
+    for watch_dir in watch_dirs:
+        stale.extend(manifest.stale_paths(seen, prefix=watch_dir.strip('/') + '/'))
+    delete_removed(stale, manifest, bucket, delete)
+    print(f"📊 启动对照完成: {uploaded}/{total} 个文件上传，{skipped} 个未变更")
+
+
+def process(batch, queue, manifest, bucket, base_dir=BASE_DIR, workers=DEFAULT_WORKERS,
+            delete=False):
+    """处理一批变更：上传新增/修改的资源，处理删除"""
+    changed, dirs, removed = batch
+    cache = {}
+    items = {}
+    for rel_path in changed:
+        item = match_path(base_dir, rel_path, cache=cache)
+        if item:
+            items[rel_path] = item
+    for rel_dir in dirs:
+        for item in scan(base_dir, STATIC_ASSET_RULES, subdirs=[rel_dir]):
+            items[item['rel_path']] = item
+
+    now = time.time()
+    settled = []
+    for rel_path, item in items.items():
+        if now - item['mtime'] < SETTLE:
+            # 可能仍在写入（大文件复制中），下一批再处理
+            queue.add('changed', rel_path)
+        else:
+            settled.append(item)
+
+    if settled:
+        print(f"\n📥 {time.strftime('%H:%M:%S')} 处理 {len(settled)} 个变更的资源")
+        uploaded, total, skipped = upload_changed(settled, manifest, bucket, workers=workers)
+        if total or uploaded:
+            print(f"📊 {uploaded}/{total} 个文件上传，{skipped} 个内容未变")
+
+    if removed:
+        delete_removed(removed_paths(removed, manifest, base_dir), manifest, bucket, delete)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监听 public/、uploads/ 并持续同步静态资源到R2")
+    parser.add_argument('--base-dir', default=BASE_DIR)
+    parser.add_argument('--dirs', nargs='+', default=WATCH_DIRS, help='相对 base-dir 的监听目录')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST_PATH, help='同步清单路径')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='最大并发上传线程数')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE,
+                        help='事件停止多少秒后处理一批')
+    parser.add_argument('--delete', action='store_true', help='本地删除的文件同时从R2删除')
+    parser.add_argument('--no-reconcile', action='store_true', help='启动时不对照同步清单')
+    rate_limiter.add_arguments(parser)
+    upload_telemetry.add_arguments(parser)
+    args = parser.parse_args()
+
+    if Observer is None:
+        print("❌ 需要 watchdog: pip install watchdog")
+        return 1
+
+    try:
+        limiter = rate_limiter.configure(args.bwlimit, args.bw_schedule)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    # 作为服务运行时输出被重定向，按行刷新以便日志及时可见
+    sys.stdout.reconfigure(line_buffering=True)
+
+    bucket = load_config()['bucket']
+
+    watch_dirs = [d for d in args.dirs if os.path.isdir(os.path.join(args.base_dir, d))]
+    if not watch_dirs:
+        print(f"❌ 监听目录都不存在: {', '.join(args.dirs)}")
+        return 1
+
+    manifest = SyncManifest(args.manifest).load()
+    queue = ChangeQueue(debounce=args.debounce)
+    handler = EventHandler(queue, args.base_dir)
+
+    # 先开始监听再对照清单，对照期间发生的变更不会丢失
+    observer = Observer()
+    try:
+        for watch_dir in watch_dirs:
+            observer.schedule(handler, os.path.join(args.base_dir, watch_dir), recursive=True)
+        observer.start()
+    except OSError as e:
+        print(f"❌ 无法监听目录: {e}")
+        print("   inotify 监听数不足时可调大: sysctl fs.inotify.max_user_watches=524288")
+        return 1
+    print(f"👀 监听 {', '.join(watch_dirs)}（防抖 {args.debounce:.0f}s，"
+          f"{'同步删除' if args.delete else '不删除R2对象'}，上传限速 {limiter.describe()}）")
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    telemetry = upload_telemetry.shared_telemetry()
+    recorded = 0
+
+    def write_telemetry():
+        # 只在有新的上传记录时重写，空批次不刷新文件
+        nonlocal recorded
+        if telemetry.count != recorded:
+            recorded = telemetry.count
+            upload_telemetry.write('r2_watch', args.metrics_dir, args.telemetry_json)
+
+    try:
+        if not args.no_reconcile:
+            reconcile(manifest, bucket, args.base_dir, watch_dirs, args.workers, args.delete)
+            write_telemetry()
+
+        while not stop.wait(POLL_INTERVAL):
+            batch = queue.take()
+            if batch:
+                process(batch, queue, manifest, bucket, args.base_dir, args.workers, args.delete)
+                write_telemetry()
+
+        # 退出前处理已收到的变更
+        batch = queue.take(force=True)
+        if batch:
+            process(batch, queue, manifest, bucket, args.base_dir, args.workers, args.delete)
+            write_telemetry()
+    finally:
+        observer.stop()
+        observer.join()
+        manifest.save()
+        rate_limiter.report(limiter)
+
+    print("👋 已停止监听")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
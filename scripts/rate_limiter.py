@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传带宽限制
+网站和同步任务共用服务器的出口带宽，全速上传时读者访问页面的延迟明显升高。
+所有上传线程（包括分片上传的分片线程）共用进程内一个令牌桶，总速率不会超过上限。
+r2_client 在 botocore 的 before-send 事件里包装请求体（throttle_request），
+令牌在把请求体写到连接上的那次读取时才取：botocore 在此之前为计算 MD5/校验和
+对请求体的预读不取令牌，也不会让真正的发送绕过限速；每次重试的重新发送都会计入
+
+- 速率写法: 500KB、2MB、1.5M（每秒字节数，K/M/G 以1024为底），0 或 off 表示不限速
+- 时段计划: "08:00-23:00=2MB,23:00-08:00=off"，按本地时间匹配，跨午夜的时段可以直接写；
+  不在任何时段内时使用基础上限
+- 实际速率按上传成功的对象大小统计（count()），与读取次数无关；没有设置上限时也统计
+
+可调环境变量:
+    R2_BWLIMIT        基础上限（默认不限速）
+    R2_BW_SCHEDULE    时段计划
+
+用法:
+    python3 scripts/rate_limiter.py --bwlimit 2MB --bw-schedule "08:00-23:00=2MB,23:00-08:00=off"
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+
+DEFAULT_BWLIMIT = os.getenv('R2_BWLIMIT', '')
+DEFAULT_SCHEDULE = os.getenv('R2_BW_SCHEDULE', '')
+
+# 桶容量（突发量）按这么多秒的额度计算，至少 64KB
+BURST_SECONDS = 0.25
+MIN_BURST = 64 * 1024
+
+RATE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?\s*$', re.IGNORECASE)
+WINDOW_RE = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(.+?)\s*$')
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(text):
+    """'2MB' -> 2097152；空、0、off 返回 None（不限速）"""
+    if text is None:
+        return None
+    text = str(text).strip()
+    if not text or text.lower() in ('0', 'off', 'none', 'unlimited'):
+        return None
+    match = RATE_RE.match(text)
+    if not match:
+        raise ValueError(f"无法解析的速率: {text}")
+    rate = float(match.group(1)) * UNITS[match.group(2).upper()]
+    return rate or None
+
+
+def parse_schedule(text):
+    """
+    "08:00-23:00=2MB,23:00-08:00=off" -> [(开始分钟, 结束分钟, 速率或None), ...]
+    """
+    windows = []
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        match = WINDOW_RE.match(part)
+        if not match:
+            raise ValueError(f"无法解析的时段: {part.strip()}（格式 HH:MM-HH:MM=速率）")
+        h1, m1, h2, m2, rate = match.groups()
+        start, end = int(h1) * 60 + int(m1), int(h2) * 60 + int(m2)
+        if not (0 <= start <= 24 * 60 and 0 <= end <= 24 * 60):
+            raise ValueError(f"时间超出范围: {part.strip()}")
+        windows.append((start, end, parse_rate(rate)))
+    return windows
+
+
+def format_rate(rate):
+    if not rate:
+        return '不限速'
+    if rate >= 1024 * 1024:
+        return f"{rate / 1024 / 1024:.1f}MB/s"
+    return f"{rate / 1024:.0f}KB/s"
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+    acquire(n) 预留 n 个令牌：余额不足时余额记为负数，调用者睡到自己的额度还清为止，
+    多个线程同时取令牌时按到达顺序排队，总速率不超过当前上限
+    """
+
+    def __init__(self, rate=None, schedule=None, burst=None):
+        self.base_rate = rate
+        self.schedule = schedule or []
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.bytes = 0
+            self.waited = 0.0
+            self.started = None
+            self.finished = None
+
+    def rate_at(self, moment=None):
+        """某个时刻（默认现在）的上限，None 表示不限速"""
+        local = time.localtime(moment)
+        minute = local.tm_hour * 60 + local.tm_min
+        for start, end, rate in self.schedule:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return rate
+        return self.base_rate
+
+    @property
+    def limited(self):
+        return bool(self.base_rate) or any(rate for _, _, rate in self.schedule)
+
+    def acquire(self, nbytes):
+        """取 nbytes 个令牌，必要时阻塞"""
+        while nbytes > 0:
+            with self.lock:
+                now = time.monotonic()
+                if self.started is None:
+                    self.started = now
+                rate = self.rate_at()
+                if not rate:
+                    # 不限速时余额清零，重新限速时从零开始积累
+                    self.tokens = 0.0
+                    self.updated = now
+                    return
+
+                burst = self.burst or max(rate * BURST_SECONDS, MIN_BURST)
+                self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+                self.updated = now
+                take = min(nbytes, burst)
+                self.tokens -= take
+                wait = -self.tokens / rate if self.tokens < 0 else 0.0
+                self.waited += wait
+            if wait:
+                time.sleep(wait)
+            nbytes -= take
+
+    def count(self, nbytes, started=None):
+        """记录一个上传完成的对象的大小，started 为该对象开始上传的 time.monotonic()，用于报告实际速率"""
+        with self.lock:
+            now = time.monotonic()
+            started = now if started is None else started
+            if self.started is None or started < self.started:
+                self.started = started
+            self.bytes += nbytes
+            self.finished = now
+
+    def stats(self):
+        """{'bytes', 'elapsed', 'rate', 'waited'}；rate 为第一个对象开始到最后一个对象完成之间的平均速率"""
+        with self.lock:
+            elapsed = (self.finished - self.started) if self.finished is not None else 0.0
+            return {
+                'bytes': self.bytes,
+                'elapsed': elapsed,
+                'rate': self.bytes / elapsed if elapsed > 0 else 0.0,
+                'waited': self.waited,
+            }
+
+    def describe(self):
+        parts = [format_rate(self.base_rate)]
+        for start, end, rate in self.schedule:
+            parts.append(f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d} "
+                         f"{format_rate(rate)}")
+        return '，'.join(parts)
+
+
+class ThrottledReader:
+    """包装文件对象：每次 read() 按读出的字节数取令牌，其余属性（seek/tell/fileno）透传"""
+
+    def __init__(self, fileobj, limiter):
+        self._fileobj = fileobj
+        self._limiter = limiter
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        if data:
+            self._limiter.acquire(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._fileobj.close()
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def new_limiter(bwlimit=None, schedule=None):
+    """按参数创建限速器，参数为 None 时使用环境变量"""
+    return TokenBucket(
+        parse_rate(DEFAULT_BWLIMIT if bwlimit is None else bwlimit),
+        parse_schedule(DEFAULT_SCHEDULE if schedule is None else schedule),
+    )
+
+
+def configure(bwlimit=None, schedule=None):
+    """设置进程内共享的限速器，命令行脚本在开始上传前调用一次"""
+    global _shared_limiter
+    limiter = new_limiter(bwlimit, schedule)
+    with _shared_lock:
+        _shared_limiter = limiter
+    return limiter
+
+
+def shared_limiter():
+    """进程内共享的限速器（未配置时按环境变量创建）"""
+    global _shared_limiter
+    if _shared_limiter is None:
+        with _shared_lock:
+            if _shared_limiter is None:
+                _shared_limiter = new_limiter()
+    return _shared_limiter
+
+
+def throttle(fileobj):
+    """用共享限速器包装一个将要上传的文件对象"""
+    return ThrottledReader(fileobj, shared_limiter())
+
+
+def throttle_request(request, **kwargs):
+    """
+    botocore before-send 事件处理函数：此时校验和已经算完，请求体接下来就被写到连接上，
+    用共享限速器包装流式请求体（文件、分片、aws-chunked 包装）。bytes 请求体（DeleteObjects
+    的XML等）很小，不限速。每次发送（包括重试）都重新包装，已包装过的不重复包装
+    """
+    body = request.body
+    if body is not None and hasattr(body, 'read') and not isinstance(body, ThrottledReader):
+        request.body = throttle(body)
+
+
+def add_arguments(parser):
+    """给上传脚本加上 --bwlimit / --bw-schedule 参数"""
+    parser.add_argument('--bwlimit', default=None,
+                        help='上传带宽上限，如 2MB、500KB，0 表示不限速（默认取 R2_BWLIMIT）')
+    parser.add_argument('--bw-schedule', default=None,
+                        help='按时段限速，如 "08:00-23:00=2MB,23:00-08:00=off"（默认取 R2_BW_SCHEDULE）')
+
+
+def report(limiter=None):
+    """打印实际上传速率"""
+    limiter = limiter or shared_limiter()
+    stats = limiter.stats()
+    if not stats['bytes']:
+        return stats
+    line = (f"📶 实际上传速率 {format_rate(stats['rate'])}"
+            f"（{stats['bytes'] / 1024 / 1024:.2f} MB / {stats['elapsed']:.1f}s")
+    if limiter.limited:
+        line += f"，上限 {limiter.describe()}，限速等待累计 {stats['waited']:.1f}s"
+    print(line + '）')
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查上传限速配置")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        limiter = configure(args.bwlimit, args.bw_schedule)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    print(f"⚙️  限速配置: {limiter.describe()}")
+    print(f"🕒 当前生效: {format_rate(limiter.rate_at())}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
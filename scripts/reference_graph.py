@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+站点资源引用图
+并行扫描构建好的 public/ 中所有HTML/CSS，找出每个页面引用的资源，
+再按 nginx-r2-optimized.conf 的规则判断每个引用由谁提供，并与R2存储桶清单（r2_inventory）对照:
+
+- 失效引用：本地没有、R2上也没有的资源，用户访问时会先代理到R2再得到404/503
+- 孤立对象：存储桶中没有任何页面引用到的对象，可以安全删除。被引用对象的预压缩副本
+  （.gz/.br）和图片变体（WebP/AVIF 等，见 image_optimizer 的变体清单）随原对象一起算作被引用
+- --delete-orphans 只在存储桶清单足够新时执行，清单过旧时先用 --refresh-inventory 刷新
+- 指向存储桶的绝对地址按 CDN 域名识别（R2_PUBLIC_URL、端点地址和 R2_CDN_HOSTS / --cdn-host）；
+  页面中出现无法识别域名、路径却在 pdfs/、img/ 等前缀下的绝对地址时，不删除这些前缀下的对象
+
+nginx 的取文件规则（与配置保持一致）:
+    *.pdf                 总是代理到R2，键为去掉开头 / 的路径
+    *.png / *.jpg         先找本地 public/，没有则代理到R2（同上）
+    /static/...           其他文件去掉 static/ 前缀后代理到R2
+    其他                  只从本地 public/ 提供（含 目录/index.html）
+
+用法:
+    python3 scripts/reference_graph.py [--report reference_report.json] [--delete-orphans]
+"""
+
+import os
+import sys
+import json
+import argparse
+import posixpath
+import concurrent.futures
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from asset_scanner import scan
+from hashed_assets import (
+    TEXT_RULES, extract_urls, resolve_reference, page_dir_for, read_site_host
+)
+
+PUBLIC_DIR = '/var/www/cuhkstudy/public'
+DEFAULT_REPORT_PATH = 'reference_report.json'
+
+# nginx 会代理到R2的扩展名
+R2_PROXIED_EXTENSIONS = {'.pdf'}
+R2_FALLBACK_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+
+# 即使没有被HTML/CSS引用也保留的键前缀（由JS动态加载等）
+DEFAULT_KEEP_PREFIXES = ['pdfjs/', 'public/pdfjs/']
+
+# 每个子进程一次处理的文件数
+CHUNK_SIZE = 64
+
+# 被引用对象的预压缩副本（precompress.ENCODINGS 的后缀）
+COMPRESSED_SUFFIXES = ['.gz', '.br']
+
+# 内容中直接链接存储桶对象的CDN域名（externalUrl、params.toml 中的背景图等）
+DEFAULT_CDN_HOSTS = [host.strip() for host in os.getenv(
+    'R2_CDN_HOSTS', 'cdn.cuhkstudy.com,pub-12287e23d91e4005b39b37b16efc1c42.r2.dev'
+).split(',') if host.strip()]
+
+# 课程资料和图片：指向这些前缀、域名却无法识别的绝对地址可能是存储桶对象的另一个别名
+PROTECTED_PREFIXES = ['pdfs/', 'img/', 'public/pdfs/', 'public/img/']
+
+# 存储桶清单超过这个秒数时拒绝删除孤立对象（旧清单与刚构建的 public/ 不同步，可能误删）
+DEFAULT_MAX_INVENTORY_AGE = int(os.getenv('R2_ORPHAN_MAX_INVENTORY_AGE', 3600))
+
+
+def cdn_bases(hosts=DEFAULT_CDN_HOSTS):
+    """指向存储桶的绝对地址前缀（hashed 发布、模板和内容中直接写的CDN地址）"""
+    from r2_client import load_config
+
+    config = load_config()
+    bases = {config['public_url'].rstrip('/') + '/'}
+    if config['endpoint']:
+        bases.add(f"{config['endpoint'].rstrip('/')}/{config['bucket']}/")
+    for host in hosts:
+        bases.update((f"https://{host}/", f"http://{host}/", f"//{host}/"))
+    return sorted(bases)
+
+
+def page_references(text, page_dir, site_host=None, bases=()):
+    """
+    一个页面中的引用，返回集合，元素为 ('site', 站点路径)、('key', R2对象键)
+    或 ('external', 地址)——域名无法识别、路径在 PROTECTED_PREFIXES 下的绝对地址
+    pdf.js 查看器的 ?file= 参数也算作引用
+    """
+    refs = set()
+    for url in extract_urls(text):
+        url = url.strip()
+        for base in bases:
+            if url.startswith(base):
+                refs.add(('key', unquote(urlsplit(url[len(base):]).path)))
+                break
+        else:
+            path, _ = resolve_reference(url, page_dir, site_host)
+            if path is not None:
+                refs.add(('site', path))
+            elif is_protected_url(url):
+                refs.add(('external', url))
+            for target in parse_qs(urlsplit(url).query).get('file', []):
+                path, _ = resolve_reference(target, path and posixpath.dirname(path) or page_dir,
+                                            site_host)
+                if path is not None:
+                    refs.add(('site', path))
+    return refs
+
+
+def is_protected_url(url):
+    """http(s) 或 // 开头的绝对地址，路径在 PROTECTED_PREFIXES 之下"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') and not url.startswith('//'):
+        return False
+    return unquote(parts.path).lstrip('/').startswith(tuple(PROTECTED_PREFIXES))
+
+
+def scan_chunk(items, site_host, bases):
+    """在子进程中扫描一批文本文件，返回 [(页面站点路径, 引用集合)]"""
+    results = []
+    for path, rel_path in items:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        results.append(('/' + rel_path, page_references(text, page_dir_for(rel_path),
+                                                        site_host, bases)))
+    return results
+
+
+def build_graph(public_dir=PUBLIC_DIR, site_host=None, bases=(), workers=None):
+    """并行扫描 public/ 中的HTML/CSS，返回 {('site'|'key', 目标): {引用它的页面}}"""
+    items = [(item['path'], item['rel_path']) for item in scan(public_dir, TEXT_RULES)]
+    graph = defaultdict(set)
+    chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(scan_chunk, chunk, site_host, tuple(bases)) for chunk in chunks]
+        for future in concurrent.futures.as_completed(futures):
+            for page, refs in future.result():
+                for ref in refs:
+                    graph[ref].add(page)
+
+    return graph, len(items)
+
+
+def resolve_target(site_path, local_files, r2_keys):
+    """
+    按 nginx 规则判断站点路径由谁提供
+    返回 (来源, R2键或None)；来源为 local / r2 / missing-local / missing-r2
+    """
+    rel = site_path.lstrip('/')
+    ext = posixpath.splitext(rel)[1].lower()
+    if ext not in R2_PROXIED_EXTENSIONS:
+        if rel in local_files or posixpath.join(rel, 'index.html') in local_files:
+            return 'local', None
+
+    if ext in R2_PROXIED_EXTENSIONS or ext in R2_FALLBACK_EXTENSIONS:
+        key = rel
+    elif rel.startswith('static/'):
+        key = rel[len('static/'):]
+    else:
+        return 'missing-local', None
+    return ('r2' if key in r2_keys else 'missing-r2'), key
+
+
+def derived_keys(key, variants):
+    """
+    随 key 一起发布的对象：预压缩副本和图片变体
+    variants 为 image_optimizer 变体清单 {相对 public/ 的路径: 记录}
+    """
+    derived = [key + suffix for suffix in COMPRESSED_SUFFIXES]
+    # 键与站点路径的对应：public/ 键、同名键、去掉 static/ 前缀的键（见 resolve_target）
+    prefix = 'public/' if key.startswith('public/') else ''
+    rel = key[len(prefix):]
+    for site_prefix in ('', 'static/'):
+        entry = variants.get(site_prefix + rel)
+        if entry:
+            derived += [prefix + variant['path'][len(site_prefix):]
+                        for variant in entry.get('variants', [])]
+    return derived
+
+
+def analyze(graph, local_files, r2_objects, keep_prefixes=DEFAULT_KEEP_PREFIXES, variants=None):
+    """
+    把引用图与本地文件、存储桶对象对照
+    variants 为图片变体清单，被引用图片的变体不算作孤立对象
+    返回 (失效引用列表, 孤立对象列表)
+    """
+    r2_keys = set(r2_objects)
+    dangling = []
+    referenced_keys = set()
+
+    for (kind, target), pages in graph.items():
+        if kind == 'external':
+            continue
+        if kind == 'key':
+            referenced_keys.add(target)
+            if target not in r2_keys:
+                dangling.append({'target': target, 'status': 'missing-r2', 'pages': sorted(pages)})
+            continue
+
+        rel = target.lstrip('/')
+        # 本地提供的文件在存储桶中的副本（hugo_r2_sync 的 public/ 键和去掉前缀的键）也视为被引用
+        referenced_keys.update((rel, 'public/' + rel))
+        status, key = resolve_target(target, local_files, r2_keys)
+        if key:
+            referenced_keys.add(key)
+        if status.startswith('missing'):
+            dangling.append({'target': target, 'status': status, 'pages': sorted(pages)})
+
+    for key in list(referenced_keys):
+        referenced_keys.update(derived_keys(key, variants or {}))
+
+    orphans = [
+        {'key': key, 'size': size} for key, size in sorted(r2_objects.items())
+        if key not in referenced_keys and not key.startswith(tuple(keep_prefixes))
+    ]
+    dangling.sort(key=lambda d: (-len(d['pages']), d['target']))
+    return dangling, orphans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查 public/ 的资源引用：失效引用和R2孤立对象")
+    parser.add_argument('--public-dir', default=PUBLIC_DIR)
+    parser.add_argument('--report', default=DEFAULT_REPORT_PATH, help='JSON报告路径')
+    parser.add_argument('--workers', type=int, default=None, help='扫描进程数，默认CPU核数')
+    parser.add_argument('--keep', nargs='*', default=DEFAULT_KEEP_PREFIXES,
+                        help='不算作孤立对象的键前缀')
+    parser.add_argument('--refresh-inventory', action='store_true', help='先刷新存储桶清单')
+    parser.add_argument('--delete-orphans', action='store_true', help='删除孤立对象')
+    parser.add_argument('--cdn-host', nargs='*', default=DEFAULT_CDN_HOSTS,
+                        help='内容中直接链接存储桶对象的CDN域名（默认取 R2_CDN_HOSTS）')
+    parser.add_argument('--max-inventory-age', type=int, default=DEFAULT_MAX_INVENTORY_AGE,
+                        help='删除孤立对象时允许的存储桶清单最长时间（秒）')
+    args = parser.parse_args()
+
+    from r2_inventory import Inventory, format_size
+    from image_optimizer import load_variant_manifest
+
+    if not os.path.isdir(args.public_dir):
+        print(f"❌ Hugo public目录不存在: {args.public_dir}")
+        return 1
+
+    print("🕸️  扫描 public/ 中的HTML/CSS引用...")
+    graph, page_count = build_graph(args.public_dir, read_site_host(), cdn_bases(args.cdn_host),
+                                    args.workers)
+    print(f"  📄 {page_count} 个文件，{len(graph)} 个不同的引用目标")
+    unresolved = sorted(target for kind, target in graph if kind == 'external')
+    if unresolved:
+        print(f"  ⚠️  {len(unresolved)} 个指向 {'、'.join(PROTECTED_PREFIXES)} 的绝对地址域名无法识别"
+              f"（可用 --cdn-host 添加CDN域名），如 {unresolved[0]}")
+
+    local_files = {item['rel_path'] for item in scan(args.public_dir, [{'name': 'all'}])}
+
+    with Inventory() as inventory:
+        if args.refresh_inventory or inventory.age() is None:
+            print("🗂️  刷新存储桶清单...")
+            inventory.refresh()
+        r2_objects = {obj['key']: obj['size'] for obj in inventory.iter_objects()}
+
+        dangling, orphans = analyze(graph, local_files, r2_objects, args.keep,
+                                    load_variant_manifest())
+
+        print(f"\n🔗 失效引用 {len(dangling)} 个:")
+        for item in dangling[:20]:
+            where = 'R2上不存在' if item['status'] == 'missing-r2' else '本地不存在'
+            print(f"  ❌ {item['target']}（{where}，{len(item['pages'])} 个页面，如 {item['pages'][0]}）")
+
+        orphan_bytes = sum(o['size'] for o in orphans)
+        print(f"\n🧹 孤立对象 {len(orphans)} 个，共 {format_size(orphan_bytes)}")
+        for item in sorted(orphans, key=lambda o: -o['size'])[:10]:
+            print(f"  - {item['key']} ({format_size(item['size'])})")
+
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({
+                'pages': page_count,
+                'targets': len(graph),
+                'dangling': dangling,
+                'orphans': orphans,
+                'orphan_bytes': orphan_bytes,
+                'unresolved': unresolved,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n📝 报告已写入: {args.report}")
+
+        if args.delete_orphans and orphans:
+            age = inventory.age()
+            if age is None or age > args.max_inventory_age:
+                print(f"❌ 存储桶清单已有 {(age or 0) / 60:.0f} 分钟未刷新"
+                      f"（上限 {args.max_inventory_age / 60:.0f} 分钟），与存储桶可能不一致，"
+                      f"请加 --refresh-inventory 后重试")
+                return 1
+
+            if unresolved:
+                protected = [o for o in orphans if o['key'].startswith(tuple(PROTECTED_PREFIXES))]
+                orphans = [o for o in orphans if not o['key'].startswith(tuple(PROTECTED_PREFIXES))]
+                print(f"⚠️  存在无法识别的绝对地址，保留 {len(protected)} 个 "
+                      f"{'、'.join(PROTECTED_PREFIXES)} 下的孤立对象")
+
+            from r2_client import load_config
+            from r2_uploader import delete_batches
+
+            print(f"🗑️  删除 {len(orphans)} 个孤立对象...")
+            for batch, errors in delete_batches((o['key'] for o in orphans), load_config()['bucket']):
+                inventory.remove(key for key in batch if key not in errors)
+                for key, reason in errors.items():
+                    print(f"  ❌ {key}: {reason}")
+
+    return 1 if dangling else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
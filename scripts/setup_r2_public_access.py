@@ -3,50 +3,25 @@
 设置Cloudflare R2公共访问权限
 """
 
-import boto3
 import json
 from botocore.exceptions import ClientError
 
+from r2_client import get_client, load_config
+
 def setup_r2_public_access():
     """设置R2 bucket的公共读取权限"""
     
-    # R2配置
-    endpoint_url = "https://447991a9c9d7dad31c67040315d483b2.r2.cloudflarestorage.com"
-    bucket_name = "cuhkstudy"
+    # R2配置（端点和凭据来自 .env，见 r2_client）
+    config = load_config()
+    bucket_name = config['bucket']
     
-    # 从环境变量或配置文件读取凭据
-    try:
-        with open('/root/cuhkstudy/.env', 'r') as f:
-            env_content = f.read()
-            
-        # 解析环境变量
-        env_vars = {}
-        for line in env_content.split('\n'):
-            if '=' in line and not line.startswith('#'):
-                key, value = line.split('=', 1)
-                env_vars[key] = value
-                
-        access_key = env_vars.get('R2_ADMIN_ACCESS_KEY')
-        secret_key = env_vars.get('R2_ADMIN_SECRET_KEY')
-        
-        if not access_key or not secret_key:
-            print("❌ 无法找到R2管理员凭据")
-            return False
-            
-    except Exception as e:
-        print(f"❌ 读取配置文件失败: {e}")
+    if not config['access_key'] or not config['secret_key']:
+        print("❌ 无法找到R2管理员凭据")
         return False
     
     # 创建S3客户端
     try:
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=endpoint_url,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name='auto'
-        )
-        
+        s3_client = get_client()
         print("✅ S3客户端创建成功")
         
     except Exception as e:
@@ -101,9 +76,11 @@ def test_public_access():
     """测试公共访问"""
     import requests
     
+    config = load_config()
+    base_url = f"{config['endpoint']}/{config['bucket']}"
     test_urls = [
-        "https://447991a9c9d7dad31c67040315d483b2.r2.cloudflarestorage.com/cuhkstudy/pdfs/UGFN AI GUIDE V2.1.pdf",
-        "https://447991a9c9d7dad31c67040315d483b2.r2.cloudflarestorage.com/cuhkstudy/img/CU_pic.png"
+        f"{base_url}/pdfs/UGFN AI GUIDE V2.1.pdf",
+        f"{base_url}/img/CU_pic.png"
     ]
     
     print("\n🧪 测试公共访问:")
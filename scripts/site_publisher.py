@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+保存即发布
+编辑器保存文件后把发布请求放入后台队列：
+- 一段时间内的多次保存合并为一批（最后一次保存后静默 DEBOUNCE 秒，最多等待 MAX_DELAY 秒）
+- 每批只运行一次 Hugo 构建，不使用 --cleanDestinationDir，未变化的输出保持原样
+- 构建后只把本次构建写过的静态资源交给同步清单比较，内容真正变化的才上传到R2
+  （Hugo 按原 mtime 复制的 static/ 文件不在此列，仍由 hugo_r2_sync / r2_watch 同步）
+- 在 SITE_DIR 中构建，输出直接写入 nginx 提供的 BASE_DIR/public（与 deploy.sh、hugo_r2_sync
+  相同的目录），页面保存后即上线；扫描和同步清单也基于这个目录，对象键与 hugo_r2_sync 相同
+- 每批记录从第一次保存到发布完成的延迟，供编辑器显示
+
+用法:
+    python3 scripts/site_publisher.py        # 立即构建并发布一次
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+
+SITE_DIR = '/root/cuhkstudy'
+BASE_DIR = '/var/www/cuhkstudy'
+HUGO_COMMAND = ['hugo', '--minify']
+
+DEBOUNCE = 3.0
+MAX_DELAY = 20.0
+
+# Hugo 写文件的时间戳精度和构建开始时间之间留的余量（秒）
+MTIME_SLACK = 1.0
+HISTORY_SIZE = 20
+
+# 由 nginx 直接提供、不上传R2的页面输出（只统计数量）
+PAGE_RULE = {'name': 'page', 'ext': ['.html']}
+
+
+def changed_outputs(base_dir, since):
+    """
+    base_dir/public 中本次构建写过（mtime 不早于 since）的文件
+    返回 (静态资源列表, 页面列表)，rel_path 相对 base_dir（public/ 开头）
+    """
+    from asset_scanner import scan, STATIC_ASSET_RULES
+
+    assets, pages = [], []
+    for item in scan(base_dir, STATIC_ASSET_RULES + [PAGE_RULE], subdirs=['public']):
+        if item['mtime'] >= since - MTIME_SLACK:
+            (pages if item['rule']['name'] == PAGE_RULE['name'] else assets).append(item)
+    return assets, pages
+
+
+def publish_once(site_dir=SITE_DIR, base_dir=BASE_DIR, upload=True, workers=None):
+    """
+    在 site_dir 构建到 base_dir/public 并上传变化的资源，返回结果字典:
+    {'ok', 'build_seconds', 'upload_seconds', 'uploaded', 'to_upload', 'pages', 'error'}
+    pages 为本次重新生成并已上线的HTML页面数
+    """
+    started = time.time()
+    result = {'ok': False, 'build_seconds': 0.0, 'upload_seconds': 0.0,
+              'uploaded': 0, 'to_upload': 0, 'pages': 0, 'error': None}
+
+    try:
+        build = subprocess.run(HUGO_COMMAND + ['--destination', os.path.join(base_dir, 'public')],
+                               cwd=site_dir, capture_output=True, text=True)
+    except OSError as e:
+        result['error'] = f"无法运行 Hugo: {e}"
+        return result
+    result['build_seconds'] = time.time() - started
+    if build.returncode != 0:
+        # 只保留最后几行，足够在编辑器里看出是哪个文件出错
+        result['error'] = '\n'.join((build.stderr or build.stdout).strip().splitlines()[-8:])
+        return result
+
+    items, pages = changed_outputs(base_dir, started)
+    result['pages'] = len(pages)
+
+    if upload:
+        from hugo_r2_sync import upload_changed
+        from r2_sync_manifest import SyncManifest
+        from r2_client import load_config
+        from r2_uploader import DEFAULT_WORKERS
+
+        upload_started = time.time()
+        manifest = SyncManifest().load()
+        uploaded, total, _ = upload_changed(items, manifest, load_config()['bucket'],
+                                            workers=workers or DEFAULT_WORKERS)
+        result.update(uploaded=uploaded, to_upload=total,
+                      upload_seconds=time.time() - upload_started)
+        if total:
+            from upload_telemetry import write
+            write('site_publisher')
+        if uploaded != total:
+            result['error'] = f"{total - uploaded} 个资源上传失败"
+            return result
+
+    result['ok'] = True
+    return result
+
+
+class Publisher:
+    """
+    后台发布线程
+    request() 返回本次保存的序号；status() 中 published 不小于该序号时说明这次保存已发布
+    """
+
+    def __init__(self, site_dir=SITE_DIR, base_dir=BASE_DIR, debounce=DEBOUNCE,
+                 max_delay=MAX_DELAY, upload=True):
+        self.site_dir = site_dir
+        self.base_dir = base_dir
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.upload = upload
+
+        self.cond = threading.Condition()
+        self.requested = 0
+        self.published = 0
+        self.first_request = None
+        self.last_request = None
+        self.state = 'idle'
+        self.history = []
+
+        self.thread = threading.Thread(target=self.run, name='publisher', daemon=True)
+        self.thread.start()
+
+    def request(self):
+        """登记一次保存，返回序号"""
+        now = time.time()
+        with self.cond:
+            self.requested += 1
+            if self.first_request is None:
+                self.first_request = now
+            self.last_request = now
+            self.cond.notify()
+            return self.requested
+
+    def wait_for_burst(self):
+        """阻塞到有待发布的保存且已静默 debounce 秒，返回 (目标序号, 第一次保存时间)"""
+        with self.cond:
+            while self.requested == self.published:
+                self.cond.wait()
+            self.state = 'waiting'
+            while True:
+                now = time.time()
+                remaining = min(self.last_request + self.debounce,
+                                self.first_request + self.max_delay) - now
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            target, first = self.requested, self.first_request
+            self.first_request = None
+            self.state = 'building'
+            return target, first
+
+    def run(self):
+        while True:
+            target, first = self.wait_for_burst()
+            print(f"🏗️  发布第 {self.published + 1}-{target} 次保存...")
+            try:
+                result = publish_once(self.site_dir, self.base_dir, self.upload)
+            except Exception as e:
+                result = {'ok': False, 'error': str(e), 'build_seconds': 0.0,
+                          'upload_seconds': 0.0, 'uploaded': 0, 'to_upload': 0, 'pages': 0}
+            result.update(seq=target, saves=target - self.published,
+                          latency=time.time() - first, finished_at=time.time())
+
+            with self.cond:
+                self.published = target
+                self.history.append(result)
+                del self.history[:-HISTORY_SIZE]
+                self.state = 'idle' if self.requested == self.published else 'waiting'
+
+            if result['ok']:
+                print(f"✅ 已发布（合并 {result['saves']} 次保存，构建 {result['build_seconds']:.1f}s，"
+                      f"更新 {result['pages']} 个页面，上传 {result['uploaded']} 个资源，"
+                      f"保存到上线 {result['latency']:.1f}s）")
+            else:
+                print(f"❌ 发布失败: {result['error']}")
+
+    def status(self):
+        """供编辑器轮询的状态"""
+        with self.cond:
+            return {
+                'state': self.state,
+                'requested': self.requested,
+                'published': self.published,
+                'last': self.history[-1] if self.history else None,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建Hugo站点并只上传变化的资源")
+    parser.add_argument('--site-dir', default=SITE_DIR, help='Hugo 站点源目录')
+    parser.add_argument('--base-dir', default=BASE_DIR, help='构建输出写入其中的 public/（nginx 网站目录）')
+    parser.add_argument('--no-upload', action='store_true', help='只构建，不上传到R2')
+    args = parser.parse_args()
+
+    result = publish_once(args.site_dir, args.base_dir, upload=not args.no_upload)
+    if not result['ok']:
+        print(f"❌ 发布失败: {result['error']}")
+        return 1
+    print(f"✅ 构建 {result['build_seconds']:.1f}s，更新 {result['pages']} 个页面，"
+          f"上传 {result['uploaded']} 个资源（{result['upload_seconds']:.1f}s）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,7 @@ CUHKstudy 系统健康检查脚本 v1.1
 检查所有服务、功能和配置的状态
 """
 
-import requests
+import argparse
 import subprocess
 import json
 import os
@@ -55,6 +55,8 @@ class SystemHealthChecker:
             
     def check_api_endpoints(self):
         """检查所有API端点"""
+        import requests
+        
         endpoints = {
             '/api/track': {'method': 'POST', 'data': {'url': '/test/', 'title': '健康检查'}},
             '/api/stats': {'method': 'GET'},
@@ -92,6 +94,8 @@ class SystemHealthChecker:
                 
     def check_file_access(self):
         """检查关键文件访问"""
+        import requests
+        
         files = {
             '/js/reading-tracker.js': '阅读统计脚本',
             '/img/background-hd.png': '高清背景图',
@@ -166,6 +170,8 @@ class SystemHealthChecker:
             
     def check_cdn_performance(self):
         """检查CDN性能"""
+        import requests
+        
         print("\n🚀 检查CDN性能...")
         
         # 检查R2连接
@@ -188,6 +194,43 @@ class SystemHealthChecker:
                 'error': str(e)
             }
             
+    def check_r2_inventory(self):
+        """从本地存储桶清单统计R2内容（不访问网络，清单由 r2_inventory.py refresh 更新）"""
+        from r2_inventory import Inventory, DEFAULT_INVENTORY_PATH, format_size
+        
+        print("\n🗂️ 检查R2存储桶清单...")
+        if not os.path.exists(DEFAULT_INVENTORY_PATH):
+            print("  ⚠️  没有本地清单，运行 python3 scripts/r2_inventory.py refresh 生成")
+            return
+        
+        try:
+            with Inventory(DEFAULT_INVENTORY_PATH) as inventory:
+                age = inventory.age()
+                count, total = inventory.totals()
+                prefixes = inventory.bytes_by_prefix()[:5]
+                largest = inventory.largest(5)
+                missing = inventory.missing_locally('public/')
+        except Exception as e:
+            print(f"  ❌ 读取清单失败: {e}")
+            self.results['cdn']['inventory'] = {'error': str(e)}
+            return
+        
+        print(f"  📦 {count} 个对象，{format_size(total)}"
+              f"（清单更新于 {age / 3600:.1f} 小时前）" if age is not None else "  ⚠️  清单为空")
+        for prefix, prefix_count, prefix_bytes in prefixes:
+            print(f"    {prefix}: {prefix_count} 个，{format_size(prefix_bytes)}")
+        if missing:
+            print(f"  ⚠️  public/ 下有 {len(missing)} 个对象在本地已不存在")
+        
+        self.results['cdn']['inventory'] = {
+            'age_seconds': age,
+            'objects': count,
+            'bytes': total,
+            'prefixes': [{'prefix': p, 'objects': c, 'bytes': b} for p, c, b in prefixes],
+            'largest': [{'key': k, 'bytes': b} for k, b in largest],
+            'missing_locally': len(missing)
+        }
+            
     def calculate_overall_health(self):
         """计算系统整体健康状态"""
         total_checks = 0
@@ -265,6 +308,7 @@ class SystemHealthChecker:
         self.check_file_access()
         self.check_database_health()
         self.check_cdn_performance()
+        self.check_r2_inventory()
         self.calculate_overall_health()
         
         report_path = self.generate_report()
@@ -274,7 +318,10 @@ class SystemHealthChecker:
         
         return self.results['overall_health'], report_path
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="CUHKstudy 系统健康检查")
+    parser.parse_args()
+    
     checker = SystemHealthChecker()
     health_status, report_path = checker.run_full_check()
     
@@ -286,4 +333,7 @@ if __name__ == "__main__":
         'critical': 2
     }
     
-    exit(exit_codes.get(health_status, 1))
\ No newline at end of file
+    return exit_codes.get(health_status, 1)
+
+if __name__ == "__main__":
+    exit(main())
\ No newline at end of file
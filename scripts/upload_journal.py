@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传日志（追加写入的JSON Lines）
+每个文件上传完成立即写入一行并落盘，崩溃或 Ctrl-C 后已完成的进度不会丢失；
+--resume 时跳过已确认成功的文件，最终的映射表和失败列表也从日志流式生成
+"""
+
+import os
+import json
+import time
+
+DEFAULT_JOURNAL_PATH = 'upload_journal.jsonl'
+
+
+class UploadJournal:
+    """追加写入的上传日志"""
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, resume=False):
+        self.path = path
+        self.rotated = None
+        # 非续传时开始一份新日志，旧日志改名保留，不会因为忘记 --resume 丢失续传进度
+        if not resume and os.path.exists(path) and os.path.getsize(path):
+            self.rotated = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}"
+            os.replace(path, self.rotated)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def record(self, result):
+        """写入一条结果并立即落盘"""
+        entry = dict(result, ts=time.time())
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_entries(path=DEFAULT_JOURNAL_PATH):
+    """逐行读取日志；崩溃时写了一半的最后一行会被忽略"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def completed_paths(path=DEFAULT_JOURNAL_PATH):
+    """日志中已确认上传成功的本地路径"""
+    return {e['local_path'] for e in iter_entries(path) if e.get('success')}
+
+
+def write_reports(journal_path, mapping_path, failed_path):
+    """
+    从日志流式生成映射表和失败列表，不在内存中保留全部结果
+    返回 (成功数, 失败数, 成功总字节数)
+    """
+    succeeded = completed_paths(journal_path)
+    success_count = 0
+    failed_count = 0
+    total_size = 0
+    seen = set()
+    seen_failed = set()
+
+    with open(mapping_path, 'w', encoding='utf-8') as mapping_file, \
+            open(f"{failed_path}.tmp", 'w', encoding='utf-8') as failed_file:
+        mapping_file.write('{')
+        failed_file.write('[')
+
+        for entry in iter_entries(journal_path):
+            local_path = entry['local_path']
+            if entry.get('success'):
+                if local_path in seen:
+                    continue
+                seen.add(local_path)
+                value = {
+                    'r2_key': entry['r2_key'],
+                    'public_url': entry['public_url'],
+                    'size': entry['size'],
+                    'content_type': entry['content_type'],
+                }
+                mapping_file.write(',' if success_count else '')
+                mapping_file.write(f"\n  {json.dumps(local_path, ensure_ascii=False)}: ")
+                mapping_file.write(_indent(json.dumps(value, indent=2, ensure_ascii=False)))
+                success_count += 1
+                total_size += entry['size']
+            elif local_path not in succeeded and local_path not in seen_failed:
+                seen_failed.add(local_path)
+                entry = {k: v for k, v in entry.items() if k != 'ts'}
+                failed_file.write(',' if failed_count else '')
+                failed_file.write('\n  ' + _indent(json.dumps(entry, indent=2, ensure_ascii=False)))
+                failed_count += 1
+
+        mapping_file.write('\n}' if success_count else '}')
+        failed_file.write('\n]' if failed_count else ']')
+
+    if failed_count:
+        os.replace(f"{failed_path}.tmp", failed_path)
+    else:
+        os.remove(f"{failed_path}.tmp")
+
+    return success_count, failed_count, total_size
+
+
+def _indent(text, prefix='  '):
+    """缩进除第一行外的所有行，使嵌套输出与 json.dump(indent=2) 一致"""
+    return text.replace('\n', '\n' + prefix)
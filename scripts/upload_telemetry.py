@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传遥测
+每个对象上传完成（成功或失败）时记录耗时、字节数、重试次数和结果，
+按 大小区间 × Content-Type 分组统计延迟分布，运行结束时写出:
+
+- Prometheus 文本文件（node_exporter textfile collector 读取），每个脚本一个文件，
+  内容为最近一次运行的直方图和汇总，覆盖写入（先写临时文件再改名，不会被读到一半）
+- JSON 汇总，按脚本名分项保存 p50/p95/p99，便于直接查看或比较
+
+对象数、耗时总和和直方图各档计数是精确值；分位数按每组最多 RESERVOIR_SIZE 个样本的
+蓄水池抽样计算，r2_watch 这样长期运行的进程内存占用不会随上传次数增长
+
+可调环境变量:
+    R2_TEXTFILE_DIR     文本文件目录（默认 /var/lib/node_exporter/textfile_collector，不存在时跳过）
+    R2_TELEMETRY_JSON   JSON汇总路径（默认 upload_telemetry.json）
+
+用法:
+    python3 scripts/upload_telemetry.py [--json upload_telemetry.json]   # 查看各脚本最近一次的延迟分布
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import random
+import argparse
+import threading
+from collections import defaultdict
+
+DEFAULT_TEXTFILE_DIR = os.getenv('R2_TEXTFILE_DIR', '/var/lib/node_exporter/textfile_collector')
+DEFAULT_JSON_PATH = os.getenv('R2_TELEMETRY_JSON', 'upload_telemetry.json')
+
+KB = 1024
+MB = 1024 * 1024
+
+# (标签, 上限字节数)，最后一档没有上限
+SIZE_BUCKETS = [
+    ('lt_64k', 64 * KB),
+    ('64k_1m', MB),
+    ('1m_16m', 16 * MB),
+    ('ge_16m', None),
+]
+
+# 直方图的延迟分档（秒），覆盖小图标的几十毫秒到大PDF分片上传的几分钟
+LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+QUANTILES = [0.5, 0.95, 0.99]
+
+# 每组 (大小区间, Content-Type, 结果) 保留的耗时样本数
+RESERVOIR_SIZE = 2048
+
+METRIC_PREFIX = 'r2_upload'
+
+
+def size_bucket(size):
+    for label, limit in SIZE_BUCKETS:
+        if limit is None or size < limit:
+            return label
+
+
+def percentile(samples, q):
+    """
+    最近秩法分位数，samples 为按耗时排序的 [(耗时, 权重)]
+    权重是样本代表的对象数（组内对象数 / 样本数），各组抽样比例不同时仍可合并
+    """
+    total = sum(weight for _, weight in samples)
+    if not total:
+        return 0.0
+    target = total * q
+    cumulative = 0.0
+    for value, weight in samples:
+        cumulative += weight
+        if cumulative >= target * (1 - 1e-9):
+            return value
+    return samples[-1][0]
+
+
+def latency_summary(samples, maximum=0.0):
+    samples = sorted(samples)
+    summary = {f"p{int(q * 100)}": round(percentile(samples, q), 4) for q in QUANTILES}
+    summary['max'] = round(maximum, 4)
+    return summary
+
+
+class Telemetry:
+    """线程安全的上传记录器，上传线程直接调用 record()"""
+
+    def __init__(self, reservoir_size=RESERVOIR_SIZE):
+        self.reservoir_size = reservoir_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # (大小区间, Content-Type, 结果) -> 耗时样本（蓄水池抽样，最多 reservoir_size 个）
+            self.latencies = defaultdict(list)
+            self.counts = defaultdict(int)
+            self.sums = defaultdict(float)
+            self.maxima = defaultdict(float)
+            # 每组在 LATENCY_BUCKETS 各档（最后一档为 +Inf）中的对象数，不累计
+            self.histograms = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+            self.bytes = defaultdict(int)
+            self.retries = defaultdict(int)
+            self.started = None
+            self.finished = None
+
+    def record(self, size, content_type, elapsed, retries=0, success=True):
+        content_type = (content_type or 'application/octet-stream').split(';')[0].strip()
+        group = (size_bucket(size or 0), content_type, 'success' if success else 'failure')
+        now = time.time()
+        with self.lock:
+            if self.started is None:
+                self.started = now - elapsed
+            self.finished = now
+            self.counts[group] += 1
+            self.sums[group] += elapsed
+            self.maxima[group] = max(self.maxima[group], elapsed)
+            self.histograms[group][bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            samples = self.latencies[group]
+            if len(samples) < self.reservoir_size:
+                samples.append(elapsed)
+            else:
+                index = random.randrange(self.counts[group])
+                if index < self.reservoir_size:
+                    samples[index] = elapsed
+            if success:
+                self.bytes[group] += size or 0
+            self.retries[group] += retries
+
+    def record_result(self, result):
+        """记录 upload_one / upload_single_file 返回的结果字典"""
+        size = result.get('size')
+        if size is None:
+            try:
+                size = os.path.getsize(result['local_path'])
+            except (OSError, KeyError):
+                size = 0
+        content_type = result.get('content_type')
+        if not content_type and result.get('local_path'):
+            from content_types import get_content_type
+            content_type = get_content_type(result['local_path'])
+        self.record(size, content_type, result.get('elapsed', 0.0),
+                    result.get('retries', 0), result.get('success', False))
+
+    @property
+    def count(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+    def summary(self, script=None):
+        """JSON汇总：总体、按大小区间、按 大小区间×Content-Type 的分位数"""
+        with self.lock:
+            groups = {k: list(v) for k, v in self.latencies.items()}
+            counts = dict(self.counts)
+            maxima = dict(self.maxima)
+            sizes = dict(self.bytes)
+            retries = dict(self.retries)
+            started, finished = self.started, self.finished
+
+        def collect(match):
+            keys = [k for k in groups if match(k)]
+            succeeded = [k for k in keys if k[2] == 'success']
+            samples = [(t, counts[k] / len(groups[k])) for k in succeeded for t in groups[k]]
+            entry = {
+                'objects': sum(counts[k] for k in keys),
+                'failed': sum(counts[k] for k in keys if k[2] == 'failure'),
+                'bytes': sum(sizes.get(k, 0) for k in keys),
+                'retries': sum(retries.get(k, 0) for k in keys),
+            }
+            entry.update(latency_summary(samples, max((maxima[k] for k in succeeded), default=0.0)))
+            return entry
+
+        by_size = {}
+        for label, _ in SIZE_BUCKETS:
+            if any(k[0] == label for k in groups):
+                by_size[label] = collect(lambda k, label=label: k[0] == label)
+
+        by_type = []
+        for bucket, content_type in sorted({(k[0], k[1]) for k in groups}):
+            entry = {'size_bucket': bucket, 'content_type': content_type}
+            entry.update(collect(lambda k: k[:2] == (bucket, content_type)))
+            by_type.append(entry)
+
+        return {
+            'script': script,
+            'started': started,
+            'finished': finished,
+            'wall_seconds': round(finished - started, 3) if started is not None else 0.0,
+            'overall': collect(lambda k: True),
+            'by_size_bucket': by_size,
+            'by_size_and_type': by_type,
+        }
+
+    def prometheus_text(self, script):
+        """Prometheus 文本格式：延迟直方图、分位数、字节数、对象数、重试次数"""
+        with self.lock:
+            groups = {k: sorted(v) for k, v in self.latencies.items()}
+            counts = dict(self.counts)
+            sums = dict(self.sums)
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+            sizes = dict(self.bytes)
+            retries = dict(self.retries)
+            finished = self.finished or time.time()
+
+        name = f"{METRIC_PREFIX}_duration_seconds"
+        lines = [
+            f"# HELP {name} 最近一次运行中单个对象的上传耗时",
+            f"# TYPE {name} histogram",
+        ]
+        for group, histogram in sorted(histograms.items()):
+            bucket, content_type, outcome = group
+            labels = format_labels(script=script, size_bucket=bucket,
+                                   content_type=content_type, outcome=outcome)
+            cumulative = 0
+            for le, observed in zip(LATENCY_BUCKETS, histogram):
+                cumulative += observed
+                lines.append(f"{name}_bucket{{{labels},le=\"{le}\"}} {cumulative}")
+            lines.append(f"{name}_bucket{{{labels},le=\"+Inf\"}} {counts[group]}")
+            lines.append(f"{name}_sum{{{labels}}} {sums[group]:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {counts[group]}")
+
+        name = f"{METRIC_PREFIX}_duration_quantile_seconds"
+        lines += [
+            f"# HELP {name} 最近一次运行中成功上传的耗时分位数",
+            f"# TYPE {name} gauge",
+        ]
+        for (bucket, content_type, outcome), values in sorted(groups.items()):
+            if outcome != 'success':
+                continue
+            for q in QUANTILES:
+                labels = format_labels(script=script, size_bucket=bucket,
+                                       content_type=content_type, quantile=q)
+                lines.append(f"{name}{{{labels}}} {percentile([(t, 1) for t in values], q):.6f}")
+
+        for metric, help_text, source in (
+            ('bytes', '最近一次运行成功上传的字节数', sizes),
+            ('retries', '最近一次运行的重试次数', retries),
+        ):
+            name = f"{METRIC_PREFIX}_{metric}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for (bucket, content_type, outcome), value in sorted(source.items()):
+                labels = format_labels(script=script, size_bucket=bucket,
+                                       content_type=content_type, outcome=outcome)
+                lines.append(f"{name}{{{labels}}} {value}")
+
+        name = f"{METRIC_PREFIX}_last_run_timestamp_seconds"
+        lines += [
+            f"# HELP {name} 最近一次运行写出遥测的时间",
+            f"# TYPE {name} gauge",
+            f"{name}{{{format_labels(script=script)}}} {finished:.0f}",
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(**labels):
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return ','.join(parts)
+
+
+def atomic_write(path, text):
+    """先写临时文件再改名，读取方不会看到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def load_summaries(json_path=DEFAULT_JSON_PATH):
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_shared = Telemetry()
+
+
+def shared_telemetry():
+    """进程内共享的记录器"""
+    return _shared
+
+
+def record_result(result):
+    """上传函数在返回结果前调用"""
+    _shared.record_result(result)
+
+
+def write(script, textfile_dir=None, json_path=None, telemetry=None):
+    """
+    写出文本文件和JSON汇总并打印一行延迟摘要，没有记录时什么都不做
+    返回本次的汇总字典（没有记录时为 None）
+    """
+    telemetry = telemetry or _shared
+    if not telemetry.count:
+        return None
+    textfile_dir = DEFAULT_TEXTFILE_DIR if textfile_dir is None else textfile_dir
+    json_path = DEFAULT_JSON_PATH if json_path is None else json_path
+
+    summary = telemetry.summary(script)
+    overall = summary['overall']
+    print(f"⏱️  单对象上传耗时 p50 {overall['p50']:.2f}s / p95 {overall['p95']:.2f}s / "
+          f"p99 {overall['p99']:.2f}s（{overall['objects']} 个对象，重试 {overall['retries']} 次）")
+
+    if textfile_dir:
+        if os.path.isdir(textfile_dir):
+            try:
+                atomic_write(os.path.join(textfile_dir, f"{METRIC_PREFIX}_{script}.prom"),
+                             telemetry.prometheus_text(script))
+            except OSError as e:
+                print(f"⚠️  无法写入Prometheus文本文件: {e}")
+        else:
+            print(f"ℹ️  textfile 目录不存在，跳过Prometheus指标: {textfile_dir}")
+
+    if json_path:
+        summaries = load_summaries(json_path)
+        summaries[script] = summary
+        try:
+            atomic_write(json_path, json.dumps(summaries, ensure_ascii=False, indent=2))
+        except OSError as e:
+            print(f"⚠️  无法写入遥测汇总: {e}")
+
+    return summary
+
+
+def add_arguments(parser):
+    """给上传脚本加上 --metrics-dir / --telemetry-json 参数"""
+    parser.add_argument('--metrics-dir', default=None,
+                        help='Prometheus 文本文件目录，空字符串表示不写（默认取 R2_TEXTFILE_DIR）')
+    parser.add_argument('--telemetry-json', default=None,
+                        help='遥测JSON汇总路径，空字符串表示不写（默认取 R2_TELEMETRY_JSON）')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看各上传脚本最近一次运行的延迟分布")
+    parser.add_argument('--json', default=DEFAULT_JSON_PATH, help='遥测JSON汇总路径')
+    args = parser.parse_args()
+
+    summaries = load_summaries(args.json)
+    if not summaries:
+        print(f"❌ 没有遥测记录: {args.json}")
+        return 1
+
+    for script, summary in sorted(summaries.items()):
+        finished = time.strftime('%Y-%m-%d %H:%M', time.localtime(summary['finished']))
+        overall = summary['overall']
+        print(f"\n📈 {script}（{finished}，{overall['objects']} 个对象，失败 {overall['failed']}，"
+              f"重试 {overall['retries']}）")
+        print(f"  {'大小':<8} {'Content-Type':<28} {'对象':>7} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}")
+        for entry in summary['by_size_and_type']:
+            print(f"  {entry['size_bucket']:<8} {entry['content_type']:<28} {entry['objects']:>7} "
+                  f"{entry['p50']:>8.3f} {entry['p95']:>8.3f} {entry['p99']:>8.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,98 +7,123 @@ Cloudflare R2 批量上传脚本
 
 import os
 import sys
+import argparse
+import functools
 import json
-import mimetypes
 import concurrent.futures
 from pathlib import Path
-from dotenv import load_dotenv
-import boto3
 from botocore.exceptions import ClientError
-import hashlib
 
-# 加载环境变量
-load_dotenv()
+from r2_client import load_config, get_client, reserve_connections
+from upload_journal import UploadJournal, completed_paths, write_reports, DEFAULT_JOURNAL_PATH
+from r2_uploader import make_task, upload_one, describe_result
+from adaptive_concurrency import AIMDController, run_adaptive, DEFAULT_RETRIES
+from r2_diff import load_remote_index, diff_against_remote
+from file_hasher import hash_files
+from r2_multipart import DEFAULT_PART_SIZE, DEFAULT_THRESHOLD, DEFAULT_PART_WORKERS, MB
+import rate_limiter
+import upload_telemetry
 
-# R2配置
-R2_ACCOUNT_ID = os.getenv('R2_ACCOUNT_ID')
-R2_ENDPOINT = os.getenv('R2_ENDPOINT')
-R2_BUCKET = os.getenv('R2_BUCKET')
-R2_ADMIN_ACCESS_KEY = os.getenv('R2_ADMIN_ACCESS_KEY')
-R2_ADMIN_SECRET_KEY = os.getenv('R2_ADMIN_SECRET_KEY')
+# R2配置（.env 由 r2_client 统一加载）
+R2_CONFIG = load_config()
+R2_ENDPOINT = R2_CONFIG['endpoint']
+R2_BUCKET = R2_CONFIG['bucket']
 
-def get_r2_client():
-    """创建R2 S3客户端"""
-    return boto3.client(
-        's3',
-        endpoint_url=R2_ENDPOINT,
-        aws_access_key_id=R2_ADMIN_ACCESS_KEY,
-        aws_secret_access_key=R2_ADMIN_SECRET_KEY,
-        region_name='auto'
-    )
+BASE_DIR = "/var/www/cuhkstudy"
+DEFAULT_FILES_LIST = 'files_to_upload.txt'
 
-def calculate_md5(file_path):
-    """计算文件MD5"""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+def get_r2_client():
+    """返回共享的R2客户端（所有线程共用一个连接池）"""
+    return get_client()
 
-def get_relative_key(file_path, base_path="/var/www/cuhkstudy"):
+def get_relative_key(file_path, base_path=BASE_DIR):
     """获取相对路径作为R2对象键"""
     return str(Path(file_path).relative_to(base_path))
 
-def upload_single_file(args):
-    """上传单个文件"""
-    file_path, s3_client = args
-    
+def upload_single_file(file_path, part_size=DEFAULT_PART_SIZE, multipart_threshold=DEFAULT_THRESHOLD,
+                       max_retries=DEFAULT_RETRIES, base_dir=BASE_DIR):
+    """上传单个文件（由 r2_uploader.upload_one 完成），成功时结果附带公共URL"""
     try:
-        # 获取文件信息
-        key = get_relative_key(file_path)
-        content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
-        file_size = os.path.getsize(file_path)
-        
-        print(f"上传: {file_path} -> s3://{R2_BUCKET}/{key}")
-        
-        # 上传文件
-        with open(file_path, 'rb') as f:
-            s3_client.put_object(
-                Bucket=R2_BUCKET,
-                Key=key,
-                Body=f,
-                ContentType=content_type,
-                ACL='public-read'  # 设置为公共可读
-            )
-        
-        # 生成公共URL
-        public_url = f"{R2_ENDPOINT}/{R2_BUCKET}/{key}"
-        
-        return {
-            'success': True,
-            'local_path': file_path,
-            'r2_key': key,
-            'public_url': public_url,
-            'size': file_size,
-            'content_type': content_type
-        }
-        
-    except Exception as e:
-        return {
-            'success': False,
-            'local_path': file_path,
-            'error': str(e)
-        }
+        key = get_relative_key(file_path, base_dir)
+    except ValueError as e:
+        return {'success': False, 'local_path': file_path, 'error': str(e),
+                'elapsed': 0.0, 'retries': 0}
+    
+    print(f"上传: {file_path} -> s3://{R2_BUCKET}/{key}")
+    result = upload_one(make_task(file_path, key), R2_BUCKET, part_size=part_size,
+                        max_retries=max_retries, threshold=multipart_threshold)
+    if result['success']:
+        result['public_url'] = f"{R2_ENDPOINT}/{R2_BUCKET}/{key}"
+    return result
+
+def filter_changed_files(s3_client, files_to_upload, base_dir=BASE_DIR):
+    """列出存储桶，只保留远端缺失或大小/ETag不同的文件"""
+    print("🔎 列出R2存储桶并比较ETag...")
+    remote_index = load_remote_index(s3_client, R2_BUCKET)
+    
+    local_files = []
+    for file_path in files_to_upload:
+        try:
+            local_files.append((get_relative_key(file_path, base_dir), file_path,
+                                os.path.getsize(file_path)))
+        except (OSError, ValueError) as e:
+            print(f"⚠️  跳过 {file_path}: {e}")
+    
+    # 大小与远端一致的文件才需要比较内容，并行计算MD5（带持久缓存）
+    md5s = hash_files([path for key, path, size in local_files
+                       if key in remote_index and remote_index[key]['size'] == size])
+    local_md5s = {key: md5s[path] for key, path, _ in local_files if path in md5s}
+    
+    to_upload, unchanged = diff_against_remote(local_files, remote_index, local_md5s)
+    
+    reasons = {'missing': '远端缺失', 'size': '大小不同', 'etag': '内容不同'}
+    for key, _, reason in to_upload:
+        print(f"  📝 {key}: {reasons[reason]}")
+    print(f"📊 远端 {len(remote_index)} 个对象，{len(unchanged)} 个已一致，{len(to_upload)} 个需要上传")
+    
+    return [file_path for _, file_path, _ in to_upload]
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="批量上传文件到 Cloudflare R2")
+    parser.add_argument('--part-size', type=int, default=DEFAULT_PART_SIZE // MB,
+                        help='分片大小(MB)，最小5MB')
+    parser.add_argument('--multipart-threshold', type=int, default=DEFAULT_THRESHOLD // MB,
+                        help='超过该大小(MB)的文件使用分片上传')
+    parser.add_argument('--min-workers', type=int, default=2, help='最小并发线程数')
+    parser.add_argument('--max-workers', type=int, default=32, help='最大并发线程数')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='限流/5xx/网络错误的最大重试次数')
+    parser.add_argument('--diff', action='store_true',
+                        help='与R2存储桶比较大小和ETag，只上传缺失或不同的文件')
+    parser.add_argument('--resume', action='store_true',
+                        help='从上传日志续传，跳过已确认成功的文件')
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL_PATH, help='上传日志路径')
+    parser.add_argument('--files', default=DEFAULT_FILES_LIST, help='待上传文件列表（每行一个路径）')
+    parser.add_argument('--base-dir', default=BASE_DIR, help='对象键相对的根目录')
+    rate_limiter.add_arguments(parser)
+    upload_telemetry.add_arguments(parser)
+    return parser.parse_args(argv)
 
 def main():
+    args = parse_args()
     print("🚀 开始批量上传文件到 Cloudflare R2...")
     
     # 检查环境变量
-    if not all([R2_ACCOUNT_ID, R2_ENDPOINT, R2_BUCKET, R2_ADMIN_ACCESS_KEY, R2_ADMIN_SECRET_KEY]):
+    if not all([R2_CONFIG['access_key'], R2_CONFIG['secret_key']]):
         print("❌ 缺少必要的环境变量，请检查 .env 文件")
         sys.exit(1)
     
+    try:
+        limiter = rate_limiter.configure(args.bwlimit, args.bw_schedule)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if limiter.limited:
+        print(f"🚦 上传限速: {limiter.describe()}")
+    
     # 读取文件列表
-    files_list_path = 'files_to_upload.txt'
+    files_list_path = args.files
     if not os.path.exists(files_list_path):
         print(f"❌ 找不到文件列表: {files_list_path}")
         sys.exit(1)
@@ -108,7 +133,14 @@ def main():
     
     print(f"📁 找到 {len(files_to_upload)} 个文件需要上传")
     
+    if args.resume:
+        done = completed_paths(args.journal)
+        files_to_upload = [p for p in files_to_upload if p not in done]
+        print(f"⏩ 续传: 跳过 {len(done)} 个已上传文件，剩余 {len(files_to_upload)} 个")
+    
     # 创建S3客户端
+    # 每个大文件还有 DEFAULT_PART_WORKERS 个分片线程，连接池按最坏情况放大，在创建客户端之前
+    reserve_connections(args.max_workers * DEFAULT_PART_WORKERS)
     s3_client = get_r2_client()
     
     # 测试连接
@@ -119,62 +151,65 @@ def main():
         print(f"❌ 无法连接到 R2: {e}")
         sys.exit(1)
     
-    # 并发上传
-    upload_results = []
-    failed_uploads = []
-    
-    print(f"🔄 开始上传，使用 10 个并发线程...")
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        # 为每个文件创建参数元组
-        upload_args = [(file_path, get_r2_client()) for file_path in files_to_upload]
-        
-        # 提交所有任务
-        future_to_file = {executor.submit(upload_single_file, args): args[0] for args in upload_args}
-        
-        # 处理结果
-        for future in concurrent.futures.as_completed(future_to_file):
-            result = future.result()
-            upload_results.append(result)
-            
-            if result['success']:
-                print(f"✅ {result['local_path']} -> {result['public_url']}")
-            else:
-                print(f"❌ {result['local_path']}: {result['error']}")
-                failed_uploads.append(result)
-    
-    # 生成上传映射表
-    successful_uploads = [r for r in upload_results if r['success']]
-    
-    mapping = {}
-    for result in successful_uploads:
-        mapping[result['local_path']] = {
-            'r2_key': result['r2_key'],
-            'public_url': result['public_url'],
-            'size': result['size'],
-            'content_type': result['content_type']
-        }
-    
-    # 保存结果
-    with open('upload_mapping.json', 'w', encoding='utf-8') as f:
-        json.dump(mapping, f, indent=2, ensure_ascii=False)
-    
-    # 保存失败列表
-    if failed_uploads:
-        with open('failed_uploads.json', 'w', encoding='utf-8') as f:
-            json.dump(failed_uploads, f, indent=2, ensure_ascii=False)
+    if args.diff:
+        files_to_upload = filter_changed_files(s3_client, files_to_upload, args.base_dir)
+    
+    # 自适应并发上传，每个文件完成后立即写入上传日志
+    controller = AIMDController(
+        initial=min(10, args.max_workers),
+        minimum=args.min_workers,
+        maximum=args.max_workers
+    )
+    print(f"🔄 开始上传，初始 {controller.limit} 个并发线程（{args.min_workers}-{args.max_workers} 自适应）...")
+    
+    upload = functools.partial(
+        upload_single_file,
+        part_size=args.part_size * MB,
+        multipart_threshold=args.multipart_threshold * MB,
+        max_retries=args.retries,
+        base_dir=args.base_dir
+    )
+    
+    def on_result(result):
+        journal.record(result)
+        if result['success']:
+            print(f"✅ {result['local_path']} -> {result['public_url']}")
+        else:
+            print(f"❌ {result['local_path']}: {result['error']}")
+    
+    # 在途任务数由控制器限制，内存占用与文件总数无关
+    with UploadJournal(args.journal, resume=args.resume) as journal, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        if journal.rotated:
+            print(f"🗄️  上一次的上传日志已保留为 {journal.rotated}（续传请使用 --resume）")
+        run_adaptive(
+            files_to_upload,
+            lambda file_path: executor.submit(upload, file_path),
+            controller,
+            on_result,
+            describe_result
+        )
+    
+    print(f"📈 最终并发: {controller.limit} 个线程")
+    rate_limiter.report(limiter)
+    upload_telemetry.write('upload_to_r2', args.metrics_dir, args.telemetry_json)
+    
+    # 从上传日志生成映射表和失败列表
+    success_count, failed_count, total_size = write_reports(
+        args.journal, 'upload_mapping.json', 'failed_uploads.json'
+    )
     
     # 输出统计
     print(f"\n📊 上传完成统计:")
-    print(f"   ✅ 成功: {len(successful_uploads)} 个文件")
-    print(f"   ❌ 失败: {len(failed_uploads)} 个文件")
+    print(f"   ✅ 成功: {success_count} 个文件")
+    print(f"   ❌ 失败: {failed_count} 个文件")
     print(f"   📝 映射表已保存到: upload_mapping.json")
+    print(f"   🧾 上传日志: {args.journal}（中断后可使用 --resume 续传）")
     
-    if failed_uploads:
+    if failed_count:
         print(f"   ⚠️  失败列表已保存到: failed_uploads.json")
     
     # 计算总大小
-    total_size = sum(r['size'] for r in successful_uploads)
     print(f"   📦 总上传大小: {total_size / 1024 / 1024:.2f} MB")
 
 if __name__ == "__main__":